@@ -15,6 +15,76 @@ class Settings:
     daily_limit: int
     moscow_tz: str = "Europe/Moscow"
 
+    # Дневные бюджеты токенов OpenAI (0 — без ограничения)
+    daily_token_limit: int = 30000
+    premium_daily_token_limit: int = 200000
+
+    # Локальная проверка качества фото до вызова OpenAI
+    quality_check_enabled: bool = True
+    quality_min_side: int = 320
+    quality_min_brightness: float = 40.0
+    quality_max_brightness: float = 245.0
+    quality_max_clipped: float = 0.9
+    quality_min_blur: float = 60.0
+    quality_edge_threshold: float = 40.0
+    quality_min_edge_density: float = 0.01
+
+    # Кэш ответов по номеру упражнения из подписи
+    exercise_cache_enabled: bool = True
+    exercise_cache_ttl_days: int = 30
+    exercise_cache_max_distance: int = 7  # из 64 бит dHash; печатные страницы похожи
+    exercise_cache_min_agreement: int = 2  # совпавших ответов до выдачи из кэша
+
+    # Сколько последних ответов держать в памяти для кнопки «текстом»
+    answer_cache_size: int = 512
+
+    # Антифлуд: скорость (в секунду) и размер корзины по типам апдейтов
+    flood_enabled: bool = True
+    flood_message_rate: float = 1.0
+    flood_message_burst: float = 5.0
+    flood_photo_rate: float = 0.2
+    flood_photo_burst: float = 10.0  # альбом в Telegram — до 10 фото
+    flood_callback_rate: float = 2.0
+    flood_callback_burst: float = 8.0
+    flood_premium_multiplier: float = 2.0
+    flood_max_delay: float = 2.0
+    flood_idle_ttl: float = 600.0
+    flood_notice_interval: float = 30.0  # «слишком часто» — не чаще раза в N с
+
+    # Общее состояние для нескольких реплик (FSM, антифлуд, блокировки).
+    # Пусто — всё в памяти процесса, подходит только для одного инстанса.
+    redis_url: str = ""
+
+    # Логи и трейсинг апдейтов
+    log_format: str = "json"        # json | text
+    trace_sample_rate: float = 1.0  # доля апдейтов, для которых пишем спаны
+    slow_update_ms: float = 15000.0
+    slow_log_path: str = ""         # пусто — slow-лог идёт в общий stdout
+
+    # Фоновое обслуживание БД
+    maintenance_interval: int = 3600
+    maintenance_batch_size: int = 1000
+    daily_usage_keep_days: int = 0       # 0 — храним только сегодняшний день
+    answer_compress_after_days: int = 30  # 0 — не сжимать
+
+    # Рассылки: общий темп (Telegram режет после ~30 сообщений/с) и число воркеров
+    broadcast_rate: float = 25.0
+    broadcast_workers: int = 8
+
+    # Отложенный режим «решить к утру»: задания копятся и уходят в Batch API
+    openai_base_url: str = ""          # пусто — api.openai.com
+    deferred_enabled: bool = True
+    deferred_daily_limit: int = 30     # отдельный лимит, не тратит обычный
+    deferred_cost_factor: float = 0.5  # доля токенов, списываемая из бюджета
+    deferred_batch_size: int = 200
+    deferred_min_batch: int = 20       # меньше — ждём, пока не истечёт max_wait
+    deferred_max_wait: int = 1800
+    deferred_poll_interval: int = 60
+    deferred_fake_backend: bool = False  # батчи в памяти, без OpenAI (локально)
+
+    # /debug/* эндпоинты профилирования; пусто — не регистрируются
+    profiling_token: str = ""
+
     @classmethod
     def from_env(cls) -> "Settings":
         bot_token = os.getenv("BOT_TOKEN")
@@ -35,9 +105,13 @@ class Settings:
         if not admin_id_raw:
             raise RuntimeError("ADMIN_ID is not set")
 
-        if not database_url.startswith("postgresql+asyncpg://"):
+        # PostgreSQL — основной вариант; SQLite (WAL) — для одного инстанса
+        if not database_url.startswith(
+            ("postgresql+asyncpg://", "sqlite+aiosqlite://")
+        ):
             raise RuntimeError(
-                "DATABASE_URL must start with 'postgresql+asyncpg://'"
+                "DATABASE_URL must start with 'postgresql+asyncpg://' "
+                "or 'sqlite+aiosqlite://'"
             )
 
         return cls(
@@ -49,6 +123,65 @@ class Settings:
             webhook_base_url=webhook_base_url,
             webhook_path=webhook_path,
             daily_limit=daily_limit,
+            daily_token_limit=int(os.getenv("DAILY_TOKEN_LIMIT", "30000")),
+            premium_daily_token_limit=int(
+                os.getenv("PREMIUM_DAILY_TOKEN_LIMIT", "200000")
+            ),
+            quality_check_enabled=os.getenv("QUALITY_CHECK_ENABLED", "1") == "1",
+            quality_min_side=int(os.getenv("QUALITY_MIN_SIDE", "320")),
+            quality_min_brightness=float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40")),
+            quality_max_brightness=float(os.getenv("QUALITY_MAX_BRIGHTNESS", "245")),
+            quality_max_clipped=float(os.getenv("QUALITY_MAX_CLIPPED", "0.9")),
+            quality_min_blur=float(os.getenv("QUALITY_MIN_BLUR", "60")),
+            quality_edge_threshold=float(os.getenv("QUALITY_EDGE_THRESHOLD", "40")),
+            quality_min_edge_density=float(
+                os.getenv("QUALITY_MIN_EDGE_DENSITY", "0.01")
+            ),
+            exercise_cache_enabled=os.getenv("EXERCISE_CACHE_ENABLED", "1") == "1",
+            exercise_cache_ttl_days=int(os.getenv("EXERCISE_CACHE_TTL_DAYS", "30")),
+            exercise_cache_max_distance=int(
+                os.getenv("EXERCISE_CACHE_MAX_DISTANCE", "7")
+            ),
+            exercise_cache_min_agreement=int(
+                os.getenv("EXERCISE_CACHE_MIN_AGREEMENT", "2")
+            ),
+            answer_cache_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+            flood_enabled=os.getenv("FLOOD_ENABLED", "1") == "1",
+            flood_message_rate=float(os.getenv("FLOOD_MESSAGE_RATE", "1")),
+            flood_message_burst=float(os.getenv("FLOOD_MESSAGE_BURST", "5")),
+            flood_photo_rate=float(os.getenv("FLOOD_PHOTO_RATE", "0.2")),
+            flood_photo_burst=float(os.getenv("FLOOD_PHOTO_BURST", "10")),
+            flood_callback_rate=float(os.getenv("FLOOD_CALLBACK_RATE", "2")),
+            flood_callback_burst=float(os.getenv("FLOOD_CALLBACK_BURST", "8")),
+            flood_premium_multiplier=float(
+                os.getenv("FLOOD_PREMIUM_MULTIPLIER", "2")
+            ),
+            flood_max_delay=float(os.getenv("FLOOD_MAX_DELAY", "2")),
+            flood_idle_ttl=float(os.getenv("FLOOD_IDLE_TTL", "600")),
+            flood_notice_interval=float(os.getenv("FLOOD_NOTICE_INTERVAL", "30")),
+            redis_url=os.getenv("REDIS_URL", ""),
+            log_format=os.getenv("LOG_FORMAT", "json"),
+            trace_sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1")),
+            slow_update_ms=float(os.getenv("SLOW_UPDATE_MS", "15000")),
+            slow_log_path=os.getenv("SLOW_LOG_PATH", ""),
+            maintenance_interval=int(os.getenv("MAINTENANCE_INTERVAL", "3600")),
+            maintenance_batch_size=int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000")),
+            daily_usage_keep_days=int(os.getenv("DAILY_USAGE_KEEP_DAYS", "0")),
+            answer_compress_after_days=int(
+                os.getenv("ANSWER_COMPRESS_AFTER_DAYS", "30")
+            ),
+            broadcast_rate=float(os.getenv("BROADCAST_RATE", "25")),
+            broadcast_workers=int(os.getenv("BROADCAST_WORKERS", "8")),
+            openai_base_url=os.getenv("OPENAI_BASE_URL", ""),
+            deferred_enabled=os.getenv("DEFERRED_ENABLED", "1") == "1",
+            deferred_daily_limit=int(os.getenv("DEFERRED_DAILY_LIMIT", "30")),
+            deferred_cost_factor=float(os.getenv("DEFERRED_COST_FACTOR", "0.5")),
+            deferred_batch_size=int(os.getenv("DEFERRED_BATCH_SIZE", "200")),
+            deferred_min_batch=int(os.getenv("DEFERRED_MIN_BATCH", "20")),
+            deferred_max_wait=int(os.getenv("DEFERRED_MAX_WAIT", "1800")),
+            deferred_poll_interval=int(os.getenv("DEFERRED_POLL_INTERVAL", "60")),
+            deferred_fake_backend=os.getenv("DEFERRED_FAKE_BACKEND", "0") == "1",
+            profiling_token=os.getenv("PROFILING_TOKEN", ""),
         )
 
 
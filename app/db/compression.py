@@ -0,0 +1,26 @@
+# app/db/compression.py
+import zlib
+from typing import Optional
+
+# Первый байт — кодек, чтобы позже можно было добавить zstd без миграции данных
+_ZLIB = b"z"
+
+
+def compress_answer(text: str) -> bytes:
+    return _ZLIB + zlib.compress(text.encode("utf-8"), level=9)
+
+
+def decompress_answer(blob: bytes) -> str:
+    codec, payload = blob[:1], blob[1:]
+    if codec == _ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown answer codec: {codec!r}")
+
+
+def load_answer(answer_text: Optional[str], answer_compressed: Optional[bytes]) -> str:
+    """Текст решения независимо от того, сжат он или ещё нет."""
+    if answer_text is not None:
+        return answer_text
+    if answer_compressed is not None:
+        return decompress_answer(answer_compressed)
+    return ""
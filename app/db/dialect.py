@@ -0,0 +1,58 @@
+# app/db/dialect.py
+"""
+Различия PostgreSQL и SQLite в одном месте: upsert и время с часовым поясом.
+"""
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Date, DateTime, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.types import TypeDecorator
+
+from app.config import settings
+
+IS_SQLITE = settings.database_url.startswith("sqlite")
+
+
+def insert(table):
+    """INSERT с on_conflict_do_nothing/do_update под текущую БД."""
+    if IS_SQLITE:
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+class TZDateTime(TypeDecorator):
+    """
+    timestamptz в PostgreSQL; в SQLite, где часовых поясов нет, — строка
+    в UTC. Наружу всегда отдаётся aware datetime, сравнения строк в SQLite
+    корректны, потому что все значения в одном поясе.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+def local_date(column, tz_name: str):
+    """
+    Календарная дата timestamptz-колонки в поясе tz_name (а не в UTC).
+    В SQLite поясов нет — сдвигаем UTC на текущее смещение пояса; для МСК
+    оно постоянное с 2014 года.
+    """
+    if IS_SQLITE:
+        offset = datetime.now(ZoneInfo(tz_name)).utcoffset()
+        return func.date(column, f"{int(offset.total_seconds()):+d} seconds", type_=Date)
+    return func.date(func.timezone(tz_name, column), type_=Date)
@@ -0,0 +1,95 @@
+# app/db/migrate.py
+"""
+Перенос данных между PostgreSQL и SQLite (в любую сторону):
+
+    python -m app.db.migrate SOURCE_URL TARGET_URL
+
+Например, с Postgres на локальный файл:
+    python -m app.db.migrate postgresql+asyncpg://u:p@host/db sqlite+aiosqlite:///gdz.db
+
+Схема в целевой базе создаётся по моделям, таблицы должны быть пустыми.
+Бот на время переноса лучше остановить.
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.db.models import Base
+
+# Строк за один SELECT/INSERT
+COPY_BATCH = 1000
+
+
+async def _ensure_empty(engine: AsyncEngine) -> None:
+    async with engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            count = (
+                await conn.execute(select(func.count()).select_from(table))
+            ).scalar_one()
+            if count:
+                raise SystemExit(
+                    f"В целевой базе таблица {table.name} не пуста ({count} строк)"
+                )
+
+
+async def _reset_pg_sequences(engine: AsyncEngine) -> None:
+    """После вставки с явными id последовательности надо догнать до max(id)."""
+    async with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if "id" not in table.c or not table.c.id.autoincrement:
+                continue
+            await conn.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f"coalesce(max(id), 1), max(id) IS NOT NULL) FROM {table.name}"
+                )
+            )
+
+
+async def copy_database(source_url: str, target_url: str) -> dict[str, int]:
+    source = create_async_engine(source_url)
+    target = create_async_engine(target_url)
+    copied: dict[str, int] = {}
+    try:
+        async with target.begin() as conn:
+            if target.dialect.name == "sqlite":
+                await conn.execute(text("PRAGMA journal_mode=WAL"))
+            await conn.run_sync(Base.metadata.create_all)
+        await _ensure_empty(target)
+
+        # родительские таблицы раньше зависимых — внешние ключи не мешают
+        for table in Base.metadata.sorted_tables:
+            copied[table.name] = 0
+            async with source.connect() as src, target.begin() as dst:
+                result = await src.stream(
+                    select(table)
+                    .order_by(*table.primary_key.columns)
+                    .execution_options(yield_per=COPY_BATCH)
+                )
+                async for rows in result.partitions():
+                    await dst.execute(
+                        insert(table), [dict(row._mapping) for row in rows]
+                    )
+                    copied[table.name] += len(rows)
+            print(f"{table.name}: {copied[table.name]}")
+
+        if target.dialect.name == "postgresql":
+            await _reset_pg_sequences(target)
+    finally:
+        await source.dispose()
+        await target.dispose()
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("source_url")
+    parser.add_argument("target_url")
+    args = parser.parse_args()
+    asyncio.run(copy_database(args.source_url, args.target_url))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,20 @@ from sqlalchemy import (
     Boolean,
     Column,
     Date,
-    DateTime,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
+    UniqueConstraint,
+    func,
 )
 from sqlalchemy.orm import declarative_base, relationship
 
+from app.db.compression import load_answer
+from app.db.dialect import TZDateTime
+
 Base = declarative_base()
 
 
@@ -23,20 +29,31 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     telegram_user_id = Column(BigInteger, unique=True, index=True, nullable=False)
     username = Column(String(255), nullable=True)
-    first_seen_at = Column(DateTime(timezone=True), nullable=False)
+    first_seen_at = Column(TZDateTime(), nullable=False)
     is_premium = Column(Boolean, default=False, nullable=False)
-    premium_since = Column(DateTime(timezone=True), nullable=True)
+    premium_since = Column(TZDateTime(), nullable=True)
+    deferred_mode = Column(Boolean, default=False, nullable=False)  # «к утру»
 
     tasks = relationship("Task", back_populates="user")
 
+    __table_args__ = (
+        # поиск по @username в массовой выдаче премиума
+        Index("ix_users_username_lower", func.lower(username)),
+    )
+
 
 class DailyUsage(Base):
     __tablename__ = "daily_usage"
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_daily_usage_user_date"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     date = Column(Date, nullable=False, index=True)
     used_requests = Column(Integer, nullable=False, default=0)
+    used_tokens = Column(Integer, nullable=False, default=0)
+    used_deferred = Column(Integer, nullable=False, default=0)
 
 
 class Task(Base):
@@ -44,9 +61,111 @@ class Task(Base):
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    created_at = Column(TZDateTime(), default=datetime.utcnow)
     is_premium = Column(Boolean, nullable=False, default=False)
     telegram_file_id = Column(String(255), nullable=True)
-    answer_text = Column(Text, nullable=False)
+    # Старые ответы сжимаются фоновым заданием: answer_text -> answer_compressed.
+    # Читать через Task.answer / load_answer().
+    answer_text = Column(Text, nullable=True)
+    answer_compressed = Column(LargeBinary, nullable=True)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    # Картинка-решение в Telegram: повторно шлём по file_id, без рендера
+    answer_hash = Column(String(40), nullable=True)
+    solution_file_id = Column(String(255), nullable=True)
 
     user = relationship("User", back_populates="tasks")
+
+    @property
+    def answer(self) -> str:
+        return load_answer(self.answer_text, self.answer_compressed)
+
+    __table_args__ = (
+        # «Мои решения»: keyset-пагинация по (created_at, id) внутри пользователя
+        Index(
+            "ix_tasks_user_created_id",
+            user_id,
+            created_at.desc(),
+            id.desc(),
+        ),
+        Index("ix_tasks_answer_hash", answer_hash),
+    )
+
+
+class UsageRollup(Base):
+    """Дневные агрегаты для админ-статистики, обновляются инкрементально."""
+
+    __tablename__ = "usage_rollups"
+
+    date = Column(Date, primary_key=True)
+    active_users = Column(Integer, nullable=False, default=0)
+    photos = Column(Integer, nullable=False, default=0)
+    premium_photos = Column(Integer, nullable=False, default=0)
+    cache_hits = Column(Integer, nullable=False, default=0)
+    rejected = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+
+
+class ExerciseAnswer(Base):
+    """Кэш ответов на упражнения, названные в подписи («стр 78 упр 3»)."""
+
+    __tablename__ = "exercise_answers"
+    __table_args__ = (
+        Index("ix_exercise_answers_key_created", "key", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(255), nullable=False)
+    task_id = Column(Integer, nullable=True)  # tasks.id, откуда взят ответ
+    image_hash = Column(BigInteger, nullable=False)
+    answer_text = Column(Text, nullable=False)
+    created_at = Column(TZDateTime(), nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+
+
+class Broadcast(Base):
+    """Рассылка от админа; last_user_id — чекпоинт для продолжения после рестарта."""
+
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default="running", index=True)
+    created_at = Column(TZDateTime(), nullable=False)
+    finished_at = Column(TZDateTime(), nullable=True)
+    admin_chat_id = Column(BigInteger, nullable=False)
+    progress_message_id = Column(Integer, nullable=True)
+    total = Column(Integer, nullable=False, default=0)
+    last_user_id = Column(Integer, nullable=False, default=0)  # users.id
+    delivered = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
+
+class DeferredTask(Base):
+    """Фото в отложенном режиме: ждёт батча, потом решение досылается."""
+
+    __tablename__ = "deferred_tasks"
+    __table_args__ = (
+        Index("ix_deferred_tasks_status_created", "status", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    message_id = Column(Integer, nullable=True)  # исходное фото, для reply
+    telegram_file_id = Column(String(255), nullable=False)
+    caption = Column(Text, nullable=True)
+    is_premium = Column(Boolean, nullable=False, default=False)
+    max_tokens = Column(Integer, nullable=False)
+    # pending -> submitting -> submitted -> done | failed;
+    # у done с error решение сохранено, но не дошло до пользователя
+    status = Column(String(16), nullable=False, default="pending")
+    batch_id = Column(String(64), nullable=True, index=True)
+    created_at = Column(TZDateTime(), nullable=False)
+    finished_at = Column(TZDateTime(), nullable=True)
+    task_id = Column(Integer, nullable=True)  # tasks.id готового решения
+    error = Column(Text, nullable=True)
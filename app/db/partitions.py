@@ -0,0 +1,146 @@
+# app/db/partitions.py
+"""
+Помесячное партиционирование tasks (только PostgreSQL).
+
+Разовая миграция существующей таблицы:
+    python -m app.db.partitions
+
+После неё фоновое обслуживание само заводит партиции на месяцы вперёд
+(ensure_task_partitions).
+"""
+import asyncio
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db.dialect import IS_SQLITE
+from app.db.session import engine
+
+# Сколько месяцев вперёд держать готовые партиции
+MONTHS_AHEAD = 2
+
+
+def _month_start(day: date, shift: int = 0) -> date:
+    month_index = day.year * 12 + (day.month - 1) + shift
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"tasks_y{month.year}m{month.month:02d}"
+
+
+async def is_tasks_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(
+        text("SELECT relkind FROM pg_class WHERE relname = 'tasks'")
+    )
+    return result.scalar_one_or_none() == "p"
+
+
+async def ensure_task_partitions(
+    conn: AsyncConnection,
+    today: date,
+    months_ahead: int = MONTHS_AHEAD,
+) -> list[str]:
+    """Создаёт недостающие партиции с текущего месяца на months_ahead вперёд."""
+    created: list[str] = []
+    for shift in range(months_ahead + 1):
+        start = _month_start(today, shift)
+        end = _month_start(today, shift + 1)
+        name = _partition_name(start)
+        exists = await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})
+        if exists.scalar_one_or_none() is not None:
+            continue
+        await conn.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF tasks "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        )
+        created.append(name)
+    return created
+
+
+async def partition_tasks(today: date) -> None:
+    """
+    Переводит обычную tasks в партиционированную по created_at.
+    Всё в одной транзакции: при ошибке таблица остаётся как была.
+    На время копирования tasks заблокирована — запускать в тихое время.
+    """
+    if IS_SQLITE:
+        print("Партиционирование есть только в PostgreSQL")
+        return
+
+    async with engine.begin() as conn:
+        if await is_tasks_partitioned(conn):
+            print("tasks уже партиционирована")
+            return
+
+        await conn.execute(text("LOCK TABLE tasks IN ACCESS EXCLUSIVE MODE"))
+        await conn.execute(
+            text("UPDATE tasks SET created_at = now() WHERE created_at IS NULL")
+        )
+        await conn.execute(text("ALTER TABLE tasks RENAME TO tasks_legacy"))
+        # имена индексов уникальны в схеме — освобождаем их для новой таблицы
+        await conn.execute(
+            text("ALTER INDEX IF EXISTS tasks_pkey RENAME TO tasks_legacy_pkey")
+        )
+        await conn.execute(
+            text(
+                "ALTER INDEX IF EXISTS ix_tasks_user_created_id "
+                "RENAME TO ix_tasks_legacy_user_created_id"
+            )
+        )
+        await conn.execute(
+            text(
+                "ALTER INDEX IF EXISTS ix_tasks_answer_hash "
+                "RENAME TO ix_tasks_legacy_answer_hash"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE TABLE tasks (LIKE tasks_legacy INCLUDING DEFAULTS) "
+                "PARTITION BY RANGE (created_at)"
+            )
+        )
+        # ключ партиционирования обязан входить в PK
+        await conn.execute(
+            text("ALTER TABLE tasks ALTER COLUMN created_at SET NOT NULL")
+        )
+        await conn.execute(text("ALTER TABLE tasks ADD PRIMARY KEY (id, created_at)"))
+        await conn.execute(
+            text(
+                "ALTER TABLE tasks ADD FOREIGN KEY (user_id) REFERENCES users (id)"
+            )
+        )
+        await conn.execute(
+            text(
+                "CREATE INDEX ix_tasks_user_created_id "
+                "ON tasks (user_id, created_at DESC, id DESC)"
+            )
+        )
+        await conn.execute(
+            text("CREATE INDEX ix_tasks_answer_hash ON tasks (answer_hash)")
+        )
+
+        # партиции на всю историю + запас вперёд, и default на всякий случай
+        first = (
+            await conn.execute(text("SELECT min(created_at)::date FROM tasks_legacy"))
+        ).scalar_one_or_none() or today
+        month = _month_start(first)
+        while month < _month_start(today):
+            await ensure_task_partitions(conn, month, months_ahead=0)
+            month = _month_start(month, 1)
+        await ensure_task_partitions(conn, today)
+        await conn.execute(text("CREATE TABLE tasks_default PARTITION OF tasks DEFAULT"))
+
+        await conn.execute(text("INSERT INTO tasks SELECT * FROM tasks_legacy"))
+        # последовательность id переезжает к новой таблице, иначе уйдёт вместе со старой
+        await conn.execute(text("ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id"))
+        await conn.execute(text("DROP TABLE tasks_legacy"))
+
+    print("tasks партиционирована по месяцам")
+
+
+if __name__ == "__main__":
+    asyncio.run(partition_tasks(date.today()))
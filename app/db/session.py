@@ -1,52 +1,133 @@
 # app/db/session.py
 
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator
 
-from sqlalchemy import text
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.config import settings
+from app.db.dialect import IS_SQLITE
 from app.db.models import Base
 
 
 # URL к базе, берём из настроек
 DATABASE_URL = settings.database_url
 
+# SQLite для одного инстанса: WAL — читатели не ждут писателя,
+# писатели ждут друг друга до busy_timeout вместо «database is locked»
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",   # в WAL безопасно, fsync только на чекпоинтах
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA cache_size=-16000",    # 16 МБ страничного кэша на соединение
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",  # 128 МБ — чтение без копирования в кэш
+)
+
 # Асинхронный движок SQLAlchemy
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,          # лишний шум в логах не нужен
     future=True,
+    # SQLite: одно пишущее соединение — писатели ждут в очереди пула
+    # по порядку, а не наперегонки в busy_timeout
+    **(
+        {"poolclass": AsyncAdaptedQueuePool, "pool_size": 1, "max_overflow": 0}
+        if IS_SQLITE
+        else {}
+    ),
 )
 
+if IS_SQLITE:
+    # Долгие чтения (выгрузки, обход пользователей рассылкой) — отдельный
+    # пул: в WAL они не мешают записи и не занимают пишущее соединение
+    read_engine = create_async_engine(
+        DATABASE_URL,
+        echo=False,
+        future=True,
+        poolclass=AsyncAdaptedQueuePool,
+    )
+
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        # транзакции открываем сами в "begin", а не драйвер
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    def _set_read_only_pragmas(dbapi_connection, connection_record) -> None:
+        _set_sqlite_pragmas(dbapi_connection, connection_record)
+        # read_only-сессия, которая вдруг пишет, — ошибка сразу, а не запись
+        # мимо очереди пишущего пула
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    def _begin_immediate(conn) -> None:
+        # Обычный BEGIN берёт блокировку записи только на первом UPDATE, и если
+        # кто-то успел закоммитить раньше, SQLite сразу отвечает «database is
+        # locked», не дожидаясь busy_timeout. IMMEDIATE берёт её сразу.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _begin_deferred(conn) -> None:
+        conn.exec_driver_sql("BEGIN")
+
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    event.listen(engine.sync_engine, "begin", _begin_immediate)
+    event.listen(read_engine.sync_engine, "connect", _set_read_only_pragmas)
+    event.listen(read_engine.sync_engine, "begin", _begin_deferred)
+else:
+    read_engine = engine
+
 # Фабрика сессий
 async_session_maker = async_sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )
+read_session_maker = async_sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
 
 
-# Используется в репозиториях/сервисах
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+# Используется в репозиториях/сервисах: async with get_session() as session
+@asynccontextmanager
+async def get_session(read_only: bool = False) -> AsyncGenerator[AsyncSession, None]:
+    """
+    read_only=True — для долгих SELECT'ов: в SQLite такая сессия идёт через
+    read_engine, не держит пишущее соединение и писать не может
+    (PRAGMA query_only). В PostgreSQL разницы нет.
+    """
+    maker = read_session_maker if read_only else async_session_maker
+    async with maker() as session:
         yield session
 
 
 # Вызываем при старте бота
 async def init_db() -> None:
     """
-    Создаёт таблицы и гарантирует,
-    что в таблице tasks есть колонка telegram_file_id.
+    Создаёт таблицы и докатывает колонки/индексы,
+    появившиеся после первого деплоя.
     """
     async with engine.begin() as conn:
         # создаём все таблицы по моделям
         await conn.run_sync(Base.metadata.create_all)
 
+        # SQLite поддерживается с текущей схемы — create_all её и создаёт;
+        # догоняющие ALTER'ы ниже нужны только старым базам PostgreSQL
+        if conn.dialect.name != "postgresql":
+            return
+
         # добавляем колонку для telegram_file_id, если её ещё нет
         await conn.execute(
             text(
@@ -56,3 +137,134 @@ async def init_db() -> None:
                 """
             )
         )
+
+        # учёт токенов по задачам и по дням
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE tasks
+                ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS completion_tokens INTEGER NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS cached_tokens INTEGER NOT NULL DEFAULT 0
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE daily_usage
+                ADD COLUMN IF NOT EXISTS used_tokens INTEGER NOT NULL DEFAULT 0
+                """
+            )
+        )
+
+        # массовая выдача премиума по @username
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_users_username_lower
+                ON users (lower(username))
+                """
+            )
+        )
+
+        # сжатие старых ответов (см. app/services/maintenance.py)
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE tasks
+                ADD COLUMN IF NOT EXISTS answer_compressed BYTEA,
+                ALTER COLUMN answer_text DROP NOT NULL
+                """
+            )
+        )
+
+        # история решений пользователя (keyset-пагинация)
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_tasks_user_created_id
+                ON tasks (user_id, created_at DESC, id DESC)
+                """
+            )
+        )
+
+        # отложенный режим «к утру»
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS deferred_mode BOOLEAN NOT NULL DEFAULT FALSE
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE daily_usage
+                ADD COLUMN IF NOT EXISTS used_deferred INTEGER NOT NULL DEFAULT 0
+                """
+            )
+        )
+
+        # одна строка на пользователя в день — нужно для upsert в limits.py.
+        # Старый check-then-insert мог оставить дубли: сливаем их в строку
+        # с меньшим id, иначе индекс не создастся и бот не стартует.
+        index_exists = await conn.scalar(
+            text("SELECT to_regclass('uq_daily_usage_user_date') IS NOT NULL")
+        )
+        if not index_exists:
+            await conn.execute(
+                text(
+                    """
+                    WITH dup AS (
+                        SELECT user_id, date, min(id) AS keep_id,
+                               sum(used_requests) AS used_requests,
+                               sum(used_tokens) AS used_tokens,
+                               sum(used_deferred) AS used_deferred
+                        FROM daily_usage
+                        GROUP BY user_id, date
+                        HAVING count(*) > 1
+                    ), merged AS (
+                        UPDATE daily_usage AS d
+                        SET used_requests = dup.used_requests,
+                            used_tokens = dup.used_tokens,
+                            used_deferred = dup.used_deferred
+                        FROM dup
+                        WHERE d.id = dup.keep_id
+                    )
+                    DELETE FROM daily_usage AS d
+                    USING dup
+                    WHERE d.user_id = dup.user_id
+                      AND d.date = dup.date
+                      AND d.id <> dup.keep_id
+                    """
+                )
+            )
+        await conn.execute(
+            text(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS uq_daily_usage_user_date
+                ON daily_usage (user_id, date)
+                """
+            )
+        )
+
+        # file_id картинок-решений по хэшу ответа
+        await conn.execute(
+            text(
+                """
+                ALTER TABLE tasks
+                ADD COLUMN IF NOT EXISTS answer_hash VARCHAR(40),
+                ADD COLUMN IF NOT EXISTS solution_file_id VARCHAR(255)
+                """
+            )
+        )
+        await conn.execute(
+            text(
+                """
+                CREATE INDEX IF NOT EXISTS ix_tasks_answer_hash
+                ON tasks (answer_hash)
+                """
+            )
+        )
@@ -1,2 +1,2 @@
 # app/handlers/__init__.py
-from . import start, menu, photo, profile, admin  # noqa: F401
\ No newline at end of file
+from . import start, menu, photo, profile, admin, history  # noqa: F401
\ No newline at end of file
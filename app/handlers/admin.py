@@ -1,24 +1,65 @@
 # app/handlers/admin.py
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
+from io import BytesIO
 from zoneinfo import ZoneInfo
 
 from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
+from aiogram.types import BufferedInputFile, Message, CallbackQuery
 
 from app.config import settings
-from app.db.models import User
 from app.db.session import get_session
-from app.keyboards import inline_admin_panel_keyboard, reply_main_keyboard
+from app.keyboards import (
+    inline_admin_panel_keyboard,
+    inline_broadcast_stop_keyboard,
+    reply_main_keyboard,
+)
+from app.services import exercise_cache
+from app.services.broadcast import (
+    cancel_broadcast,
+    create_broadcast,
+    progress_text,
+    set_progress_message,
+    start_broadcast,
+)
+from app.services.exercise_key import normalize_exercise_key
+from app.services.export import (
+    EXPORT_FORMATS,
+    EXPORT_TABLES,
+    TELEGRAM_DOCUMENT_LIMIT,
+    SpooledInputFile,
+    export_table,
+)
+from app.services.limits import get_token_report, report_since
+from app.services.maintenance import (
+    get_table_sizes,
+    maintenance_lock,
+    run_maintenance,
+)
+from app.services.premium import (
+    PremiumBulkResult,
+    PremiumChange,
+    parse_targets,
+    set_premium_bulk,
+)
+from app.services import solution_files
+from app.services.stats import get_rollups, rebuild_rollup
+from app.services.text_split import TELEGRAM_MESSAGE_LIMIT
 
 router = Router()
+logger = logging.getLogger(__name__)
+
+# Файл со списком ID для массовой выдачи премиума
+MAX_TARGETS_FILE_SIZE = 1024 * 1024
 
 
 class AdminStates(StatesGroup):
     waiting_user_id_give = State()
     waiting_user_id_remove = State()
+    waiting_broadcast_text = State()
 
 
 def _is_admin(user_id: int) -> bool:
@@ -45,7 +86,8 @@ async def admin_give_premium(callback: CallbackQuery, state: FSMContext):
 
     await state.set_state(AdminStates.waiting_user_id_give)
     await callback.message.answer(
-        "Введите User ID пользователя, которому нужно выдать премиум:"
+        "Введите User ID или @username пользователя, которому нужно выдать "
+        "премиум. Можно сразу списком или файлом .txt:"
     )
     await callback.answer()
 
@@ -58,39 +100,74 @@ async def admin_remove_premium(callback: CallbackQuery, state: FSMContext):
 
     await state.set_state(AdminStates.waiting_user_id_remove)
     await callback.message.answer(
-        "Введите User ID пользователя, у которого нужно снять премиум:"
+        "Введите User ID или @username пользователя, у которого нужно снять "
+        "премиум. Можно сразу списком или файлом .txt:"
     )
     await callback.answer()
 
 
-@router.message(AdminStates.waiting_user_id_give)
-async def process_give_premium(message: Message, state: FSMContext):
-    if not _is_admin(message.from_user.id):
-        return
+def _nick(change: PremiumChange) -> str:
+    return f"@{change.username}" if change.username else str(change.telegram_user_id)
 
-    try:
-        target_id = int(message.text.strip())
-    except ValueError:
-        await message.answer("Нужно отправить числовой User ID.")
+
+def _premium_report(result: PremiumBulkResult, grant: bool) -> str:
+    done = "выдан" if grant else "снят"
+    already = "уже был" if grant else "не было"
+    lines = [
+        f"Премиум {done}: {len(result.changed)}",
+        f"Премиума {already}: {len(result.unchanged)}",
+        f"Не найдены (пусть запустят /start): {len(result.not_found)}",
+        f"Не распознаны: {len(result.invalid)}",
+        "",
+    ]
+    lines += [f"✅ {_nick(c)}" for c in result.changed]
+    lines += [f"☑️ {_nick(c)} — {already}" for c in result.unchanged]
+    lines += [f"❌ {item} — не найден" for item in result.not_found]
+    lines += [f"⚠️ {item} — не ID и не @username" for item in result.invalid]
+    return "\n".join(lines)
+
+
+async def _read_targets_text(message: Message) -> str | None:
+    """Список ID/@username из текста сообщения или из присланного .txt/.csv."""
+    if message.text:
+        return message.text
+    document = message.document
+    if document is None or (document.file_size or 0) > MAX_TARGETS_FILE_SIZE:
+        return None
+    buf = BytesIO()
+    await message.bot.download(document, buf)
+    return buf.getvalue().decode("utf-8", errors="ignore")
+
+
+async def _process_premium_bulk(message: Message, state: FSMContext, grant: bool):
+    raw = await _read_targets_text(message)
+    targets = parse_targets(raw or "")
+    if not targets.ids and not targets.usernames:
+        await message.answer(
+            "Нужно отправить User ID или @username — можно списком "
+            "(через пробел, запятую или с новой строки) или файлом .txt."
+        )
         return
 
+    now_moscow = datetime.now(ZoneInfo(settings.moscow_tz))
     async with get_session() as session:
-        stmt = select(User).where(User.telegram_user_id == target_id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
-
-        if not user:
-            await message.answer(
-                "Проблема с выдачей премиума: пользователь не найден. "
-                "Пусть сначала запустит бота командой /start❌"
-            )
-        else:
-            if not user.is_premium:
-                user.is_premium = True
-                user.premium_since = datetime.now(ZoneInfo(settings.moscow_tz))
-                await session.commit()
-            nick = f"@{user.username}" if user.username else str(user.telegram_user_id)
-            await message.answer(f"Успешно выдан премиум пользователю: {nick}✅")
+        result = await set_premium_bulk(
+            session=session,
+            targets=targets,
+            grant=grant,
+            now_moscow=now_moscow,
+        )
+
+    report = _premium_report(result, grant)
+    if len(report) <= TELEGRAM_MESSAGE_LIMIT:
+        await message.answer(report, parse_mode=None)
+    else:
+        # тысячи строк — отдаём подробности файлом, в чате только итог
+        summary = report.split("\n\n", 1)[0]
+        await message.answer_document(
+            BufferedInputFile(report.encode("utf-8"), filename="premium_report.txt"),
+            caption=summary,
+        )
 
     await state.clear()
     await message.answer(
@@ -99,38 +176,327 @@ async def process_give_premium(message: Message, state: FSMContext):
     )
 
 
+@router.message(AdminStates.waiting_user_id_give)
+async def process_give_premium(message: Message, state: FSMContext):
+    if not _is_admin(message.from_user.id):
+        return
+    await _process_premium_bulk(message, state, grant=True)
+
+
 @router.message(AdminStates.waiting_user_id_remove)
 async def process_remove_premium(message: Message, state: FSMContext):
+    if not _is_admin(message.from_user.id):
+        return
+    await _process_premium_bulk(message, state, grant=False)
+
+
+@router.callback_query(F.data == "admin_token_report")
+async def admin_token_report(callback: CallbackQuery):
+    if not _is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    now_moscow = datetime.now(ZoneInfo(settings.moscow_tz))
+    async with get_session() as session:
+        rows = await get_token_report(session, since=report_since(now_moscow, 7))
+
+    if not rows:
+        await callback.message.answer("За последние 7 дней токены не тратились.")
+        await callback.answer()
+        return
+
+    lines = ["Расход токенов за 7 дней (вход / выход / из кэша):"]
+    current_day = None
+    for row in rows:
+        if row.day != current_day:
+            current_day = row.day
+            lines.append(f"\n📅 {row.day:%d.%m.%Y}")
+        nick = f"@{row.username}" if row.username else str(row.telegram_user_id)
+        lines.append(
+            f"{nick}: {row.tasks} фото, "
+            f"{row.prompt_tokens} / {row.completion_tokens} / {row.cached_tokens}"
+        )
+
+    await callback.message.answer("\n".join(lines))
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin_exercise_cache")
+async def admin_exercise_cache(callback: CallbackQuery):
+    if not _is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    async with get_session() as session:
+        entries = await exercise_cache.count_entries(session)
+
+    st = exercise_cache.stats
+    sf = solution_files.stats
+    await callback.message.answer(
+        "Кэш упражнений (с момента запуска):\n"
+        f"Запросов с номером: {st.lookups}\n"
+        f"Попаданий: {st.hits} ({st.hit_rate:.0%})\n"
+        f"Нет ответов по ключу: {st.key_misses}\n"
+        f"Фото не совпало: {st.image_mismatches}\n"
+        f"Ответы ещё не сошлись: {st.unconfirmed}\n"
+        f"Сохранено: {st.stored}, удалено: {st.invalidated}\n"
+        f"Записей в базе: {entries}\n\n"
+        "Картинки решений:\n"
+        f"Отрендерено: {sf.renders}, загружено: {sf.uploads} "
+        f"({_mb(sf.upload_bytes)})\n"
+        f"Отправлено по file_id: {sf.reuses} (устаревших: {sf.stale})\n"
+        f"Сэкономлено: ~{sf.saved_render_seconds:.1f} с рендера, "
+        f"~{_mb(sf.saved_upload_bytes)} загрузки\n\n"
+        "Сбросить: /cache_drop стр 78 упр 3 — по подписи, "
+        "/cache_drop expired — просроченные, /cache_drop all — всё."
+    )
+    await callback.answer()
+
+
+@router.message(Command("cache_drop"))
+async def admin_cache_drop(message: Message, command: CommandObject):
+    if not _is_admin(message.from_user.id):
+        return
+
+    arg = (command.args or "").strip()
+    if not arg:
+        await message.answer("Укажи подпись упражнения, expired или all.")
+        return
+
+    now_moscow = datetime.now(ZoneInfo(settings.moscow_tz))
+    async with get_session() as session:
+        if arg == "all":
+            removed = await exercise_cache.invalidate(session)
+        elif arg == "expired":
+            removed = await exercise_cache.purge_expired(session, now_moscow)
+        else:
+            # можно прислать и подпись, и готовый ключ вида p=78|ex=3
+            key = arg if "ex=" in arg else normalize_exercise_key(arg)
+            if key is None:
+                await message.answer("Не нашёл номер упражнения в подписи❌")
+                return
+            removed = await exercise_cache.invalidate(session, key)
+
+    await message.answer(f"Удалено записей из кэша: {removed}✅")
+
+
+@router.message(Command("flood_stats"))
+async def admin_flood_stats(message: Message, throttling=None):
+    if not _is_admin(message.from_user.id):
+        return
+    if throttling is None:
+        await message.answer("Антифлуд выключен.")
+        return
+
+    st = throttling.stats
+    lines = ["Антифлуд (с момента запуска), пропущено / задержано / отброшено:"]
+    for kind in throttling.rules:
+        lines.append(
+            f"{kind}: {st.passed.get(kind, 0)} / "
+            f"{st.delayed.get(kind, 0)} / {st.dropped.get(kind, 0)}"
+        )
+    await message.answer("\n".join(lines))
+
+
+def _percent(part: int, total: int) -> str:
+    return f"{part / total:.0%}" if total else "—"
+
+
+@router.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: CallbackQuery):
+    if not _is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    today = datetime.now(ZoneInfo(settings.moscow_tz)).date()
+    async with get_session() as session:
+        rollups = await get_rollups(session, today=today, days=7)
+
+    if not rollups:
+        await callback.message.answer("Статистики за последние 7 дней пока нет.")
+        await callback.answer()
+        return
+
+    lines = ["Статистика за 7 дней:"]
+    for row in rollups:
+        attempts = row.photos + row.errors
+        lines.append(
+            f"\n📅 {row.date:%d.%m.%Y}\n"
+            f"Активных: {row.active_users}, фото: {row.photos}\n"
+            f"Премиум: {_percent(row.premium_photos, row.photos)}, "
+            f"из кэша: {_percent(row.cache_hits, row.photos)}\n"
+            f"Ошибок: {row.errors} ({_percent(row.errors, attempts)}), "
+            f"отклонено фото: {row.rejected}\n"
+            f"Токены: {row.prompt_tokens} / {row.completion_tokens}"
+        )
+    lines.append("\nПересчитать день из tasks: /stats_rebuild ДД.ММ.ГГГГ")
+    await callback.message.answer("\n".join(lines))
+    await callback.answer()
+
+
+@router.message(Command("stats_rebuild"))
+async def admin_stats_rebuild(message: Message, command: CommandObject):
     if not _is_admin(message.from_user.id):
         return
 
     try:
-        target_id = int(message.text.strip())
+        day = datetime.strptime((command.args or "").strip(), "%d.%m.%Y").date()
     except ValueError:
-        await message.answer("Нужно отправить числовой User ID.")
+        await message.answer("Формат: /stats_rebuild 19.10.2026")
         return
 
     async with get_session() as session:
-        stmt = select(User).where(User.telegram_user_id == target_id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
-
-        if not user or not user.is_premium:
-            await message.answer(
-                "Снятие не завершено. Возможно, пользователь не зарегистрирован "
-                "в боте или у него не было премиума❌"
+        row = await rebuild_rollup(session, day)
+
+    await message.answer(
+        f"Пересчитано за {day:%d.%m.%Y}: активных {row.active_users}, "
+        f"фото {row.photos}✅"
+    )
+
+
+def _mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+
+EXPORT_USAGE = (
+    "Формат: /export tasks|users|daily_usage 01.10.2026 19.10.2026 [csv|jsonl]\n"
+    "Без дат — за последние 7 дней."
+)
+
+
+@router.message(Command("export"))
+async def admin_export(message: Message, command: CommandObject):
+    if not _is_admin(message.from_user.id):
+        return
+
+    args = (command.args or "").split()
+    fmt = "csv"
+    if args and args[-1].lower() in EXPORT_FORMATS:
+        fmt = args.pop().lower()
+    if not args or args[0] not in EXPORT_TABLES or len(args) not in (1, 3):
+        await message.answer(EXPORT_USAGE)
+        return
+
+    table = args[0]
+    today = datetime.now(ZoneInfo(settings.moscow_tz)).date()
+    if len(args) == 3:
+        try:
+            start_day = datetime.strptime(args[1], "%d.%m.%Y").date()
+            end_day = datetime.strptime(args[2], "%d.%m.%Y").date()
+        except ValueError:
+            await message.answer(EXPORT_USAGE)
+            return
+    else:
+        start_day, end_day = today - timedelta(days=6), today
+
+    status = await message.answer("Выгружаю… ⏳")
+    try:
+        result = await export_table(table, start_day, end_day, fmt)
+    except Exception:
+        await status.edit_text(f"❌ Не удалось выгрузить {table}, подробности в логах.")
+        logger.exception("export failed", extra={"stage": "export", "table": table})
+        return
+    try:
+        summary = (
+            f"{table}: {result.rows} строк за {result.seconds:.1f} с, "
+            f"{_mb(result.raw_bytes)} → {_mb(result.compressed_bytes)} gzip"
+        )
+        if result.compressed_bytes > TELEGRAM_DOCUMENT_LIMIT:
+            await status.edit_text(
+                f"{summary}\nФайл больше 50 МБ — Telegram его не примет, "
+                "сократи период."
             )
-        else:
-            user.is_premium = False
-            user.premium_since = None
-            await session.commit()
-            nick = f"@{user.username}" if user.username else str(user.telegram_user_id)
-            await message.answer(
-                f"Снятие премиума было успешно закончено✅\nПользователь: {nick}"
+            return
+        try:
+            await message.answer_document(
+                SpooledInputFile(result.file, filename=result.filename),
+                caption=summary,
+            )
+        except Exception:
+            await status.edit_text(f"{summary}\n❌ Не смог отправить файл.")
+            logger.exception(
+                "export send failed", extra={"stage": "export", "table": table}
             )
+            return
+        await status.delete()
+    finally:
+        result.file.close()
+
+
+@router.message(Command("db_sizes"))
+async def admin_db_sizes(message: Message):
+    if not _is_admin(message.from_user.id):
+        return
+
+    sizes = await get_table_sizes()
+    lines = ["Размер таблиц (данные / индексы):"]
+    for size in sizes:
+        lines.append(f"{size.name}: {_mb(size.table_bytes)} / {_mb(size.index_bytes)}")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("maintenance"))
+async def admin_maintenance(message: Message):
+    """Запускает обслуживание БД вне расписания."""
+    if not _is_admin(message.from_user.id):
+        return
+
+    # та же блокировка, что у фонового прохода: вторая копия не стартует
+    async with maintenance_lock() as acquired:
+        if not acquired:
+            await message.answer("Обслуживание уже идёт, дождись его окончания ⏳")
+            return
+        await message.answer("Обслуживание БД запущено…")
+        report = await run_maintenance(datetime.now(ZoneInfo(settings.moscow_tz)))
+    lines = [f"{name}: {value}" for name, value in report.items()]
+    await message.answer("Готово✅\n" + "\n".join(lines))
+
+
+@router.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
+    if not _is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    await state.set_state(AdminStates.waiting_broadcast_text)
+    await callback.message.answer(
+        "Отправьте текст рассылки (форматирование сохранится). "
+        "Для отмены — /cancel."
+    )
+    await callback.answer()
 
+
+@router.message(AdminStates.waiting_broadcast_text)
+async def process_broadcast_text(message: Message, state: FSMContext):
+    if not _is_admin(message.from_user.id):
+        return
+    if not message.text:
+        await message.answer("Нужен текст рассылки.")
+        return
     await state.clear()
-    await message.answer(
-        "Готово.",
-        reply_markup=reply_main_keyboard(is_admin=True),
+    if message.text == "/cancel":
+        await message.answer(
+            "Рассылка отменена.", reply_markup=reply_main_keyboard(is_admin=True)
+        )
+        return
+
+    broadcast = await create_broadcast(message.html_text, message.chat.id)
+    progress = await message.answer(
+        progress_text(broadcast),
+        reply_markup=inline_broadcast_stop_keyboard(broadcast.id),
+    )
+    await set_progress_message(broadcast.id, progress.message_id)
+    start_broadcast(message.bot, broadcast.id)
+
+
+@router.callback_query(F.data.startswith("bc_stop:"))
+async def admin_broadcast_stop(callback: CallbackQuery):
+    if not _is_admin(callback.from_user.id):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+
+    broadcast_id = int(callback.data.split(":", 1)[1])
+    stopped = await cancel_broadcast(broadcast_id)
+    await callback.answer(
+        "Останавливаю рассылку…" if stopped else "Рассылка уже завершена"
     )
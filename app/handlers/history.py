@@ -0,0 +1,131 @@
+# app/handlers/history.py
+from zoneinfo import ZoneInfo
+
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery
+
+from app.config import settings
+from app.db.session import get_session
+from app.keyboards import inline_history_keyboard, inline_task_text_keyboard
+from app.services.history import (
+    decode_cursor,
+    encode_cursor,
+    get_stored_solution,
+    list_history,
+)
+from app.services.solution_files import (
+    answer_hash,
+    forget_file_id,
+    stats as solution_stats,
+)
+from app.services.text_split import answer_messages
+from app.services.tracing import span
+
+router = Router()
+
+
+def _button_label(created_at, preview: str) -> str:
+    created_at = created_at.astimezone(ZoneInfo(settings.moscow_tz))
+    preview = " ".join(preview.split())
+    return f"{created_at:%d.%m %H:%M} — {preview}…"
+
+
+@router.callback_query(F.data == "history")
+@router.callback_query(F.data.startswith("hist:"))
+async def history_page(callback: CallbackQuery):
+    """Список прошлых решений, новые сверху, страницами."""
+    after = None
+    if callback.data.startswith("hist:"):
+        after = decode_cursor(callback.data.split(":", 1)[1])
+        if after is None:
+            await callback.answer("Список устарел, открой заново", show_alert=True)
+            return
+
+    with span("db.history_page"):
+        async with get_session() as session:
+            items, next_cursor = await list_history(
+                session=session,
+                owner_tg_id=callback.from_user.id,
+                after=after,
+            )
+
+    if not items:
+        text = "Решений пока нет. Отправь фото задания📸" if after is None else (
+            "Больше решений нет."
+        )
+        await callback.message.answer(text)
+        await callback.answer()
+        return
+
+    buttons = [
+        (item.task_id, _button_label(item.created_at, item.preview))
+        for item in items
+    ]
+    await callback.message.answer(
+        "Мои решения:" if after is None else "Ещё решения:",
+        reply_markup=inline_history_keyboard(
+            buttons,
+            encode_cursor(next_cursor) if next_cursor else None,
+        ),
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("hist_open:"))
+async def history_open(callback: CallbackQuery):
+    """Повторно отдаёт сохранённое решение — без вызова OpenAI."""
+    try:
+        task_id = int(callback.data.split(":", 1)[1])
+    except ValueError:
+        await callback.answer("Неверный ID задачи", show_alert=True)
+        return
+
+    with span("db.history_open"):
+        async with get_session() as session:
+            solution = await get_stored_solution(
+                session=session,
+                task_id=task_id,
+                owner_tg_id=callback.from_user.id,
+            )
+
+    if solution is None:
+        await callback.answer("Решение не найдено", show_alert=True)
+        return
+
+    await callback.answer()
+    created_at = solution.created_at.astimezone(ZoneInfo(settings.moscow_tz))
+    if solution.solution_file_id:
+        # картинка-решение уже в Telegram — шлём по file_id, без рендера
+        if solution.telegram_file_id:
+            await callback.message.answer_photo(
+                photo=solution.telegram_file_id,
+                caption=f"Задание от {created_at:%d.%m.%Y %H:%M}👇",
+            )
+        try:
+            await callback.message.answer_photo(
+                photo=solution.solution_file_id,
+                caption="Решение👇",
+                reply_markup=inline_task_text_keyboard(solution.task_id),
+            )
+        except TelegramBadRequest:
+            # file_id протух — забываем его и отдаём решение текстом
+            solution_stats.stale += 1
+            await forget_file_id(
+                answer_hash(solution.answer_text), solution.solution_file_id
+            )
+        else:
+            solution_stats.reuses += 1
+            return
+        for chunk in answer_messages(solution.answer_text):
+            await callback.message.answer(chunk)
+        return
+
+    if solution.telegram_file_id:
+        await callback.message.answer_photo(
+            photo=solution.telegram_file_id,
+            caption=f"Задание от {created_at:%d.%m.%Y %H:%M}👇",
+            reply_markup=inline_task_text_keyboard(solution.task_id),
+        )
+    for chunk in answer_messages(solution.answer_text):
+        await callback.message.answer(chunk)
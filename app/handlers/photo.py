@@ -1,4 +1,7 @@
 # app/handlers/photo.py
+import asyncio
+import logging
+from contextlib import nullcontext
 from io import BytesIO
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -7,25 +10,64 @@ from aiogram import Router, F
 from aiogram.types import (
     Message,
     CallbackQuery,
-    BufferedInputFile,
     PhotoSize,
 )
-from sqlalchemy import select
 
 from app.config import settings
 from app.db.session import get_session
-from app.db.models import Task
-from app.services.ai_client import call_openai_vision
-from app.services.image_renderer import render_solution_image
+from app.db.models import Task, User
+from app.services.ai_client import (
+    VisionResult,
+    call_openai_vision,
+    choose_max_tokens,
+)
+from app.services.answer_cache import get_answer_text, remember_answer
+from app.services.deferred import enqueue_deferred
+from app.services.exercise_cache import add_cached_answer, find_cached_answer
+from app.services.exercise_key import normalize_exercise_key
+from app.services.image_quality import (
+    REJECT_MESSAGES,
+    assess_image_quality,
+    image_dhash,
+)
 from app.services.limits import (
     get_or_create_user,
     check_and_increment_daily_usage,
+    add_token_usage,
+    get_recent_completion_tokens,
+    ensure_daily_quota,
     DailyLimitExceeded,
+    DailyTokenLimitExceeded,
+)
+from app.services.solution_files import (
+    PreparedSolution,
+    lookup_solution,
+    render_solution,
+    send_solution,
 )
+from app.services.state_backend import get_state_backend
+from app.services.stats import bump_rollup, record_usage
+from app.services.text_split import answer_messages
+from app.services.tracing import span
 from app.keyboards import inline_task_text_keyboard
 
+logger = logging.getLogger(__name__)
 router = Router()
 
+# Сколько держим/ждём блокировку одного упражнения (≈ время ответа OpenAI)
+SINGLE_FLIGHT_TIMEOUT = 60
+
+LIMIT_MESSAGES = {
+    DailyTokenLimitExceeded: (
+        "❌ На сегодня исчерпан дневной объём решений.\n"
+        "Приходите завтра ⏳"
+    ),
+    DailyLimitExceeded: (
+        "❌ Лимит на день исчерпан, дабы поддерживать функционал бота "
+        "и избегать ошибок.\nПриходите через 12 часов ⏳"
+    ),
+}
+
 
 @router.callback_query(F.data == "start_solve")
 async def start_solve(callback: CallbackQuery):
@@ -48,102 +90,333 @@ async def handle_photo(message: Message):
 
     now_msk = datetime.now(ZoneInfo(settings.moscow_tz))
 
-    # ===== 1. Пользователь + лимит =====
-    async with get_session() as session:
-        user = await get_or_create_user(
-            session=session,
-            tg_user_id=message.from_user.id,
-            username=message.from_user.username,
-            now_moscow=now_msk,
-        )
-
-        try:
-            await check_and_increment_daily_usage(
+    # ===== 1. Пользователь + остаток лимита (без списания) =====
+    # Исчерпавшим лимит отвечаем сразу — фото даже не качаем
+    with span("db.user_limits"):
+        async with get_session() as session:
+            user = await get_or_create_user(
                 session=session,
-                user=user,
+                tg_user_id=message.from_user.id,
+                username=message.from_user.username,
                 now_moscow=now_msk,
-                daily_limit=settings.daily_limit,
             )
-        except DailyLimitExceeded:
-            await status.edit_text(
-                "❌ Лимит на день исчерпан, дабы поддерживать функционал бота "
-                "и избегать ошибок.\nПриходите через 12 часов ⏳"
+            token_limit = (
+                settings.premium_daily_token_limit
+                if user.is_premium
+                else settings.daily_token_limit
+            )
+            deferred = settings.deferred_enabled and user.deferred_mode
+            daily_limit = (
+                settings.deferred_daily_limit if deferred else settings.daily_limit
             )
-            return
+            limit_error = None
+            try:
+                await ensure_daily_quota(
+                    session=session,
+                    user=user,
+                    now_moscow=now_msk,
+                    daily_limit=daily_limit,
+                    daily_token_limit=token_limit,
+                    deferred=deferred,
+                )
+            except (DailyLimitExceeded, DailyTokenLimitExceeded) as e:
+                limit_error = e
+    if limit_error is not None:
+        await status.edit_text(LIMIT_MESSAGES[type(limit_error)])
+        return
 
     # ===== 2. Качаем фото =====
     try:
         buf = BytesIO()
         largest: PhotoSize = message.photo[-1]  # самое большое
-        await message.bot.download(largest, buf)
+        with span("download", size=largest.file_size):
+            await message.bot.download(largest, buf)
         image_bytes = buf.getvalue()
-    except Exception as e:
+    except Exception:
         await status.edit_text("❌ Не смог скачать фото. Попробуй ещё раз.")
-        print("DOWNLOAD ERROR:", repr(e))
+        logger.exception("photo download failed", extra={"stage": "download"})
         return
 
-    # ===== 3. Зовём OpenAI =====
-    await status.edit_text("Анализирую изображение 📊…")
+    # ===== 3. Быстрая проверка качества (до списания лимита) =====
+    if settings.quality_check_enabled:
+        try:
+            with span("quality_check") as sp:
+                quality = await asyncio.to_thread(assess_image_quality, image_bytes)
+                sp.set(reason=quality.reason)
+        except Exception:
+            # Не смогли разобрать картинку локально — пусть решает OpenAI
+            logger.exception("quality check failed", extra={"stage": "quality"})
+        else:
+            if not quality.ok:
+                logger.info(
+                    "photo rejected by quality check",
+                    extra={"stage": "quality", "reason": quality.reason},
+                )
+                await status.edit_text(REJECT_MESSAGES[quality.reason])
+                await record_usage(now_msk.date(), rejected=1)
+                return
 
-    try:
-        answer = await call_openai_vision(
-            image_bytes=image_bytes,
-            caption=message.caption,
-            is_premium=user.is_premium,
-        )
-    except RuntimeError as e:
-        # Наши осознанные OPENAI_* ошибки
-        await status.edit_text(
-            "❌ Ошибка при работе с OpenAI.\n"
-            f"{e}\n\n"
-            "Это проблема конфигурации (ключ/модель/лимиты). "
-            "После исправления всё заработает."
-        )
-        print("VISION ERROR:", repr(e))
+    # ===== 3б. Списываем лимит (атомарно: пока качали, могли прийти другие фото) =====
+    with span("db.charge_limit"):
+        async with get_session() as session:
+            try:
+                remaining_tokens = await check_and_increment_daily_usage(
+                    session=session,
+                    user=user,
+                    now_moscow=now_msk,
+                    daily_limit=daily_limit,
+                    daily_token_limit=token_limit,
+                    deferred=deferred,
+                )
+            except (DailyLimitExceeded, DailyTokenLimitExceeded) as e:
+                limit_error = e
+            else:
+                recent_tokens = await get_recent_completion_tokens(session, user.id)
+    if limit_error is not None:
+        await status.edit_text(LIMIT_MESSAGES[type(limit_error)])
         return
-    except Exception as e:
+
+    # ===== Отложенный режим: в очередь на батч, ответ придёт позже =====
+    if deferred:
+        with span("db.deferred_enqueue"):
+            await enqueue_deferred(
+                user=user,
+                chat_id=message.chat.id,
+                message_id=message.message_id,
+                telegram_file_id=largest.file_id,
+                caption=message.caption,
+                max_tokens=choose_max_tokens(
+                    caption=message.caption,
+                    is_premium=user.is_premium,
+                    recent_completion_tokens=recent_tokens,
+                    remaining_budget=remaining_tokens,
+                ),
+                now_moscow=now_msk,
+            )
         await status.edit_text(
-            "❌ Неизвестная ошибка при анализе фото. Попробуй позже."
+            "Принял🌙 Решу в фоне, в режиме «к утру» — пришлю ответом на это "
+            "фото, как только будет готово."
         )
-        print("VISION UNKNOWN ERROR:", repr(e))
         return
 
-    # ===== 4. Рендерим картинку с решением =====
-    await status.edit_text("Создаю готовое решение 🧠🖼")
+    # ===== 4. Кэш по номеру упражнения из подписи =====
+    exercise_key = (
+        normalize_exercise_key(message.caption)
+        if settings.exercise_cache_enabled
+        else None
+    )
 
-    try:
-        result_image = render_solution_image(answer)
-        file = BufferedInputFile(result_image, filename="solution.png")
-    except Exception as e:
-        await status.edit_text("❌ Ошибка при рендере изображения.")
-        print("RENDER ERROR:", repr(e))
-        return
+    # Одно и то же упражнение от нескольких учеников одновременно: в OpenAI
+    # идут по очереди, пока EXERCISE_CACHE_MIN_AGREEMENT ответов не совпадут,
+    # остальные ждут и забирают ответ из кэша. Держим блокировку до записи
+    # ответа в exercise_answers, рендер и отправка — уже без неё.
+    guard = (
+        get_state_backend().lock(
+            f"exercise:{exercise_key}",
+            timeout=SINGLE_FLIGHT_TIMEOUT,
+            wait=SINGLE_FLIGHT_TIMEOUT,
+        )
+        if exercise_key
+        else nullcontext()
+    )
+    async with guard:
+        solved = await _solve_and_save(
+            message=message,
+            status=status,
+            user=user,
+            image_bytes=image_bytes,
+            photo=largest,
+            exercise_key=exercise_key,
+            recent_tokens=recent_tokens,
+            remaining_tokens=remaining_tokens,
+            now_msk=now_msk,
+        )
+    if solved is not None:
+        task_id, answer, prepared = solved
+        await _render_and_reply(message, status, task_id, answer, prepared, now_msk)
+
+
+async def _solve_and_save(
+    message: Message,
+    status: Message,
+    user: User,
+    image_bytes: bytes,
+    photo: PhotoSize,
+    exercise_key: str | None,
+    recent_tokens: list[int],
+    remaining_tokens: int | None,
+    now_msk: datetime,
+) -> tuple[int, str, PreparedSolution] | None:
+    """
+    Шаги 4–7: кэш упражнения или OpenAI, сохранение задачи.
+    None — ошибка, пользователю уже ответили.
+    """
+    image_hash = None
+    cached = None
+    if exercise_key:
+        try:
+            image_hash = await asyncio.to_thread(image_dhash, image_bytes)
+        except Exception:
+            logger.exception("image hash failed", extra={"stage": "exercise_cache"})
+        else:
+            with span("db.exercise_cache", key=exercise_key) as sp:
+                async with get_session() as session:
+                    cached = await find_cached_answer(
+                        session=session,
+                        key=exercise_key,
+                        image_hash=image_hash,
+                        now_moscow=now_msk,
+                    )
+                sp.set(hit=cached is not None)
 
-    # ===== 5. Сохраняем задачу в БД =====
-    async with get_session() as session:
-        task = Task(
-            user_id=user.id,
-            created_at=now_msk,
+    # ===== 5. Зовём OpenAI (если ответа нет в кэше) =====
+    if cached is not None:
+        vision = VisionResult(text=cached.answer_text)
+    else:
+        await status.edit_text("Анализирую изображение 📊…")
+
+        max_tokens = choose_max_tokens(
+            caption=message.caption,
             is_premium=user.is_premium,
-            telegram_file_id=largest.file_id,
-            answer_text=answer,
+            recent_completion_tokens=recent_tokens,
+            remaining_budget=remaining_tokens,
         )
-        session.add(task)
-        await session.commit()
-        await session.refresh(task)
-        task_id = task.id
 
-    # ===== 6. Отправляем результат =====
+        try:
+            with span("openai", max_tokens=max_tokens) as sp:
+                vision = await call_openai_vision(
+                    image_bytes=image_bytes,
+                    caption=message.caption,
+                    is_premium=user.is_premium,
+                    max_tokens=max_tokens,
+                )
+                sp.set(
+                    prompt_tokens=vision.prompt_tokens,
+                    completion_tokens=vision.completion_tokens,
+                    cached_tokens=vision.cached_tokens,
+                )
+        except RuntimeError as e:
+            # Наши осознанные OPENAI_* ошибки
+            await status.edit_text(
+                "❌ Ошибка при работе с OpenAI.\n"
+                f"{e}\n\n"
+                "Это проблема конфигурации (ключ/модель/лимиты). "
+                "После исправления всё заработает."
+            )
+            logger.error(
+                "openai call failed", extra={"stage": "openai", "error": repr(e)}
+            )
+            await record_usage(now_msk.date(), errors=1)
+            return None
+        except Exception:
+            await status.edit_text(
+                "❌ Неизвестная ошибка при анализе фото. Попробуй позже."
+            )
+            logger.exception("openai call crashed", extra={"stage": "openai"})
+            await record_usage(now_msk.date(), errors=1)
+            return None
+
+    answer = vision.text
+
+    # ===== 6. Готовая картинка с таким ответом уже есть в Telegram? =====
+    prepared = await lookup_solution(answer)
+
+    # ===== 7. Сохраняем задачу в БД =====
+    with span("db.save_task"):
+        async with get_session() as session:
+            task = Task(
+                user_id=user.id,
+                created_at=now_msk,
+                is_premium=user.is_premium,
+                telegram_file_id=photo.file_id,
+                answer_text=answer,
+                prompt_tokens=vision.prompt_tokens,
+                completion_tokens=vision.completion_tokens,
+                cached_tokens=vision.cached_tokens,
+                answer_hash=prepared.answer_hash,
+                solution_file_id=prepared.file_id,
+            )
+            session.add(task)
+            await add_token_usage(
+                session=session,
+                user_id=user.id,
+                now_moscow=now_msk,
+                tokens=vision.total_tokens,
+            )
+            await bump_rollup(
+                session,
+                now_msk.date(),
+                photos=1,
+                premium_photos=int(user.is_premium),
+                cache_hits=int(cached is not None),
+                prompt_tokens=vision.prompt_tokens,
+                completion_tokens=vision.completion_tokens,
+            )
+            await session.flush()
+            task_id = task.id
+
+            # Свежий ответ по названному упражнению — в кэш для одноклассников.
+            # Обрезанные по max_tokens ответы не кэшируем.
+            if exercise_key and image_hash is not None and cached is None and (
+                not vision.truncated
+            ):
+                add_cached_answer(
+                    session=session,
+                    key=exercise_key,
+                    image_hash=image_hash,
+                    answer_text=answer,
+                    task_id=task_id,
+                    now_moscow=now_msk,
+                )
+            await session.commit()
+
+    remember_answer(task_id, message.from_user.id, answer)
+    return task_id, answer, prepared
+
+
+async def _render_and_reply(
+    message: Message,
+    status: Message,
+    task_id: int,
+    answer: str,
+    prepared: PreparedSolution,
+    now_msk: datetime,
+) -> None:
+    """Шаг 8: рендер (если file_id не нашёлся) и отправка картинки."""
+    await status.edit_text("Создаю готовое решение 🧠🖼")
+
+    try:
+        with span("render") as sp:
+            await render_solution(prepared, answer)
+            sp.set(
+                reused=prepared.file_id is not None,
+                bytes=len(prepared.image) if prepared.image else 0,
+            )
+    except Exception:
+        # задача уже сохранена — текст решения всё равно можно отдать
+        await status.edit_text(
+            "❌ Ошибка при рендере изображения.",
+            reply_markup=inline_task_text_keyboard(task_id),
+        )
+        logger.exception("render failed", extra={"stage": "render"})
+        await record_usage(now_msk.date(), errors=1)
+        return
+
     try:
         await status.delete()
     except Exception:
         pass
 
-    await message.answer_photo(
-        photo=file,
-        caption="Готово!👇",
-        reply_markup=inline_task_text_keyboard(task_id),
-    )
+    with span("send", reused=prepared.file_id is not None):
+        await send_solution(
+            message.bot,
+            message.chat.id,
+            prepared,
+            answer_text=answer,
+            task_id=task_id,
+            caption="Готово!👇",
+            reply_markup=inline_task_text_keyboard(task_id),
+        )
 
 
 @router.callback_query(F.data.startswith("task_text:"))
@@ -156,14 +429,19 @@ async def task_text(callback: CallbackQuery):
         await callback.answer("Неверный ID задачи", show_alert=True)
         return
 
-    async with get_session() as session:
-        stmt = select(Task).where(Task.id == task_id)
-        result = await session.execute(stmt)
-        task = result.scalar_one_or_none()
+    with span("db.answer_text"):
+        async with get_session() as session:
+            answer_text = await get_answer_text(
+                session=session,
+                task_id=task_id,
+                owner_tg_id=callback.from_user.id,
+            )
 
-    if not task:
+    if answer_text is None:
         await callback.answer("Решение не найдено", show_alert=True)
         return
 
-    await callback.message.answer(task.answer_text)
     await callback.answer()
+    # Длинные ответы — несколькими сообщениями по абзацам
+    for chunk in answer_messages(answer_text):
+        await callback.message.answer(chunk)
@@ -5,8 +5,13 @@ from zoneinfo import ZoneInfo
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
+from sqlalchemy import update
+
 from app.config import settings
+from app.db.models import User
 from app.db.session import get_session
+from app.keyboards import inline_profile_keyboard
+from app.services.deferred import count_waiting
 from app.services.limits import get_or_create_user
 
 router = Router()
@@ -46,5 +51,46 @@ async def menu_profile(callback: CallbackQuery):
         f"Премиум: {premium_status}"
     )
 
-    await callback.message.answer(text)
+    if not settings.deferred_enabled:
+        await callback.message.answer(text)
+        await callback.answer()
+        return
+
+    waiting = await count_waiting(user.id)
+    text += (
+        "\n\nРежим «к утру»🌙: фото решаются в фоне и приходят позже, зато "
+        f"не тратят обычный дневной лимит (до {settings.deferred_daily_limit} "
+        "в день отдельно)."
+    )
+    if waiting:
+        text += f"\nЖдут решения: {waiting}"
+
+    await callback.message.answer(
+        text, reply_markup=inline_profile_keyboard(user.deferred_mode)
+    )
     await callback.answer()
+
+
+@router.callback_query(F.data == "toggle_deferred")
+async def toggle_deferred(callback: CallbackQuery):
+    """Переключает отложенный режим «к утру»."""
+    async with get_session() as session:
+        result = await session.execute(
+            update(User)
+            .where(User.telegram_user_id == callback.from_user.id)
+            .values(deferred_mode=~User.deferred_mode)
+            .returning(User.deferred_mode)
+        )
+        deferred_mode = result.scalar_one_or_none()
+        await session.commit()
+
+    if deferred_mode is None:
+        await callback.answer("Сначала нажми /start", show_alert=True)
+        return
+
+    await callback.message.edit_reply_markup(
+        reply_markup=inline_profile_keyboard(deferred_mode)
+    )
+    await callback.answer(
+        "Теперь фото решаются к утру🌙" if deferred_mode else "Теперь решаю сразу⚡"
+    )
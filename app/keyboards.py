@@ -40,6 +40,7 @@ def inline_main_menu_keyboard() -> InlineKeyboardMarkup:
             [InlineKeyboardButton(text="Правила", callback_data="menu_rules")],
             [InlineKeyboardButton(text="Премиум✨", callback_data="menu_premium")],
             [InlineKeyboardButton(text="Мой профиль👤", callback_data="profile")],
+            [InlineKeyboardButton(text="Мои решения📚", callback_data="history")],
         ]
     )
 
@@ -57,6 +58,19 @@ def inline_premium_contact_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+def inline_profile_keyboard(deferred_mode: bool) -> InlineKeyboardMarkup:
+    text = (
+        "Режим: к утру🌙 (нажми — решать сразу)"
+        if deferred_mode
+        else "Режим: сразу⚡ (нажми — решать к утру)"
+    )
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=text, callback_data="toggle_deferred")]
+        ]
+    )
+
+
 def inline_task_text_keyboard(task_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -70,6 +84,22 @@ def inline_task_text_keyboard(task_id: int) -> InlineKeyboardMarkup:
     )
 
 
+def inline_history_keyboard(
+    items: list[tuple[int, str]],
+    next_cursor: str | None,
+) -> InlineKeyboardMarkup:
+    """items — (task_id, подпись кнопки); next_cursor — курсор следующей страницы."""
+    rows = [
+        [InlineKeyboardButton(text=label, callback_data=f"hist_open:{task_id}")]
+        for task_id, label in items
+    ]
+    if next_cursor:
+        rows.append(
+            [InlineKeyboardButton(text="Ещё ▶️", callback_data=f"hist:{next_cursor}")]
+        )
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 def inline_admin_panel_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -83,5 +113,31 @@ def inline_admin_panel_keyboard() -> InlineKeyboardMarkup:
                     text="Снять премиум🔥", callback_data="admin_remove_premium"
                 )
             ],
+            [
+                InlineKeyboardButton(text="Статистика📊", callback_data="admin_stats")
+            ],
+            [
+                InlineKeyboardButton(
+                    text="Расход токенов🧮", callback_data="admin_token_report"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="Кэш упражнений📚", callback_data="admin_exercise_cache"
+                )
+            ],
+            [InlineKeyboardButton(text="Рассылка📣", callback_data="admin_broadcast")],
+        ]
+    )
+
+
+def inline_broadcast_stop_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="Остановить⛔", callback_data=f"bc_stop:{broadcast_id}"
+                )
+            ]
         ]
     )
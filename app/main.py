@@ -12,14 +12,19 @@ from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_applicati
 
 from app.config import settings
 from app.db.session import init_db
-from app.handlers import start, menu, photo, profile, admin
+from app.handlers import start, menu, photo, profile, admin, history
+from app.middlewares.throttling import ThrottlingMiddleware
+from app.middlewares.tracing import TracingMiddleware
+from app.services.broadcast import resume_broadcasts, shutdown_broadcasts
+from app.services.deferred import deferred_loop
+from app.services.maintenance import maintenance_loop
+from app.services.profiling import setup_profiling
+from app.services.state_backend import get_state_backend
+from app.services.tracing import setup_logging
 
 
 # ===== Настройка логов =====
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - [%(levelname)s] - %(name)s - %(message)s",
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # ===== Webhook =====
@@ -45,8 +50,16 @@ async def healthcheck(request: web.Request) -> web.Response:
 
 
 # ===== Стартовые хуки dp =====
+background_tasks: set[asyncio.Task] = set()
+
+
 async def on_startup(bot: Bot) -> None:
     await init_db()
+    background_tasks.add(asyncio.create_task(maintenance_loop()))
+    if settings.deferred_enabled:
+        background_tasks.add(asyncio.create_task(deferred_loop(bot)))
+    # рассылки, прерванные рестартом, продолжаем с чекпоинта
+    await resume_broadcasts(bot)
     webhook_url = get_webhook_url()
     logger.info("Setting webhook to: %s", webhook_url)
     await bot.set_webhook(
@@ -60,6 +73,11 @@ async def on_shutdown(bot: Bot) -> None:
     logger.info("Shutting down bot...")
     await bot.delete_webhook(drop_pending_updates=False)
     logger.info("Webhook deleted")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await shutdown_broadcasts()
+    await get_state_backend().close()
 
 
 # ===== Основной запуск =====
@@ -70,7 +88,19 @@ async def main() -> None:
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-    dp = Dispatcher()
+    # FSM, антифлуд и блокировки — в общем бэкенде (Redis, если задан REDIS_URL)
+    state_backend = get_state_backend()
+    dp = Dispatcher(storage=state_backend.fsm_storage())
+
+    # trace_id на каждый апдейт + slow-лог
+    dp.update.outer_middleware(TracingMiddleware())
+
+    # Антифлуд — outer-middleware, срабатывает до хендлеров и БД
+    if settings.flood_enabled:
+        throttling = ThrottlingMiddleware.from_settings()
+        dp.message.outer_middleware(throttling)
+        dp.callback_query.outer_middleware(throttling)
+        dp["throttling"] = throttling
 
     # Регистрируем хуки
     dp.startup.register(on_startup)
@@ -82,11 +112,14 @@ async def main() -> None:
     dp.include_router(photo.router)
     dp.include_router(profile.router)
     dp.include_router(admin.router)
+    dp.include_router(history.router)
 
     # Aiohttp-приложение для вебхука
     app = web.Application()
     app.router.add_get("/", healthcheck)
     app.router.add_get("/health", healthcheck)
+    # профилирование по запросу, только с PROFILING_TOKEN
+    setup_profiling(app)
 
     SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
     setup_application(app, dp, bot=bot)
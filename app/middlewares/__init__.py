@@ -0,0 +1,2 @@
+# app/middlewares/__init__.py
+# Пакет для aiogram-middleware
@@ -0,0 +1,146 @@
+# app/middlewares/throttling.py
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.config import settings
+from app.services import premium_cache
+from app.services.state_backend import StateBackend, get_state_backend
+
+
+DROPPED_TEXT = {
+    "message": "Слишком часто, подожди немного ⏳",
+    "photo": (
+        "Слишком много фото подряд — последние я не обработал. "
+        "Подожди немного и пришли их ещё раз ⏳"
+    ),
+}
+
+
+@dataclass
+class BucketRule:
+    rate: float   # токенов в секунду
+    burst: float  # размер корзины
+
+
+@dataclass
+class ThrottlingStats:
+    passed: Dict[str, int] = field(default_factory=dict)
+    delayed: Dict[str, int] = field(default_factory=dict)
+    dropped: Dict[str, int] = field(default_factory=dict)
+
+    @staticmethod
+    def _inc(counter: Dict[str, int], kind: str) -> None:
+        counter[kind] = counter.get(kind, 0) + 1
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд: token bucket на (тип апдейта, пользователь) в state-бэкенде
+    (память процесса или общий Redis для нескольких реплик).
+    Вешается как outer-middleware, поэтому лишние апдейты отсекаются
+    до фильтров, хендлеров и любых походов в БД.
+    Небольшое превышение ждём (до max_delay), всё остальное выкидываем.
+    """
+
+    def __init__(
+        self,
+        backend: StateBackend,
+        rules: Dict[str, BucketRule],
+        premium_burst_multiplier: float = 2.0,
+        max_delay: float = 2.0,
+        idle_ttl: float = 600.0,
+        notice_interval: float = 30.0,
+        exempt_ids: frozenset[int] = frozenset(),
+    ) -> None:
+        self.backend = backend
+        self.rules = rules
+        self.premium_burst_multiplier = premium_burst_multiplier
+        self.max_delay = max_delay
+        self.idle_ttl = idle_ttl
+        self.notice_interval = notice_interval
+        self.exempt_ids = exempt_ids
+        self.stats = ThrottlingStats()
+
+    @classmethod
+    def from_settings(cls) -> "ThrottlingMiddleware":
+        return cls(
+            backend=get_state_backend(),
+            rules={
+                "message": BucketRule(
+                    settings.flood_message_rate, settings.flood_message_burst
+                ),
+                "photo": BucketRule(
+                    settings.flood_photo_rate, settings.flood_photo_burst
+                ),
+                "callback": BucketRule(
+                    settings.flood_callback_rate, settings.flood_callback_burst
+                ),
+            },
+            premium_burst_multiplier=settings.flood_premium_multiplier,
+            max_delay=settings.flood_max_delay,
+            idle_ttl=settings.flood_idle_ttl,
+            notice_interval=settings.flood_notice_interval,
+            exempt_ids=frozenset({settings.admin_id}),
+        )
+
+    async def _notify_dropped(self, event: Message, kind: str, user_id: int) -> None:
+        """
+        Говорим, что сообщение выкинуто, — но не чаще раза за notice_interval,
+        иначе на каждую лишнюю фотку из альбома прилетало бы по ответу.
+        """
+        key = f"flood:notice:{user_id}"
+        if await self.backend.get(key) is not None:
+            return
+        await self.backend.set(key, "1", ttl=self.notice_interval)
+        await event.answer(DROPPED_TEXT[kind])
+
+    @staticmethod
+    def _kind(event: TelegramObject) -> str | None:
+        if isinstance(event, Message):
+            return "photo" if event.photo else "message"
+        if isinstance(event, CallbackQuery):
+            return "callback"
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = self._kind(event)
+        user = getattr(event, "from_user", None)
+        if kind is None or kind not in self.rules or user is None:
+            return await handler(event, data)
+        if user.id in self.exempt_ids:
+            return await handler(event, data)
+
+        rule = self.rules[kind]
+        wait = await self.backend.take_token(
+            key=f"flood:{kind}:{user.id}",
+            rate=rule.rate,
+            burst=rule.burst,
+            max_delay=self.max_delay,
+            idle_ttl=self.idle_ttl,
+            boost_key=premium_cache.key(user.id),
+            boost=self.premium_burst_multiplier,
+        )
+        if wait > self.max_delay:
+            self.stats._inc(self.stats.dropped, kind)
+            if isinstance(event, CallbackQuery):
+                # иначе у пользователя будут вечно крутиться «часики» на кнопке
+                await event.answer("Слишком часто, подожди немного ⏳")
+            else:
+                await self._notify_dropped(event, kind, user.id)
+            return None
+
+        if wait > 0:
+            self.stats._inc(self.stats.delayed, kind)
+            await asyncio.sleep(wait)
+
+        self.stats._inc(self.stats.passed, kind)
+        return await handler(event, data)
@@ -0,0 +1,33 @@
+# app/middlewares/tracing.py
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.services.tracing import finish_trace, start_trace
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на уровне Update: заводит trace_id на каждый апдейт,
+    а по завершении отдаёт его в slow-лог, если апдейт был медленным.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        trace = start_trace(
+            update_id=event.update_id,
+            user_id=user.id if user else None,
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            finish_trace(trace, update_type=event.event_type)
@@ -1,7 +1,11 @@
 # app/services/ai_client.py
 import asyncio
 import base64
-from typing import Optional
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Optional
 
 from openai import (
     OpenAI,
@@ -12,9 +16,14 @@ from openai import (
 )
 
 from app.config import settings
+from app.services.exercise_key import count_exercises
 
-# Клиент OpenAI, ключ берём из настроек
-client = OpenAI(api_key=settings.openai_api_key)
+# Клиент OpenAI, ключ берём из настроек. OPENAI_BASE_URL — свой адрес API
+# (прокси или локальная заглушка для проверки пакетного режима).
+client = OpenAI(
+    api_key=settings.openai_api_key,
+    base_url=settings.openai_base_url or None,
+)
 
 # Системная роль ИИ
 SYSTEM_PROMPT = (
@@ -23,67 +32,162 @@ SYSTEM_PROMPT = (
     "колледж-задания. Отвечай чётко по условию, без лишней воды."
 )
 
+# Инструкция идёт в сообщении пользователя, подпись — между её частями:
+# от формулировки и роли зависят ответы модели, их не трогаем ради кэша.
+# Prompt caching у OpenAI начинается с префикса в 1024 токена, а системный
+# промпт с началом инструкции — порядка 150, поэтому cached_tokens пока нулевой.
+# Считаем его всё равно: станет видно, если промпт вырастет.
+TASK_INSTRUCTIONS = (
+    "Реши задание по этой фотографии. Если в подписи указаны, какие номера "
+    "решать или как именно отвечать — строго соблюдай это.\n\n"
+)
+ANSWER_INSTRUCTIONS = (
+    "Дай в ответе само решение / ответы. Если нужно, можешь очень кратко "
+    "пояснить, но без лишней воды."
+)
+
+# Границы max_tokens по тарифам
+MIN_MAX_TOKENS = 200
+BASE_MAX_TOKENS = {False: 500, True: 1200}
+CEIL_MAX_TOKENS = {False: 800, True: 2000}
 
-async def call_openai_vision(
-    image_bytes: bytes,
+_SHORT_INTENT_RE = re.compile(
+    r"только\s+ответ|без\s+решени|кратк|коротк|просто\s+ответ", re.IGNORECASE
+)
+_LONG_INTENT_RE = re.compile(
+    r"подробн|объясн|распиш|пошагов|по\s+шагам|с\s+решением|с\s+пояснени",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class VisionResult:
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    truncated: bool = False  # упёрлись в max_tokens
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def choose_max_tokens(
     caption: Optional[str],
     is_premium: bool,
-) -> str:
+    recent_completion_tokens: list[int] | None = None,
+    remaining_budget: int | None = None,
+) -> int:
     """
-    Вызов GPT с поддержкой картинок.
-    Картинка шлётся в base64 через image_url (data:...).
+    Подбирает max_tokens под запрос:
+    - «только ответ» — вдвое меньше, «подробно/объясни» — в полтора раза больше;
+    - несколько номеров в подписи — больше места под ответ;
+    - если прошлые ответы пользователя были длиннее базы — подстраиваемся под них;
+    - не выходим за остаток дневного бюджета токенов.
     """
+    base = BASE_MAX_TOKENS[is_premium]
+    ceil = CEIL_MAX_TOKENS[is_premium]
+    text = caption or ""
+
+    if _SHORT_INTENT_RE.search(text):
+        value = base // 2
+    elif _LONG_INTENT_RE.search(text):
+        value = int(base * 1.5)
+    else:
+        value = base
 
-    # 1. Кодируем картинку
+    # «реши 1, 2, 5» — по ~четверти базы на каждое дополнительное задание;
+    # класс и страница («7 класс стр 78») заданиями не считаются
+    numbers = count_exercises(text)
+    if numbers > 1:
+        value += (numbers - 1) * base // 4
+
+    if recent_completion_tokens:
+        typical = sum(recent_completion_tokens) / len(recent_completion_tokens)
+        value = max(value, int(typical * 1.3))
+
+    value = min(max(value, MIN_MAX_TOKENS), ceil)
+    if remaining_budget is not None:
+        value = max(min(value, remaining_budget), MIN_MAX_TOKENS)
+    return value
+
+
+def build_vision_request(
+    image_bytes: bytes,
+    caption: Optional[str],
+    max_tokens: int,
+) -> dict[str, Any]:
+    """
+    Тело запроса к chat.completions: и для обычного вызова, и для Batch API.
+    Картинка шлётся в base64 через image_url (data:...).
+    """
     b64_image = base64.b64encode(image_bytes).decode("utf-8")
 
-    # 2. Текст пользователя
     caption_part = caption.strip() if caption else ""
-    user_text = (
-        "Реши задание по этой фотографии. Если в подписи указаны, какие номера "
-        "решать или как именно отвечать — строго соблюдай это.\n\n"
-    )
+    user_text = TASK_INSTRUCTIONS
     if caption_part:
         user_text += f"Подпись к фото: {caption_part}\n\n"
+    user_text += ANSWER_INSTRUCTIONS
 
-    user_text += (
-        "Дай в ответе само решение / ответы. Если нужно, можешь очень кратко "
-        "пояснить, но без лишней воды."
+    return {
+        "model": settings.openai_model,
+        "messages": [
+            {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": SYSTEM_PROMPT},
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": user_text},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{b64_image}",
+                        },
+                    },
+                ],
+            },
+        ],
+        "max_tokens": max_tokens,
+    }
+
+
+def _result_from_completion(body: dict[str, Any]) -> VisionResult:
+    """VisionResult из JSON-ответа chat.completions (строка результата батча)."""
+    choice = body["choices"][0]
+    usage = body.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return VisionResult(
+        text=(choice["message"].get("content") or "").strip(),
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        completion_tokens=usage.get("completion_tokens") or 0,
+        cached_tokens=details.get("cached_tokens") or 0,
+        truncated=choice.get("finish_reason") == "length",
     )
 
-    # 3. Сообщения для модели
-    messages = [
-        {
-            "role": "system",
-            "content": [
-                {"type": "text", "text": SYSTEM_PROMPT},
-            ],
-        },
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": user_text},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{b64_image}",
-                    },
-                },
-            ],
-        },
-    ]
 
-    max_tokens = 1200 if is_premium else 500
+async def call_openai_vision(
+    image_bytes: bytes,
+    caption: Optional[str],
+    is_premium: bool,
+    max_tokens: Optional[int] = None,
+) -> VisionResult:
+    """
+    Вызов GPT с поддержкой картинок.
+    Возвращает текст ответа вместе с расходом токенов.
+    """
+    if max_tokens is None:
+        max_tokens = choose_max_tokens(caption, is_premium)
+    request = build_vision_request(image_bytes, caption, max_tokens)
 
-    # 4. Синхронный вызов в отдельном потоке
-    def _call_sync() -> str:
+    # Синхронный вызов в отдельном потоке
+    def _call_sync() -> VisionResult:
         try:
-            resp = client.chat.completions.create(
-                model=settings.openai_model,
-                messages=messages,
-                max_tokens=max_tokens,
-            )
-            return resp.choices[0].message.content.strip()
+            resp = client.chat.completions.create(**request)
         except AuthenticationError as e:
             # Неправильный / пустой ключ
             raise RuntimeError("OPENAI_AUTH_ERROR: проверь OPENAI_API_KEY") from e
@@ -97,4 +201,187 @@ async def call_openai_vision(
             # Любая другая ошибка API (часто — закончился баланс)
             raise RuntimeError(f"OPENAI_API_ERROR: {e}") from e
 
+        choice = resp.choices[0]
+        result = VisionResult(
+            text=choice.message.content.strip(),
+            truncated=choice.finish_reason == "length",
+        )
+        usage = resp.usage
+        if usage is not None:
+            result.prompt_tokens = usage.prompt_tokens or 0
+            result.completion_tokens = usage.completion_tokens or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            result.cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        return result
+
     return await asyncio.to_thread(_call_sync)
+
+
+# ===== Пакетный режим (Batch API) =====
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Статусы батча, при которых результатов ещё нет
+BATCH_PENDING_STATUSES = {"validating", "in_progress", "finalizing", "cancelling"}
+
+
+@dataclass
+class BatchPoll:
+    done: bool
+    status: str = ""
+    results: dict[str, VisionResult] = field(default_factory=dict)
+    errors: dict[str, str] = field(default_factory=dict)
+
+
+class BatchBackend(ABC):
+    """
+    Куда отправлять отложенные задания пачкой.
+    submit() принимает пары (custom_id, тело build_vision_request) и возвращает
+    id батча; poll() отдаёт результаты по custom_id, когда батч завершён.
+    """
+
+    @abstractmethod
+    async def submit(self, requests: list[tuple[str, dict[str, Any]]]) -> str: ...
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> BatchPoll: ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    OpenAI Batch API: JSONL-файл с запросами, ответ в течение 24 часов
+    за половину цены. Работает и с любой совместимой заглушкой через
+    OPENAI_BASE_URL.
+    """
+
+    def __init__(self, openai_client: OpenAI) -> None:
+        self.client = openai_client
+
+    async def submit(self, requests: list[tuple[str, dict[str, Any]]]) -> str:
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": body,
+                },
+                ensure_ascii=False,
+            )
+            for custom_id, body in requests
+        ]
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        def _submit_sync() -> str:
+            try:
+                uploaded = self.client.files.create(
+                    file=("deferred.jsonl", payload), purpose="batch"
+                )
+                batch = self.client.batches.create(
+                    input_file_id=uploaded.id,
+                    endpoint=BATCH_ENDPOINT,
+                    completion_window="24h",
+                )
+            except APIError as e:
+                raise RuntimeError(f"OPENAI_BATCH_ERROR: {e}") from e
+            return batch.id
+
+        return await asyncio.to_thread(_submit_sync)
+
+    async def poll(self, batch_id: str) -> BatchPoll:
+        def _poll_sync() -> BatchPoll:
+            try:
+                batch = self.client.batches.retrieve(batch_id)
+                if batch.status in BATCH_PENDING_STATUSES:
+                    return BatchPoll(done=False, status=batch.status)
+
+                poll = BatchPoll(done=True, status=batch.status)
+                for file_id in (batch.output_file_id, batch.error_file_id):
+                    if not file_id:
+                        continue
+                    content = self.client.files.content(file_id).text
+                    for line in content.splitlines():
+                        if line.strip():
+                            _collect_batch_line(poll, json.loads(line))
+            except APIError as e:
+                raise RuntimeError(f"OPENAI_BATCH_ERROR: {e}") from e
+            return poll
+
+        return await asyncio.to_thread(_poll_sync)
+
+
+def _collect_batch_line(poll: BatchPoll, item: dict[str, Any]) -> None:
+    custom_id = item.get("custom_id")
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        error = item.get("error") or (response.get("body") or {}).get("error")
+        if isinstance(error, dict):
+            error = error.get("message") or error.get("code")
+        poll.errors[custom_id] = str(error or response.get("status_code"))
+        return
+    try:
+        poll.results[custom_id] = _result_from_completion(response["body"])
+    except (KeyError, IndexError, TypeError) as e:
+        poll.errors[custom_id] = f"bad response: {e!r}"
+
+
+class FakeBatchBackend(BatchBackend):
+    """
+    Батчи в памяти процесса — для локальной проверки отложенного режима без
+    OpenAI (DEFERRED_FAKE_BACKEND=1) и для тестов. Батч «в работе» первые
+    pending_polls опросов, потом отдаёт ответы в формате строк Batch API.
+    """
+
+    def __init__(self, pending_polls: int = 1, answer: str = "Тестовое решение") -> None:
+        self.pending_polls = pending_polls
+        self.answer = answer
+        self._batches: dict[str, list[tuple[str, dict[str, Any]]]] = {}
+        self._polls: dict[str, int] = {}
+
+    async def submit(self, requests: list[tuple[str, dict[str, Any]]]) -> str:
+        batch_id = f"fake_batch_{len(self._batches) + 1}"
+        self._batches[batch_id] = list(requests)
+        self._polls[batch_id] = 0
+        return batch_id
+
+    def _line(self, custom_id: str, body: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "model": body.get("model"),
+                    "choices": [
+                        {
+                            "message": {"role": "assistant", "content": self.answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": 50},
+                },
+            },
+        }
+
+    async def poll(self, batch_id: str) -> BatchPoll:
+        if batch_id not in self._batches:
+            # батч из прошлого запуска процесса — его уже не будет
+            return BatchPoll(done=True, status="expired")
+        self._polls[batch_id] += 1
+        if self._polls[batch_id] <= self.pending_polls:
+            return BatchPoll(done=False, status="in_progress")
+        poll = BatchPoll(done=True, status="completed")
+        for custom_id, body in self._batches.pop(batch_id):
+            _collect_batch_line(poll, self._line(custom_id, body))
+        return poll
+
+
+_batch_backend: Optional[BatchBackend] = None
+
+
+def get_batch_backend() -> BatchBackend:
+    global _batch_backend
+    if _batch_backend is None:
+        if settings.deferred_fake_backend:
+            _batch_backend = FakeBatchBackend()
+        else:
+            _batch_backend = OpenAIBatchBackend(client)
+    return _batch_backend
@@ -0,0 +1,51 @@
+# app/services/answer_cache.py
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.compression import load_answer
+from app.db.models import Task, User
+from app.services.lru import LRUCache
+
+# task_id -> (telegram_user_id владельца, текст ответа)
+_cache: LRUCache[int, tuple[int, str]] = LRUCache(settings.answer_cache_size)
+
+
+def remember_answer(task_id: int, owner_tg_id: int, answer_text: str) -> None:
+    _cache.put(task_id, (owner_tg_id, answer_text))
+
+
+async def get_answer_text(
+    session: AsyncSession,
+    task_id: int,
+    owner_tg_id: int,
+) -> Optional[str]:
+    """
+    Текст решения для кнопки «Получить в текстовом формате».
+    Сначала смотрим в LRU, затем берём из БД только колонки ответа, и только если
+    задача принадлежит этому пользователю (PK tasks + уникальный индекс users).
+    """
+    cached = _cache.get(task_id)
+    if cached is not None:
+        owner, answer_text = cached
+        return answer_text if owner == owner_tg_id else None
+
+    stmt = (
+        select(Task.answer_text, Task.answer_compressed)
+        .join(User, User.id == Task.user_id)
+        .where(Task.id == task_id, User.telegram_user_id == owner_tg_id)
+    )
+    result = await session.execute(stmt)
+    row = result.one_or_none()
+    if row is None:
+        return None
+    answer_text = load_answer(*row)
+    remember_answer(task_id, owner_tg_id, answer_text)
+    return answer_text
+
+
+def cache_stats() -> tuple[int, int, int]:
+    """(записей, попаданий, промахов)"""
+    return len(_cache), _cache.hits, _cache.misses
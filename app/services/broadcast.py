@@ -0,0 +1,390 @@
+# app/services/broadcast.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from sqlalchemy import func, select, update
+
+from app.config import settings
+from app.db.models import Broadcast, User
+from app.db.session import get_session
+from app.keyboards import inline_broadcast_stop_keyboard
+from app.services.state_backend import get_state_backend
+
+logger = logging.getLogger(__name__)
+
+# Как часто сохранять чекпоинт и обновлять сообщение с прогрессом
+CHECKPOINT_INTERVAL = 3.0
+# Сколько получателей тянуть из курсора за раз
+STREAM_BATCH = 500
+# Попыток на одного получателя (retry_after и сетевые ошибки)
+MAX_ATTEMPTS = 5
+# Рассылку ведёт одна реплика; блокировка держится не дольше этого
+BROADCAST_LOCK_TIMEOUT = 6 * 60 * 60
+
+# broadcast_id -> событие остановки, для рассылок этого процесса
+_running: dict[int, asyncio.Event] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+class RatePacer:
+    """
+    Общий темп для всех воркеров: слоты раздаются строго через 1/rate секунд,
+    поэтому N воркеров вместе не превышают rate сообщений в секунду.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._paused_until = 0.0
+
+    async def wait(self) -> None:
+        while True:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # слот выдали до retry_after, а наступил он уже внутри паузы —
+            # не шлём, берём новый после неё
+            if time.monotonic() >= self._paused_until:
+                return
+
+    def pause(self, seconds: float) -> None:
+        """Telegram попросил подождать (retry_after) — притормаживаем всех."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._next = max(self._next, self._paused_until)
+
+
+@dataclass
+class _Progress:
+    delivered: int
+    blocked: int
+    failed: int
+    checkpoint: int
+    pending: set[int] = field(default_factory=set)
+    dispatched_max: int = 0
+
+    def dispatch(self, user_id: int) -> None:
+        self.pending.add(user_id)
+        self.dispatched_max = user_id
+
+    def done(self, user_id: int, outcome: str) -> None:
+        self.pending.discard(user_id)
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def safe_checkpoint(self) -> int:
+        """Наибольший users.id, до которого включительно всё уже отправлено."""
+        if self.pending:
+            return min(self.pending) - 1
+        return max(self.dispatched_max, self.checkpoint)
+
+
+def progress_text(broadcast: Broadcast, progress: _Progress | None = None) -> str:
+    delivered = progress.delivered if progress else broadcast.delivered
+    blocked = progress.blocked if progress else broadcast.blocked
+    failed = progress.failed if progress else broadcast.failed
+    done = delivered + blocked + failed
+    status = {
+        "running": "идёт📣",
+        "done": "завершена✅",
+        "cancelled": "остановлена⛔",
+        "failed": "не запустилась❌",
+    }.get(broadcast.status, broadcast.status)
+    return (
+        f"Рассылка #{broadcast.id}: {status}\n"
+        f"Обработано: {done} из {broadcast.total}\n"
+        f"Доставлено: {delivered}\n"
+        f"Заблокировали бота: {blocked}\n"
+        f"Ошибки: {failed}"
+    )
+
+
+async def _deliver(bot: Bot, pacer: RatePacer, chat_id: int, text: str) -> str:
+    for _ in range(MAX_ATTEMPTS):
+        await pacer.wait()
+        try:
+            await bot.send_message(chat_id, text)
+            return "delivered"
+        except TelegramRetryAfter as e:
+            pacer.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except (TelegramBadRequest, TelegramNotFound):
+            # чат удалён / пользователь деактивирован
+            return "failed"
+        except (TelegramNetworkError, TelegramServerError):
+            await asyncio.sleep(1)
+    return "failed"
+
+
+async def create_broadcast(text: str, admin_chat_id: int) -> Broadcast:
+    async with get_session() as session:
+        total = (await session.execute(select(func.count(User.id)))).scalar_one()
+        broadcast = Broadcast(
+            text=text,
+            status="running",
+            created_at=datetime.now(ZoneInfo(settings.moscow_tz)),
+            admin_chat_id=admin_chat_id,
+            total=total,
+            last_user_id=0,
+            delivered=0,
+            blocked=0,
+            failed=0,
+        )
+        session.add(broadcast)
+        await session.commit()
+        await session.refresh(broadcast)
+    return broadcast
+
+
+async def set_progress_message(broadcast_id: int, message_id: int) -> None:
+    async with get_session() as session:
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(progress_message_id=message_id)
+        )
+        await session.commit()
+
+
+async def _save_checkpoint(
+    broadcast_id: int,
+    progress: _Progress,
+    status: str | None = None,
+) -> Broadcast:
+    values = dict(
+        last_user_id=progress.safe_checkpoint(),
+        delivered=progress.delivered,
+        blocked=progress.blocked,
+        failed=progress.failed,
+    )
+    if status is not None:
+        values["status"] = status
+        values["finished_at"] = datetime.now(ZoneInfo(settings.moscow_tz))
+    async with get_session() as session:
+        await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id).values(**values)
+        )
+        await session.commit()
+        return await session.get(Broadcast, broadcast_id, populate_existing=True)
+
+
+async def _show_progress(
+    bot: Bot, broadcast: Broadcast, progress: _Progress | None
+) -> None:
+    if not broadcast.progress_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            text=progress_text(broadcast, progress),
+            chat_id=broadcast.admin_chat_id,
+            message_id=broadcast.progress_message_id,
+            reply_markup=(
+                inline_broadcast_stop_keyboard(broadcast.id)
+                if broadcast.status == "running"
+                else None
+            ),
+        )
+    except TelegramBadRequest:
+        # «message is not modified» и т.п. — прогресс не критичен
+        pass
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int) -> None:
+    """
+    Рассылка с чекпоинтами: получатели идут по users.id через серверный курсор,
+    воркеры шлют в общем темпе. После рестарта продолжаем с last_user_id —
+    повторно сообщение могут получить только те, кто был «в полёте».
+    """
+    async with get_session() as session:
+        broadcast = await session.get(Broadcast, broadcast_id)
+    if broadcast is None or broadcast.status != "running":
+        return
+
+    stop = _running.setdefault(broadcast_id, asyncio.Event())
+    progress = _Progress(
+        delivered=broadcast.delivered,
+        blocked=broadcast.blocked,
+        failed=broadcast.failed,
+        checkpoint=broadcast.last_user_id,
+    )
+    pacer = RatePacer(settings.broadcast_rate)
+    workers = settings.broadcast_workers
+    queue: asyncio.Queue[tuple[int, int] | None] = asyncio.Queue(maxsize=workers * 4)
+
+    async def producer() -> None:
+        async with get_session(read_only=True) as session:
+            result = await session.stream(
+                select(User.id, User.telegram_user_id)
+                .where(User.id > broadcast.last_user_id)
+                .order_by(User.id)
+                .execution_options(yield_per=STREAM_BATCH)
+            )
+            async for user_id, tg_id in result:
+                if stop.is_set():
+                    break
+                progress.dispatch(user_id)
+                await queue.put((user_id, tg_id))
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def worker() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            user_id, tg_id = item
+            if stop.is_set():
+                continue
+            outcome = await _deliver(bot, pacer, tg_id, broadcast.text)
+            progress.done(user_id, outcome)
+
+    async def reporter() -> None:
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            current = await _save_checkpoint(broadcast_id, progress)
+            if current.status != "running":
+                # остановили с другой реплики / из админки
+                stop.set()
+            await _show_progress(bot, current, progress)
+
+    tasks = [
+        asyncio.create_task(producer()),
+        *(asyncio.create_task(worker()) for _ in range(workers)),
+    ]
+    reporter_task = asyncio.create_task(reporter())
+    completed = False
+    try:
+        await asyncio.gather(*tasks)
+        completed = True
+    finally:
+        for task in (*tasks, reporter_task):
+            task.cancel()
+        await asyncio.gather(*tasks, reporter_task, return_exceptions=True)
+        _running.pop(broadcast_id, None)
+
+        if stop.is_set():
+            final_status = "cancelled"
+        elif completed:
+            final_status = "done"
+        else:
+            # рестарт или сбой — оставляем running, продолжим с чекпоинта
+            final_status = None
+        final = await _save_checkpoint(broadcast_id, progress, status=final_status)
+        await _show_progress(bot, final, progress)
+        logger.info(
+            "broadcast finished",
+            extra={
+                "broadcast_id": broadcast_id,
+                "status": final.status,
+                "delivered": progress.delivered,
+                "blocked": progress.blocked,
+                "failed": progress.failed,
+            },
+        )
+
+
+async def _mark_failed(bot: Bot, broadcast_id: int) -> None:
+    async with get_session() as session:
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+            .values(
+                status="failed",
+                finished_at=datetime.now(ZoneInfo(settings.moscow_tz)),
+            )
+        )
+        await session.commit()
+        broadcast = await session.get(Broadcast, broadcast_id)
+    if broadcast is not None:
+        await _show_progress(bot, broadcast, None)
+
+
+async def _run_locked(bot: Bot, broadcast_id: int) -> None:
+    async with get_state_backend().lock(
+        f"broadcast:{broadcast_id}", timeout=BROADCAST_LOCK_TIMEOUT, wait=0
+    ) as acquired:
+        if not acquired:
+            if broadcast_id in _running:
+                # повторный запуск в этом же процессе — рассылка уже идёт
+                logger.info(
+                    "broadcast already running", extra={"broadcast_id": broadcast_id}
+                )
+            elif settings.redis_url:
+                # блокировка общая — рассылку ведёт другая реплика
+                logger.info(
+                    "broadcast owned by another replica",
+                    extra={"broadcast_id": broadcast_id},
+                )
+            else:
+                # реплика одна, а блокировку держит неизвестно кто — не оставляем
+                # рассылку вечно running, иначе она будет всплывать на каждом старте
+                logger.error(
+                    "broadcast lock unavailable", extra={"broadcast_id": broadcast_id}
+                )
+                await _mark_failed(bot, broadcast_id)
+            return
+        # сразу, до первого запроса в БД — чтобы повторный запуск это видел
+        _running.setdefault(broadcast_id, asyncio.Event())
+        try:
+            await run_broadcast(bot, broadcast_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("broadcast crashed", extra={"broadcast_id": broadcast_id})
+        finally:
+            _running.pop(broadcast_id, None)
+
+
+def start_broadcast(bot: Bot, broadcast_id: int) -> None:
+    task = asyncio.create_task(_run_locked(bot, broadcast_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def resume_broadcasts(bot: Bot) -> None:
+    """На старте подхватываем рассылки, прерванные рестартом."""
+    async with get_session() as session:
+        result = await session.execute(
+            select(Broadcast.id).where(Broadcast.status == "running")
+        )
+        ids = list(result.scalars().all())
+    for broadcast_id in ids:
+        logger.info("resuming broadcast", extra={"broadcast_id": broadcast_id})
+        start_broadcast(bot, broadcast_id)
+
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    """Останавливает рассылку (на любой реплике — через статус в БД)."""
+    async with get_session() as session:
+        result = await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+            .values(status="cancelled")
+            .returning(Broadcast.id)
+        )
+        changed = result.scalar_one_or_none() is not None
+        await session.commit()
+    event = _running.get(broadcast_id)
+    if event is not None:
+        event.set()
+    return changed
+
+
+async def shutdown_broadcasts() -> None:
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,428 @@
+# app/services/deferred.py
+"""
+Отложенный режим «решить к утру».
+
+handle_photo кладёт фото в deferred_tasks, а фоновый цикл:
+1) собирает pending-задания в один батч (Batch API, половина цены) —
+   когда их набралось DEFERRED_MIN_BATCH или самое старое ждёт дольше
+   DEFERRED_MAX_WAIT;
+2) опрашивает отправленные батчи и досылает готовые решения.
+
+Статусы: pending -> submitting -> submitted -> done | failed.
+submitting ставится до отправки батча: если процесс упал между отправкой
+и записью batch_id, такие задания не уходят в батч второй раз (и второй раз
+не оплачиваются), а закрываются как failed.
+"""
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta
+from io import BytesIO
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from sqlalchemy import func, select, update
+
+from app.config import settings
+from app.db.models import DeferredTask, Task, User
+from app.db.session import get_session
+from app.keyboards import inline_task_text_keyboard
+from app.services.ai_client import (
+    BatchBackend,
+    VisionResult,
+    build_vision_request,
+    get_batch_backend,
+)
+from app.services.answer_cache import remember_answer
+from app.services.limits import add_token_usage
+from app.services.solution_files import (
+    PreparedSolution,
+    prepare_solution,
+    send_solution,
+)
+from app.services.state_backend import get_state_backend
+from app.services.stats import bump_rollup
+
+logger = logging.getLogger(__name__)
+
+# Сколько фото качаем из Telegram одновременно при сборке батча
+DOWNLOAD_CONCURRENCY = 8
+
+
+async def enqueue_deferred(
+    user: User,
+    chat_id: int,
+    message_id: int | None,
+    telegram_file_id: str,
+    caption: str | None,
+    max_tokens: int,
+    now_moscow: datetime,
+) -> int:
+    """Ставит фото в очередь. Картинку не храним — заберём по file_id."""
+    async with get_session() as session:
+        item = DeferredTask(
+            user_id=user.id,
+            chat_id=chat_id,
+            message_id=message_id,
+            telegram_file_id=telegram_file_id,
+            caption=caption,
+            is_premium=user.is_premium,
+            max_tokens=max_tokens,
+            status="pending",
+            created_at=now_moscow,
+        )
+        session.add(item)
+        await session.commit()
+        return item.id
+
+
+async def count_waiting(user_id: int) -> int:
+    async with get_session() as session:
+        result = await session.execute(
+            select(func.count(DeferredTask.id)).where(
+                DeferredTask.user_id == user_id,
+                DeferredTask.status.in_(("pending", "submitting", "submitted")),
+            )
+        )
+        return result.scalar_one()
+
+
+async def _download(bot: Bot, file_id: str) -> bytes:
+    buf = BytesIO()
+    await bot.download(file_id, buf)
+    return buf.getvalue()
+
+
+async def submit_pending(
+    bot: Bot,
+    backend: BatchBackend,
+    now_moscow: datetime,
+) -> int:
+    """Отправляет накопившиеся задания одним батчем. Возвращает их число."""
+    await _fail_interrupted(bot, now_moscow)
+    async with get_session() as session:
+        result = await session.execute(
+            select(DeferredTask)
+            .where(DeferredTask.status == "pending")
+            .order_by(DeferredTask.created_at, DeferredTask.id)
+            .limit(settings.deferred_batch_size)
+        )
+        items = list(result.scalars().all())
+    if not items:
+        return 0
+    oldest_wait = now_moscow - items[0].created_at
+    if len(items) < settings.deferred_min_batch and oldest_wait < timedelta(
+        seconds=settings.deferred_max_wait
+    ):
+        return 0
+
+    semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    async def build(item: DeferredTask):
+        async with semaphore:
+            try:
+                image_bytes = await _download(bot, item.telegram_file_id)
+            except Exception:
+                logger.exception(
+                    "deferred photo download failed",
+                    extra={"deferred_id": item.id},
+                )
+                return None
+        return str(item.id), build_vision_request(
+            image_bytes, item.caption, item.max_tokens
+        )
+
+    built = await asyncio.gather(*(build(item) for item in items))
+    requests = [request for request in built if request is not None]
+    lost = [item for item, request in zip(items, built) if request is None]
+    request_ids = [int(cid) for cid, _ in requests]
+
+    batch_id = None
+    if requests:
+        # Сначала помечаем, потом отправляем: упадём между submit и записью
+        # batch_id — задания останутся submitting, а не pending, и повторно
+        # в батч не попадут
+        await _set_status(request_ids, "submitting", expected="pending")
+        try:
+            batch_id = await backend.submit(requests)
+        except Exception:
+            await _set_status(request_ids, "pending", expected="submitting")
+            raise
+    async with get_session() as session:
+        if batch_id is not None:
+            await session.execute(
+                update(DeferredTask)
+                .where(DeferredTask.id.in_(request_ids))
+                .values(status="submitted", batch_id=batch_id)
+            )
+        if lost:
+            await session.execute(
+                update(DeferredTask)
+                .where(DeferredTask.id.in_([item.id for item in lost]))
+                .values(
+                    status="failed",
+                    error="download failed",
+                    finished_at=now_moscow,
+                )
+            )
+        await session.commit()
+
+    for item in lost:
+        await _notify_failed(bot, item)
+    logger.info(
+        "deferred batch submitted",
+        extra={"batch_id": batch_id, "tasks": len(requests), "lost": len(lost)},
+    )
+    return len(requests)
+
+
+async def _set_status(ids: list[int], status: str, expected: str) -> None:
+    async with get_session() as session:
+        await session.execute(
+            update(DeferredTask)
+            .where(DeferredTask.id.in_(ids), DeferredTask.status == expected)
+            .values(status=status)
+        )
+        await session.commit()
+
+
+async def _fail_interrupted(bot: Bot, now_moscow: datetime) -> None:
+    """
+    submitting в начале цикла — наследство упавшего процесса: цикл идёт под
+    блокировкой и сам такой статус не оставляет. Ушёл ли батч, неизвестно,
+    поэтому второй раз не отправляем, а просим прислать фото заново.
+    """
+    async with get_session() as session:
+        result = await session.execute(
+            update(DeferredTask)
+            .where(DeferredTask.status == "submitting")
+            .values(
+                status="failed",
+                error="submit interrupted",
+                finished_at=now_moscow,
+            )
+            .returning(DeferredTask)
+        )
+        items = list(result.scalars().all())
+        await session.commit()
+    for item in items:
+        logger.warning("deferred submit interrupted", extra={"deferred_id": item.id})
+        await _notify_failed(bot, item)
+
+
+async def _notify_failed(bot: Bot, item: DeferredTask) -> None:
+    try:
+        await bot.send_message(
+            item.chat_id,
+            "❌ Не получилось решить отложенное фото. Пришли его ещё раз, пожалуйста.",
+            reply_to_message_id=item.message_id,
+            allow_sending_without_reply=True,
+        )
+    except Exception:
+        logger.exception("deferred notify failed", extra={"deferred_id": item.id})
+
+
+async def _save_solution(
+    item: DeferredTask,
+    vision: VisionResult,
+    now_moscow: datetime,
+) -> tuple[int, PreparedSolution]:
+    """Сохраняет решение как обычную задачу и закрывает задание как done."""
+    prepared = await prepare_solution(vision.text)
+
+    async with get_session() as session:
+        owner_tg_id = (
+            await session.execute(
+                select(User.telegram_user_id).where(User.id == item.user_id)
+            )
+        ).scalar_one()
+        task = Task(
+            user_id=item.user_id,
+            created_at=now_moscow,
+            is_premium=item.is_premium,
+            telegram_file_id=item.telegram_file_id,
+            answer_text=vision.text,
+            prompt_tokens=vision.prompt_tokens,
+            completion_tokens=vision.completion_tokens,
+            cached_tokens=vision.cached_tokens,
+            answer_hash=prepared.answer_hash,
+            solution_file_id=prepared.file_id,
+        )
+        session.add(task)
+        # В бюджет идёт только часть токенов — пакетный режим вдвое дешевле.
+        # Списываем на день постановки в очередь: тогда и проверялся лимит.
+        await add_token_usage(
+            session=session,
+            user_id=item.user_id,
+            now_moscow=item.created_at.astimezone(ZoneInfo(settings.moscow_tz)),
+            tokens=math.ceil(vision.total_tokens * settings.deferred_cost_factor),
+        )
+        await bump_rollup(
+            session,
+            now_moscow.date(),
+            photos=1,
+            premium_photos=int(item.is_premium),
+            prompt_tokens=vision.prompt_tokens,
+            completion_tokens=vision.completion_tokens,
+        )
+        await session.flush()
+        await session.execute(
+            update(DeferredTask)
+            .where(DeferredTask.id == item.id)
+            .values(status="done", task_id=task.id, finished_at=now_moscow)
+        )
+        await session.commit()
+        task_id = task.id
+
+    remember_answer(task_id, owner_tg_id, vision.text)
+    return task_id, prepared
+
+
+async def _deliver(
+    bot: Bot,
+    item: DeferredTask,
+    task_id: int,
+    prepared: PreparedSolution,
+    answer_text: str,
+) -> None:
+    """
+    Присылает сохранённое решение. Задание уже done и лимит списан, поэтому
+    при сбое отправки не просим прислать фото заново: пишем ошибку в задание
+    и коротким сообщением даём открыть решение текстом.
+    """
+    try:
+        await send_solution(
+            bot,
+            item.chat_id,
+            prepared,
+            answer_text=answer_text,
+            task_id=task_id,
+            caption="Готово! Решение отложенного задания🌙👇",
+            reply_markup=inline_task_text_keyboard(task_id),
+            reply_to_message_id=item.message_id,
+            allow_sending_without_reply=True,
+        )
+        return
+    except Exception:
+        logger.exception(
+            "deferred delivery failed",
+            extra={"deferred_id": item.id, "task_id": task_id},
+        )
+
+    async with get_session() as session:
+        await session.execute(
+            update(DeferredTask)
+            .where(DeferredTask.id == item.id)
+            .values(error="delivery failed")
+        )
+        await session.commit()
+    try:
+        await bot.send_message(
+            item.chat_id,
+            "Решение отложенного задания готово🌙, но картинку отправить "
+            "не вышло. Открой его кнопкой ниже или в «Мои решения».",
+            reply_markup=inline_task_text_keyboard(task_id),
+            reply_to_message_id=item.message_id,
+            allow_sending_without_reply=True,
+        )
+    except Exception:
+        logger.exception("deferred fallback failed", extra={"deferred_id": item.id})
+
+
+async def collect_results(
+    bot: Bot,
+    backend: BatchBackend,
+    now_moscow: datetime,
+) -> int:
+    """Опрашивает отправленные батчи и досылает готовое. Возвращает число решений."""
+    async with get_session() as session:
+        result = await session.execute(
+            select(DeferredTask.batch_id)
+            .where(DeferredTask.status == "submitted")
+            .distinct()
+        )
+        batch_ids = list(result.scalars().all())
+
+    delivered = 0
+    for batch_id in batch_ids:
+        poll = await backend.poll(batch_id)
+        if not poll.done:
+            continue
+
+        async with get_session() as session:
+            result = await session.execute(
+                select(DeferredTask).where(
+                    DeferredTask.batch_id == batch_id,
+                    DeferredTask.status == "submitted",
+                )
+            )
+            items = list(result.scalars().all())
+
+        for item in items:
+            vision = poll.results.get(str(item.id))
+            if vision is not None:
+                try:
+                    task_id, prepared = await _save_solution(item, vision, now_moscow)
+                except Exception:
+                    logger.exception(
+                        "deferred save failed", extra={"deferred_id": item.id}
+                    )
+                    error = "save failed"
+                else:
+                    await _deliver(bot, item, task_id, prepared, vision.text)
+                    delivered += 1
+                    continue
+            else:
+                error = poll.errors.get(str(item.id)) or f"batch {poll.status}"
+
+            async with get_session() as session:
+                await session.execute(
+                    update(DeferredTask)
+                    .where(DeferredTask.id == item.id)
+                    .values(status="failed", error=error, finished_at=now_moscow)
+                )
+                await session.commit()
+            await _notify_failed(bot, item)
+
+        logger.info(
+            "deferred batch collected",
+            extra={
+                "batch_id": batch_id,
+                "status": poll.status,
+                "results": len(poll.results),
+                "errors": len(poll.errors),
+            },
+        )
+    return delivered
+
+
+async def run_deferred_cycle(bot: Bot, backend: BatchBackend | None = None) -> dict:
+    backend = backend or get_batch_backend()
+    now_moscow = datetime.now(ZoneInfo(settings.moscow_tz))
+    return {
+        "delivered": await collect_results(bot, backend, now_moscow),
+        "submitted": await submit_pending(bot, backend, now_moscow),
+    }
+
+
+async def deferred_loop(bot: Bot) -> None:
+    """
+    Планировщик отложенных заданий раз в DEFERRED_POLL_INTERVAL секунд.
+    При нескольких репликах работает только та, что взяла блокировку.
+    """
+    state_backend = get_state_backend()
+    while True:
+        await asyncio.sleep(settings.deferred_poll_interval)
+        try:
+            async with state_backend.lock(
+                "deferred", timeout=settings.deferred_poll_interval * 5, wait=0
+            ) as acquired:
+                if not acquired:
+                    continue
+                report = await run_deferred_cycle(bot)
+                if report["delivered"] or report["submitted"]:
+                    logger.info("deferred cycle done", extra=report)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("deferred cycle failed")
@@ -0,0 +1,163 @@
+# app/services/exercise_cache.py
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.models import ExerciseAnswer
+from app.services.image_quality import hamming_distance
+
+# Сколько последних ответов по одному ключу сверяем с картинкой
+CANDIDATES_PER_KEY = 10
+
+# Разметка и пробелы не делают ответы разными
+_ANSWER_NOISE_RE = re.compile(r"[\s*_`#]+")
+
+
+@dataclass
+class ExerciseCacheStats:
+    lookups: int = 0
+    hits: int = 0
+    key_misses: int = 0      # ключ есть, но ответов по нему нет
+    image_mismatches: int = 0  # ответы есть, но фото не похоже
+    unconfirmed: int = 0     # фото похоже, но ответы ещё не сошлись
+    stored: int = 0
+    invalidated: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+stats = ExerciseCacheStats()
+
+
+def _to_bigint(value: int) -> int:
+    """64-битный хэш -> знаковое значение для колонки BIGINT."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+async def find_cached_answer(
+    session: AsyncSession,
+    key: str,
+    image_hash: int,
+    now_moscow: datetime,
+) -> ExerciseAnswer | None:
+    """
+    Ищет свежий ответ по ключу упражнения с похожей картинкой.
+    Отдаёт его, только когда столько же независимых ответов OpenAI на похожие
+    фото совпали (EXERCISE_CACHE_MIN_AGREEMENT): один ответ мог быть ошибкой
+    модели или относиться к другому учебнику с той же страницей и номером.
+    """
+    stats.lookups += 1
+    since = now_moscow - timedelta(days=settings.exercise_cache_ttl_days)
+    stmt = (
+        select(ExerciseAnswer)
+        .where(ExerciseAnswer.key == key, ExerciseAnswer.created_at >= since)
+        .order_by(ExerciseAnswer.created_at.desc())
+        .limit(CANDIDATES_PER_KEY)
+    )
+    result = await session.execute(stmt)
+    candidates = result.scalars().all()
+    if not candidates:
+        stats.key_misses += 1
+        return None
+
+    similar = [
+        c
+        for c in candidates
+        if hamming_distance(c.image_hash, image_hash)
+        <= settings.exercise_cache_max_distance
+    ]
+    if not similar:
+        stats.image_mismatches += 1
+        return None
+
+    best = _agreed_answer(similar)
+    if best is None:
+        stats.unconfirmed += 1
+        return None
+
+    await session.execute(
+        update(ExerciseAnswer)
+        .where(ExerciseAnswer.id == best.id)
+        .values(hits=ExerciseAnswer.hits + 1)
+    )
+    await session.commit()
+    stats.hits += 1
+    return best
+
+
+def _answer_fingerprint(answer_text: str) -> str:
+    text = answer_text.casefold().replace("ё", "е")
+    return _ANSWER_NOISE_RE.sub("", text)
+
+
+def _agreed_answer(similar: list[ExerciseAnswer]) -> ExerciseAnswer | None:
+    """Самый свежий из ответов, с которым согласны не меньше N записей."""
+    groups: dict[str, list[ExerciseAnswer]] = defaultdict(list)
+    for candidate in similar:
+        groups[_answer_fingerprint(candidate.answer_text)].append(candidate)
+    agreed = [
+        group
+        for group in groups.values()
+        if len(group) >= settings.exercise_cache_min_agreement
+    ]
+    if not agreed:
+        return None
+    # similar отсортированы от новых к старым
+    return max(agreed, key=len)[0]
+
+
+def add_cached_answer(
+    session: AsyncSession,
+    key: str,
+    image_hash: int,
+    answer_text: str,
+    task_id: int | None,
+    now_moscow: datetime,
+) -> None:
+    """
+    Кладёт ответ в кэш (commit — на вызывающем). Каждый свежий ответ —
+    отдельная запись: это голос за ответ, отдавать его начнём после согласия.
+    """
+    session.add(
+        ExerciseAnswer(
+            key=key,
+            task_id=task_id,
+            image_hash=_to_bigint(image_hash),
+            answer_text=answer_text,
+            created_at=now_moscow,
+            hits=0,
+        )
+    )
+    stats.stored += 1
+
+
+async def invalidate(session: AsyncSession, key: str | None = None) -> int:
+    """Удаляет ответы по ключу, а без ключа — весь кэш. Возвращает число строк."""
+    stmt = delete(ExerciseAnswer)
+    if key is not None:
+        stmt = stmt.where(ExerciseAnswer.key == key)
+    result = await session.execute(stmt)
+    await session.commit()
+    stats.invalidated += result.rowcount or 0
+    return result.rowcount or 0
+
+
+async def purge_expired(session: AsyncSession, now_moscow: datetime) -> int:
+    since = now_moscow - timedelta(days=settings.exercise_cache_ttl_days)
+    result = await session.execute(
+        delete(ExerciseAnswer).where(ExerciseAnswer.created_at < since)
+    )
+    await session.commit()
+    return result.rowcount or 0
+
+
+async def count_entries(session: AsyncSession) -> int:
+    result = await session.execute(select(func.count(ExerciseAnswer.id)))
+    return result.scalar_one()
@@ -0,0 +1,116 @@
+# app/services/exercise_key.py
+import re
+from typing import Optional
+
+# Предмет по корню слова: «алгебра», «по алгебре», «алг.» -> algebra
+_SUBJECTS = {
+    "algebra": r"алгебр|алг\.",
+    "geometry": r"геометр|геом\.",
+    "math": r"математ|матем",
+    "russian": r"русск|рус\.\s*яз",
+    "english": r"англ",
+    "physics": r"физик",
+    "chemistry": r"хими",
+    "biology": r"биолог",
+    "history": r"истори",
+    "geography": r"географ",
+    "literature": r"литератур",
+}
+_SUBJECT_RES = {
+    name: re.compile(pattern, re.IGNORECASE) for name, pattern in _SUBJECTS.items()
+}
+
+_NUM = r"(\d{1,4}(?:[.,]\d{1,3})?(?:\s*\(?[а-яa-z]\))?)"
+_GRADE_RE = re.compile(r"(\d{1,2})\s*(?:-?й\s*)?кл(?:асс|\.|\b)", re.IGNORECASE)
+_PAGE_RE = re.compile(r"(?:\bстр(?:аница|\.)?|\bс\.)\s*" + r"(\d{1,4})", re.IGNORECASE)
+_PARAGRAPH_RE = re.compile(r"(?:§|\bпараграф|\bп\.)\s*(\d{1,3})", re.IGNORECASE)
+_EXERCISE_RE = re.compile(
+    r"(?:№|\bномер(?:а)?|\bупр(?:ажнение|\.)?|\bзадани[ея]|\bзадач[аи]|\bзад\.|\bпример)"
+    r"\s*" + _NUM + r"((?:\s*(?:,|и)\s*" + _NUM + r")*)",
+    re.IGNORECASE,
+)
+_LIST_SPLIT_RE = re.compile(r"\s*(?:,|и)\s*", re.IGNORECASE)
+# Номер без «№/упр»: «реши 1, 2, 5», «5.12»
+_BARE_NUMBER_RE = re.compile(r"\d+(?:\.\d+)*")
+
+
+def _norm_number(raw: str) -> str:
+    raw = raw.lower().replace(",", ".")
+    return re.sub(r"[\s()]", "", raw)
+
+
+def _exercise_numbers(caption: str) -> list[str]:
+    numbers: list[str] = []
+    for match in _EXERCISE_RE.finditer(caption):
+        numbers.append(_norm_number(match.group(1)))
+        tail = match.group(2)
+        if tail:
+            numbers.extend(
+                _norm_number(part)
+                for part in _LIST_SPLIT_RE.split(tail.strip(" ,"))
+                if part
+            )
+    # порядок номеров в подписи не важен, дубликаты тоже
+    return sorted(set(numbers))
+
+
+def count_exercises(caption: Optional[str]) -> int:
+    """
+    Сколько заданий просят решить. Класс, страница и параграф — это адрес в
+    учебнике, а не задания: «7 класс стр 78 №3» — одно задание, «реши 1, 2, 5» —
+    три.
+    """
+    if not caption:
+        return 0
+    text = caption.replace("ё", "е").replace("Ё", "Е")
+    numbers = _exercise_numbers(text)
+    if numbers:
+        return len(numbers)
+    for pattern in (_GRADE_RE, _PAGE_RE, _PARAGRAPH_RE):
+        text = pattern.sub(" ", text)
+    return len(_BARE_NUMBER_RE.findall(text))
+
+
+def normalize_exercise_key(caption: Optional[str]) -> Optional[str]:
+    """
+    Достаёт из подписи идентификатор упражнения: предмет, класс, страницу,
+    параграф и номера. «Алгебра 7 класс, стр 78 упр 3» и «упр.3 стр.78 алгебра
+    7 кл» дают один ключ. Без номера упражнения, без предмета или класса,
+    а также без страницы или пары «предмет + класс» ключа нет — кэш не
+    используем.
+    """
+    if not caption:
+        return None
+    text = caption.replace("ё", "е").replace("Ё", "Е")
+
+    numbers = _exercise_numbers(text)
+    if not numbers:
+        return None
+
+    subject = next(
+        (name for name, pattern in _SUBJECT_RES.items() if pattern.search(text)),
+        None,
+    )
+    grade = _GRADE_RE.search(text)
+    page = _PAGE_RE.search(text)
+    # «номер 1» без учебника общий для всех книг — одного dHash мало, чтобы
+    # не отдать ответ из чужого учебника. Нужна страница или предмет + класс,
+    # и «стр. 12» одной мало: двенадцатая страница есть в каждом учебнике.
+    if subject is None and grade is None:
+        return None
+    if page is None and (subject is None or grade is None):
+        return None
+
+    parts: list[str] = []
+    if subject:
+        parts.append(f"subj={subject}")
+    if grade:
+        parts.append(f"grade={int(grade.group(1))}")
+    if page:
+        parts.append(f"p={int(page.group(1))}")
+    paragraph = _PARAGRAPH_RE.search(text)
+    if paragraph:
+        parts.append(f"par={int(paragraph.group(1))}")
+
+    parts.append("ex=" + ",".join(numbers))
+    return "|".join(parts)
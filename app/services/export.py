@@ -0,0 +1,269 @@
+# app/services/export.py
+"""
+Выгрузка tasks / users / daily_usage за период в gzip CSV или JSONL.
+
+Строки идут из серверного курсора пачками, каждая пачка кодируется и
+дожимается в потоковый gzip прямо в SpooledTemporaryFile (в памяти до
+SPOOL_MAX_SIZE, дальше — на диске). Память не растёт с числом строк.
+"""
+import asyncio
+import csv
+import io
+import json
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta
+from tempfile import SpooledTemporaryFile
+from typing import Any, AsyncGenerator, Callable, Iterable
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+from sqlalchemy import select
+
+from app.config import settings
+from app.db.compression import load_answer
+from app.db.models import DailyUsage, Task, User
+from app.db.session import get_session
+
+EXPORT_FORMATS = ("csv", "jsonl")
+# Строк из курсора за раз
+EXPORT_BATCH = 2000
+# До этого размера сжатый файл живёт в памяти, дальше уходит на диск
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# Telegram не примет документ больше 50 МБ
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+
+@dataclass
+class ExportTable:
+    columns: list[str]
+    query: Callable[[datetime, datetime], Any]
+    convert: Callable[[tuple], tuple] = tuple
+
+
+def _tasks_query(start: datetime, end: datetime):
+    return (
+        select(
+            Task.id,
+            Task.user_id,
+            Task.created_at,
+            Task.is_premium,
+            Task.prompt_tokens,
+            Task.completion_tokens,
+            Task.cached_tokens,
+            Task.telegram_file_id,
+            Task.answer_text,
+            Task.answer_compressed,
+        )
+        .where(Task.created_at >= start, Task.created_at < end)
+        .order_by(Task.created_at, Task.id)
+    )
+
+
+def _tasks_convert(row: tuple) -> tuple:
+    *head, answer_text, answer_compressed = row
+    return (*head, load_answer(answer_text, answer_compressed))
+
+
+def _users_query(start: datetime, end: datetime):
+    return (
+        select(
+            User.id,
+            User.telegram_user_id,
+            User.username,
+            User.first_seen_at,
+            User.is_premium,
+            User.premium_since,
+            User.deferred_mode,
+        )
+        .where(User.first_seen_at >= start, User.first_seen_at < end)
+        .order_by(User.id)
+    )
+
+
+def _daily_usage_query(start: datetime, end: datetime):
+    return (
+        select(
+            DailyUsage.id,
+            DailyUsage.user_id,
+            DailyUsage.date,
+            DailyUsage.used_requests,
+            DailyUsage.used_tokens,
+            DailyUsage.used_deferred,
+        )
+        .where(DailyUsage.date >= start.date(), DailyUsage.date < end.date())
+        .order_by(DailyUsage.date, DailyUsage.id)
+    )
+
+
+EXPORT_TABLES: dict[str, ExportTable] = {
+    "tasks": ExportTable(
+        columns=[
+            "id",
+            "user_id",
+            "created_at",
+            "is_premium",
+            "prompt_tokens",
+            "completion_tokens",
+            "cached_tokens",
+            "telegram_file_id",
+            "answer",
+        ],
+        query=_tasks_query,
+        convert=_tasks_convert,
+    ),
+    "users": ExportTable(
+        columns=[
+            "id",
+            "telegram_user_id",
+            "username",
+            "first_seen_at",
+            "is_premium",
+            "premium_since",
+            "deferred_mode",
+        ],
+        query=_users_query,
+    ),
+    "daily_usage": ExportTable(
+        columns=[
+            "id",
+            "user_id",
+            "date",
+            "used_requests",
+            "used_tokens",
+            "used_deferred",
+        ],
+        query=_daily_usage_query,
+    ),
+}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class ExportWriter:
+    """Кодирует строки в CSV/JSONL и сразу жмёт их потоковым gzip."""
+
+    def __init__(self, fmt: str, columns: list[str]) -> None:
+        self.fmt = fmt
+        self.columns = columns
+        self.file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        # wbits=31 — gzip-обёртка, файл открывается обычным gunzip
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._text = io.StringIO()
+        self._csv = csv.writer(self._text)
+        self.rows = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        if fmt == "csv":
+            self._csv.writerow(columns)
+            self._flush_text()
+
+    def _flush_text(self) -> None:
+        data = self._text.getvalue().encode("utf-8")
+        self._text.seek(0)
+        self._text.truncate()
+        self.raw_bytes += len(data)
+        self.file.write(self._compressor.compress(data))
+
+    def write_rows(self, rows: Iterable[tuple]) -> None:
+        if self.fmt == "csv":
+            for row in rows:
+                self._csv.writerow(row)
+                self.rows += 1
+        else:
+            for row in rows:
+                self._text.write(
+                    json.dumps(
+                        dict(zip(self.columns, row)),
+                        ensure_ascii=False,
+                        default=_json_default,
+                    )
+                )
+                self._text.write("\n")
+                self.rows += 1
+        self._flush_text()
+
+    def finish(self) -> SpooledTemporaryFile:
+        self.file.write(self._compressor.flush())
+        self.compressed_bytes = self.file.tell()
+        self.file.seek(0)
+        return self.file
+
+
+class SpooledInputFile(InputFile):
+    """Документ для Telegram, который читается из файла кусками."""
+
+    def __init__(
+        self,
+        file: SpooledTemporaryFile,
+        filename: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> None:
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+@dataclass
+class ExportResult:
+    file: SpooledTemporaryFile
+    filename: str
+    rows: int
+    raw_bytes: int
+    compressed_bytes: int
+    seconds: float
+
+
+def export_range(start_day: date, end_day: date) -> tuple[datetime, datetime]:
+    """Дни включительно, по МСК -> полуинтервал [start, end)."""
+    tz = ZoneInfo(settings.moscow_tz)
+    start = datetime.combine(start_day, dt_time.min, tzinfo=tz)
+    end = datetime.combine(end_day + timedelta(days=1), dt_time.min, tzinfo=tz)
+    return start, end
+
+
+async def export_table(
+    table: str,
+    start_day: date,
+    end_day: date,
+    fmt: str = "csv",
+) -> ExportResult:
+    spec = EXPORT_TABLES[table]
+    start, end = export_range(start_day, end_day)
+    writer = ExportWriter(fmt, spec.columns)
+    started = time.perf_counter()
+
+    def write_batch(rows: list) -> None:
+        writer.write_rows(spec.convert(tuple(row)) for row in rows)
+
+    try:
+        async with get_session(read_only=True) as session:
+            result = await session.stream(
+                spec.query(start, end).execution_options(yield_per=EXPORT_BATCH)
+            )
+            async for rows in result.partitions():
+                # кодирование и сжатие — CPU, уводим из event loop
+                await asyncio.to_thread(write_batch, rows)
+        await asyncio.to_thread(writer.finish)
+    except BaseException:
+        writer.file.close()
+        raise
+
+    return ExportResult(
+        file=writer.file,
+        filename=f"{table}_{start_day:%Y%m%d}-{end_day:%Y%m%d}.{fmt}.gz",
+        rows=writer.rows,
+        raw_bytes=writer.raw_bytes,
+        compressed_bytes=writer.compressed_bytes,
+        seconds=time.perf_counter() - started,
+    )
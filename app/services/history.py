@@ -0,0 +1,155 @@
+# app/services/history.py
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.compression import load_answer
+from app.db.models import Task, User
+
+HISTORY_PAGE_SIZE = 5
+PREVIEW_CHARS = 40
+ARCHIVED_PREVIEW = "🗄 из архива"
+
+# Курсор страницы: (created_at, id) последней показанной задачи
+Cursor = tuple[datetime, int]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+@dataclass
+class HistoryItem:
+    task_id: int
+    created_at: datetime
+    preview: str
+
+
+@dataclass
+class StoredSolution:
+    task_id: int
+    created_at: datetime
+    telegram_file_id: Optional[str]
+    answer_text: str
+    solution_file_id: Optional[str] = None
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    """Компактно для callback_data (лимит 64 байта): микросекунды и id в base36."""
+    created_at, task_id = cursor
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    # целочисленно, без float: курсор должен совпадать с БД до микросекунды
+    micros = (created_at - _EPOCH) // _MICROSECOND
+    return f"{_b36(micros)}.{_b36(task_id)}"
+
+
+def decode_cursor(raw: str) -> Optional[Cursor]:
+    try:
+        micros_raw, id_raw = raw.split(".", 1)
+        created_at = _EPOCH + int(micros_raw, 36) * _MICROSECOND
+        return created_at, int(id_raw, 36)
+    except (ValueError, OverflowError):
+        return None
+
+
+def _b36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        value, rem = divmod(value, 36)
+        out = digits[rem] + out
+        if value == 0:
+            return out
+
+
+def history_page_query(user_id: int, after: Optional[Cursor], limit: int):
+    """SELECT одной страницы — отдельно, чтобы план запроса можно было проверить."""
+    stmt = (
+        select(
+            Task.id,
+            Task.created_at,
+            # у сжатых (архивных) ответов превью нет
+            func.coalesce(
+                func.substr(Task.answer_text, 1, PREVIEW_CHARS), ARCHIVED_PREVIEW
+            ),
+        )
+        .where(Task.user_id == user_id)
+        .order_by(Task.created_at.desc(), Task.id.desc())
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(Task.created_at, Task.id) < tuple_(*after))
+    return stmt
+
+
+async def list_history(
+    session: AsyncSession,
+    owner_tg_id: int,
+    after: Optional[Cursor] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> tuple[list[HistoryItem], Optional[Cursor]]:
+    """
+    Страница решений пользователя, новые сверху.
+    Keyset по индексу (user_id, created_at DESC, id DESC) вместо OFFSET:
+    любая страница стоит одинаково. Тянем только короткое превью ответа.
+    Возвращает элементы и курсор следующей страницы (None — страниц больше нет).
+    """
+    # users.id — отдельным запросом по уникальному индексу: с join планировщик
+    # может пойти от users и сортировать задачи сам, а с равенством по
+    # Task.user_id он идёт прямо по ix_tasks_user_created_id
+    user_id = (
+        await session.execute(
+            select(User.id).where(User.telegram_user_id == owner_tg_id)
+        )
+    ).scalar_one_or_none()
+    if user_id is None:
+        return [], None
+
+    stmt = history_page_query(user_id, after, limit + 1)
+    result = await session.execute(stmt)
+    rows = result.all()
+
+    items = [
+        HistoryItem(task_id=row[0], created_at=row[1], preview=row[2] or "")
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = (last.created_at, last.task_id)
+    return items, next_cursor
+
+
+async def get_stored_solution(
+    session: AsyncSession,
+    task_id: int,
+    owner_tg_id: int,
+) -> Optional[StoredSolution]:
+    """Сохранённое решение, только если задача принадлежит пользователю."""
+    stmt = (
+        select(
+            Task.id,
+            Task.created_at,
+            Task.telegram_file_id,
+            Task.answer_text,
+            Task.answer_compressed,
+            Task.solution_file_id,
+        )
+        .join(User, User.id == Task.user_id)
+        .where(Task.id == task_id, User.telegram_user_id == owner_tg_id)
+    )
+    result = await session.execute(stmt)
+    row = result.one_or_none()
+    if row is None:
+        return None
+    task_id, created_at, file_id, answer_text, answer_compressed, solution_id = row
+    return StoredSolution(
+        task_id=task_id,
+        created_at=created_at,
+        telegram_file_id=file_id,
+        answer_text=load_answer(answer_text, answer_compressed),
+        solution_file_id=solution_id,
+    )
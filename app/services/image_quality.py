@@ -0,0 +1,144 @@
+# app/services/image_quality.py
+import math
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+
+# Сторона, до которой ужимаем картинку перед подсчётом метрик.
+# Для оценки резкости/экспозиции больше не нужно, а считается в разы быстрее.
+ANALYSIS_SIDE = 512
+
+
+@dataclass
+class QualityReport:
+    ok: bool
+    reason: str | None
+    width: int
+    height: int
+    blur: float
+    brightness: float
+    clipped: float
+    edge_density: float
+
+
+# Понятные пользователю подсказки под каждую причину отказа
+REJECT_MESSAGES = {
+    "resolution": (
+        "❌ Фото слишком маленькое, на нём не разобрать текст.\n"
+        "Сфотографируй задание ближе или отправь в лучшем качестве."
+    ),
+    "dark": (
+        "❌ Фото слишком тёмное.\n"
+        "Включи свет или вспышку и сфотографируй ещё раз."
+    ),
+    "bright": (
+        "❌ Фото пересвечено, текст не виден.\n"
+        "Убери блик (отодвинь лампу/выключи вспышку) и попробуй снова."
+    ),
+    "blur": (
+        "❌ Фото размытое.\n"
+        "Держи телефон ровно, дождись фокуса и сфотографируй ещё раз."
+    ),
+    "no_text": (
+        "❌ Не вижу на фото задания.\n"
+        "Сфотографируй страницу учебника или тетради так, чтобы текст "
+        "занимал большую часть кадра."
+    ),
+}
+
+
+def _load_gray(image_bytes: bytes) -> tuple[np.ndarray, int, int]:
+    img = Image.open(BytesIO(image_bytes))
+    width, height = img.size
+    # draft() для JPEG декодирует сразу в уменьшенном масштабе (1/2, 1/4, 1/8) —
+    # это основная экономия времени на больших фото. Просим размер будущей
+    # миниатюры с теми же пропорциями: с квадратом ANALYSIS_SIDE короткая
+    # сторона не пускала бы к 1/4 и снимок 2560 px декодировался бы вдвое крупнее
+    scale = min(1.0, ANALYSIS_SIDE / max(width, height))
+    img.draft("L", (math.ceil(width * scale), math.ceil(height * scale)))
+    img = img.convert("L")
+    img.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+    return np.asarray(img, dtype=np.float32), width, height
+
+
+def _laplacian_variance(gray: np.ndarray) -> float:
+    lap = (
+        gray[:-2, 1:-1]
+        + gray[2:, 1:-1]
+        + gray[1:-1, :-2]
+        + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def _edge_density(gray: np.ndarray, threshold: float) -> float:
+    gx = np.abs(gray[:, 1:] - gray[:, :-1])
+    gy = np.abs(gray[1:, :] - gray[:-1, :])
+    edges = (gx[:-1, :] + gy[:, :-1]) > threshold
+    return float(edges.mean())
+
+
+def assess_image_quality(image_bytes: bytes) -> QualityReport:
+    """
+    Быстрая локальная проверка фото до вызова OpenAI.
+    Смотрит разрешение, экспозицию, резкость (дисперсия лапласиана)
+    и плотность границ (есть ли на фото вообще текст).
+    """
+    gray, width, height = _load_gray(image_bytes)
+
+    brightness = float(gray.mean())
+    # доля пересвеченных пикселей (блик, пустой белый лист)
+    clipped = float((gray > 250).mean())
+    blur = _laplacian_variance(gray)
+    edge_density = _edge_density(gray, settings.quality_edge_threshold)
+
+    reason: str | None = None
+    if min(width, height) < settings.quality_min_side:
+        reason = "resolution"
+    elif brightness < settings.quality_min_brightness:
+        reason = "dark"
+    elif brightness > settings.quality_max_brightness or (
+        clipped > settings.quality_max_clipped
+    ):
+        reason = "bright"
+    elif blur < settings.quality_min_blur:
+        reason = "blur"
+    elif edge_density < settings.quality_min_edge_density:
+        reason = "no_text"
+
+    return QualityReport(
+        ok=reason is None,
+        reason=reason,
+        width=width,
+        height=height,
+        blur=blur,
+        brightness=brightness,
+        clipped=clipped,
+        edge_density=edge_density,
+    )
+
+
+def image_dhash(image_bytes: bytes) -> int:
+    """
+    Грубый перцептивный хэш (dHash, 64 бита). Разные фото одной страницы
+    дают близкие хэши — для сверки с кэшем этого достаточно.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    img.draft("L", (64, 64))
+    img = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    # маска — чтобы одинаково работать и со знаковыми значениями из BIGINT
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
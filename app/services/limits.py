@@ -1,16 +1,44 @@
 # app/services/limits.py
-from datetime import datetime, date
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
 
-from sqlalchemy import select
+from sqlalchemy import func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models import User, DailyUsage
+from app.config import settings
+from app.db.dialect import insert, local_date
+from app.db.models import User, DailyUsage, Task
+from app.services import premium_cache
+from app.services.stats import bump_rollup
 
 
 class DailyLimitExceeded(Exception):
     pass
 
 
+class DailyTokenLimitExceeded(DailyLimitExceeded):
+    pass
+
+
+@dataclass
+class TokenReportRow:
+    day: date
+    telegram_user_id: int
+    username: str | None
+    tasks: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+
+
+def _today(now_moscow: datetime) -> date:
+    return date(
+        year=now_moscow.year,
+        month=now_moscow.month,
+        day=now_moscow.day,
+    )
+
+
 async def get_or_create_user(
     session: AsyncSession,
     tg_user_id: int,
@@ -33,43 +61,178 @@ async def get_or_create_user(
         await session.commit()
         await session.refresh(user)
 
+    await premium_cache.remember(tg_user_id, user.is_premium)
     return user
 
 
-async def check_and_increment_daily_usage(
+async def ensure_daily_quota(
     session: AsyncSession,
     user: User,
     now_moscow: datetime,
     daily_limit: int,
+    daily_token_limit: int = 0,
+    deferred: bool = False,
 ) -> None:
-    """Кидает DailyLimitExceeded, если превышен лимит для НЕ премиумов."""
-    if user.is_premium:
+    """
+    Проверка лимитов без списания — чтобы не качать фото тем, у кого лимит
+    уже исчерпан. Те же исключения, что у check_and_increment_daily_usage;
+    списывает и окончательно решает по-прежнему она.
+    """
+    counter = DailyUsage.used_deferred if deferred else DailyUsage.used_requests
+    row = (
+        await session.execute(
+            select(counter, DailyUsage.used_tokens).where(
+                DailyUsage.user_id == user.id,
+                DailyUsage.date == _today(now_moscow),
+            )
+        )
+    ).one_or_none()
+    if row is None:
         return
+    used_requests, used_tokens = row
+    if not user.is_premium and used_requests >= daily_limit:
+        raise DailyLimitExceeded()
+    if daily_token_limit and used_tokens >= daily_token_limit:
+        raise DailyTokenLimitExceeded()
 
-    today = date(
-        year=now_moscow.year,
-        month=now_moscow.month,
-        day=now_moscow.day,
+
+async def check_and_increment_daily_usage(
+    session: AsyncSession,
+    user: User,
+    now_moscow: datetime,
+    daily_limit: int,
+    daily_token_limit: int = 0,
+    deferred: bool = False,
+) -> int | None:
+    """
+    Атомарно списывает один запрос из дневного лимита.
+
+    Лимит по числу запросов действует только для НЕ премиумов (DailyLimitExceeded),
+    бюджет токенов — для всех, у каждого тарифа свой (DailyTokenLimitExceeded).
+    Отложенные запросы (deferred=True) считаются в отдельном счётчике
+    used_deferred и не тратят обычный лимит.
+    Возвращает остаток токенов на сегодня или None, если бюджет не ограничен.
+    """
+    today = _today(now_moscow)
+
+    # строка на сегодня появляется один раз, дальше только UPDATE
+    created = await session.execute(
+        insert(DailyUsage)
+        .values(
+            user_id=user.id,
+            date=today,
+            used_requests=0,
+            used_tokens=0,
+            used_deferred=0,
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "date"])
+        .returning(DailyUsage.id)
     )
-    stmt = select(DailyUsage).where(
+    if created.scalar_one_or_none() is not None:
+        # первый запрос пользователя за день — он попадает в DAU
+        await bump_rollup(session, today, active_users=1)
+
+    counter = DailyUsage.used_deferred if deferred else DailyUsage.used_requests
+
+    # проверка и инкремент одним запросом — без гонок между параллельными фото
+    stmt = update(DailyUsage).where(
         DailyUsage.user_id == user.id,
         DailyUsage.date == today,
     )
+    if not user.is_premium:
+        stmt = stmt.where(counter < daily_limit)
+    if daily_token_limit:
+        stmt = stmt.where(DailyUsage.used_tokens < daily_token_limit)
+    stmt = stmt.values({counter: counter + 1}).returning(DailyUsage.used_tokens)
+
     result = await session.execute(stmt)
-    usage = result.scalar_one_or_none()
+    used_tokens = result.scalar_one_or_none()
+    await session.commit()
 
-    if usage is None:
-        usage = DailyUsage(
-            user_id=user.id,
-            date=today,
-            used_requests=0,
+    if used_tokens is None:
+        # понять, какой из лимитов сработал
+        usage_stmt = select(counter).where(
+            DailyUsage.user_id == user.id,
+            DailyUsage.date == today,
         )
-        session.add(usage)
-        await session.commit()
-        await session.refresh(usage)
+        used_requests = (await session.execute(usage_stmt)).scalar_one()
+        if not user.is_premium and used_requests >= daily_limit:
+            raise DailyLimitExceeded()
+        raise DailyTokenLimitExceeded()
 
-    if usage.used_requests >= daily_limit:
-        raise DailyLimitExceeded()
+    if not daily_token_limit:
+        return None
+    return daily_token_limit - used_tokens
 
-    usage.used_requests += 1
-    await session.commit()
+
+async def add_token_usage(
+    session: AsyncSession,
+    user_id: int,
+    now_moscow: datetime,
+    tokens: int,
+) -> None:
+    """Докидывает потраченные токены в дневной счётчик (без commit)."""
+    if tokens <= 0:
+        return
+    await session.execute(
+        update(DailyUsage)
+        .where(
+            DailyUsage.user_id == user_id,
+            DailyUsage.date == _today(now_moscow),
+        )
+        .values(used_tokens=DailyUsage.used_tokens + tokens)
+    )
+
+
+async def get_recent_completion_tokens(
+    session: AsyncSession,
+    user_id: int,
+    limit: int = 5,
+) -> list[int]:
+    """Сколько токенов занимали последние ответы пользователя."""
+    stmt = (
+        select(Task.completion_tokens)
+        .where(Task.user_id == user_id, Task.completion_tokens > 0)
+        .order_by(Task.created_at.desc())
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def get_token_report(
+    session: AsyncSession,
+    since: datetime,
+    limit: int = 30,
+) -> list[TokenReportRow]:
+    """Расход токенов по пользователям и дням начиная с since."""
+    # день по МСК, как и since из report_since
+    day = local_date(Task.created_at, settings.moscow_tz).label("day")
+    stmt = (
+        select(
+            day,
+            User.telegram_user_id,
+            User.username,
+            func.count(Task.id),
+            func.coalesce(func.sum(Task.prompt_tokens), 0),
+            func.coalesce(func.sum(Task.completion_tokens), 0),
+            func.coalesce(func.sum(Task.cached_tokens), 0),
+        )
+        .join(User, User.id == Task.user_id)
+        .where(Task.created_at >= since)
+        .group_by(day, User.telegram_user_id, User.username)
+        .order_by(
+            day.desc(),
+            (
+                func.sum(Task.prompt_tokens) + func.sum(Task.completion_tokens)
+            ).desc(),
+        )
+        .limit(limit)
+    )
+    result = await session.execute(stmt)
+    return [TokenReportRow(*row) for row in result.all()]
+
+
+def report_since(now_moscow: datetime, days: int) -> datetime:
+    start = now_moscow - timedelta(days=days - 1)
+    return start.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -0,0 +1,203 @@
+# app/services/maintenance.py
+import asyncio
+import logging
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, select, text, update
+from sqlalchemy.exc import DBAPIError
+
+from app.config import settings
+from app.db.compression import compress_answer
+from app.db.dialect import IS_SQLITE
+from app.db.models import DailyUsage, Task
+from app.db.partitions import ensure_task_partitions, is_tasks_partitioned
+from app.db.session import engine, get_session
+from app.services import exercise_cache
+from app.services.state_backend import get_state_backend
+
+logger = logging.getLogger(__name__)
+
+# Пауза между пачками, чтобы фоновая работа не душила живые запросы
+BATCH_PAUSE = 0.2
+# Одна блокировка на плановый проход и /maintenance: два прохода разом
+# сжимали бы одни и те же ответы
+MAINTENANCE_LOCK = "maintenance"
+
+
+@dataclass
+class TableSize:
+    name: str
+    table_bytes: int
+    index_bytes: int
+
+
+async def purge_daily_usage(today, batch_size: int) -> int:
+    """Удаляет старые строки daily_usage пачками по batch_size."""
+    cutoff = today - timedelta(days=settings.daily_usage_keep_days)
+    total = 0
+    while True:
+        async with get_session() as session:
+            ids = select(DailyUsage.id).where(DailyUsage.date < cutoff).limit(batch_size)
+            result = await session.execute(
+                delete(DailyUsage).where(DailyUsage.id.in_(ids.scalar_subquery()))
+            )
+            await session.commit()
+        deleted = result.rowcount or 0
+        total += deleted
+        if deleted < batch_size:
+            return total
+        await asyncio.sleep(BATCH_PAUSE)
+
+
+async def compress_old_answers(now_moscow: datetime, batch_size: int) -> int:
+    """Переносит ответы старше N дней в сжатую колонку answer_compressed."""
+    if settings.answer_compress_after_days <= 0:
+        return 0
+    cutoff = now_moscow - timedelta(days=settings.answer_compress_after_days)
+    total = 0
+    # Keyset по id: без него каждая пачка заново проходила бы мимо всех уже
+    # сжатых строк (индекса под created_at + answer_text нет) — квадрат
+    last_id = 0
+    while True:
+        async with get_session() as session:
+            result = await session.execute(
+                select(Task.id, Task.answer_text)
+                .where(
+                    Task.id > last_id,
+                    Task.created_at < cutoff,
+                    Task.answer_text.is_not(None),
+                )
+                .order_by(Task.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                return total
+            last_id = rows[-1][0]
+            # сжатие — CPU, уносим из event loop
+            params = await asyncio.to_thread(
+                lambda: [
+                    {
+                        "id": task_id,
+                        "answer_compressed": compress_answer(answer_text),
+                        "answer_text": None,
+                    }
+                    for task_id, answer_text in rows
+                ]
+            )
+            # bulk UPDATE по первичному ключу — один executemany на пачку
+            await session.execute(update(Task), params)
+            await session.commit()
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+        await asyncio.sleep(BATCH_PAUSE)
+
+
+async def run_maintenance(now_moscow: datetime) -> dict[str, int]:
+    batch = settings.maintenance_batch_size
+    today = now_moscow.date()
+    report = {
+        "daily_usage_deleted": await purge_daily_usage(today, batch),
+        "answers_compressed": await compress_old_answers(now_moscow, batch),
+    }
+    async with get_session() as session:
+        report["exercise_cache_expired"] = await exercise_cache.purge_expired(
+            session, now_moscow
+        )
+
+    async with engine.begin() as conn:
+        if IS_SQLITE:
+            # свежая статистика для планировщика после удалений
+            await conn.execute(text("PRAGMA optimize"))
+        elif await is_tasks_partitioned(conn):
+            created = await ensure_task_partitions(conn, today)
+            report["partitions_created"] = len(created)
+    return report
+
+
+def maintenance_lock() -> AbstractAsyncContextManager[bool]:
+    """Блокировка прохода обслуживания; без ожидания — занято, значит уже идёт."""
+    return get_state_backend().lock(
+        MAINTENANCE_LOCK, timeout=settings.maintenance_interval, wait=0
+    )
+
+
+async def maintenance_loop() -> None:
+    """
+    Фоновое обслуживание БД раз в MAINTENANCE_INTERVAL секунд.
+    При нескольких репликах работает только та, что взяла блокировку.
+    """
+    while True:
+        await asyncio.sleep(settings.maintenance_interval)
+        try:
+            async with maintenance_lock() as acquired:
+                if not acquired:
+                    continue
+                now_moscow = datetime.now(ZoneInfo(settings.moscow_tz))
+                report = await run_maintenance(now_moscow)
+                logger.info("maintenance done", extra=report)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("maintenance failed")
+
+
+SIZE_TABLES = ("tasks", "daily_usage", "usage_rollups", "exercise_answers")
+
+
+async def _sqlite_table_sizes() -> list[TableSize]:
+    """SQLite: по таблицам через dbstat, если он собран, иначе весь файл."""
+    async with engine.connect() as conn:
+        try:
+            sizes = []
+            for name in SIZE_TABLES:
+                table_bytes, index_bytes = (
+                    await conn.execute(
+                        text(
+                            "SELECT "
+                            "coalesce(sum(CASE WHEN name = :name "
+                            "THEN pgsize END), 0), "
+                            "coalesce(sum(CASE WHEN name != :name "
+                            "THEN pgsize END), 0) "
+                            "FROM dbstat WHERE name = :name OR name IN "
+                            "(SELECT name FROM sqlite_master "
+                            "WHERE type = 'index' AND tbl_name = :name)"
+                        ),
+                        {"name": name},
+                    )
+                ).one()
+                sizes.append(TableSize(name, int(table_bytes), int(index_bytes)))
+            return sizes
+        except DBAPIError:
+            page_count = (await conn.execute(text("PRAGMA page_count"))).scalar_one()
+            page_size = (await conn.execute(text("PRAGMA page_size"))).scalar_one()
+            return [TableSize("sqlite (весь файл)", page_count * page_size, 0)]
+
+
+async def get_table_sizes() -> list[TableSize]:
+    """Размер таблиц и индексов (для партиционированных — сумма по партициям)."""
+    if IS_SQLITE:
+        return await _sqlite_table_sizes()
+    sizes = []
+    async with engine.connect() as conn:
+        for name in SIZE_TABLES:
+            row = (
+                await conn.execute(
+                    text(
+                        # обычная таблица в pg_partition_tree не попадает —
+                        # добавляем её саму (у родителя партиций размер 0)
+                        "SELECT coalesce(sum(pg_table_size(relid)), 0), "
+                        "coalesce(sum(pg_indexes_size(relid)), 0) "
+                        "FROM (SELECT relid FROM pg_partition_tree("
+                        "CAST(:name AS regclass)) "
+                        "UNION SELECT CAST(:name AS regclass)) AS tree"
+                    ),
+                    {"name": name},
+                )
+            ).one()
+            sizes.append(TableSize(name, int(row[0]), int(row[1])))
+    return sizes
@@ -0,0 +1,201 @@
+# app/services/premium.py
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import BigInteger, String, bindparam, func, or_, select, union, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.selectable import TableValuedAlias
+
+from app.db.dialect import IS_SQLITE
+from app.db.models import User
+from app.services import premium_cache
+
+_TOKEN_SPLIT_RE = re.compile(r"[\s,;]+")
+_USERNAME_RE = re.compile(r"^@?([A-Za-z][A-Za-z0-9_]{3,31})$")
+
+# Telegram ID — положительные и не длиннее 64 бит
+_MAX_TG_ID = 2**63 - 1
+
+
+@dataclass
+class PremiumTargets:
+    ids: list[int] = field(default_factory=list)
+    usernames: list[str] = field(default_factory=list)  # без @, в нижнем регистре
+    invalid: list[str] = field(default_factory=list)
+
+
+@dataclass
+class PremiumChange:
+    telegram_user_id: int
+    username: str | None
+    changed: bool  # False — статус уже был нужным
+
+
+@dataclass
+class PremiumBulkResult:
+    changed: list[PremiumChange]
+    unchanged: list[PremiumChange]
+    not_found: list[str]
+    invalid: list[str]
+
+
+def parse_targets(raw: str) -> PremiumTargets:
+    """Разбирает список из ID и @username через пробелы, запятые или переносы."""
+    targets = PremiumTargets()
+    seen: set[str] = set()
+    for token in _TOKEN_SPLIT_RE.split(raw.strip()):
+        if not token or token in seen:
+            continue
+        seen.add(token)
+        if token.isdigit() and 0 < int(token) <= _MAX_TG_ID:
+            targets.ids.append(int(token))
+            continue
+        match = _USERNAME_RE.match(token)
+        if match:
+            targets.usernames.append(match.group(1).lower())
+        else:
+            targets.invalid.append(token)
+    return targets
+
+
+def _premium_values(grant: bool, now_moscow: datetime) -> dict:
+    return {
+        "is_premium": grant,
+        "premium_since": (
+            func.coalesce(User.premium_since, now_moscow) if grant else None
+        ),
+    }
+
+
+def _unnest(name: str, values: list, item_type) -> TableValuedAlias:
+    """Массив одним параметром, развёрнутый в строки: unnest(:name) AS name(value)."""
+    return (
+        func.unnest(bindparam(name, values, type_=ARRAY(item_type)))
+        .table_valued("value")
+        .render_derived(name=name)
+    )
+
+
+async def _set_premium_pg(
+    session: AsyncSession,
+    targets: PremiumTargets,
+    grant: bool,
+    now_moscow: datetime,
+) -> list[tuple[int, str | None, bool]]:
+    """
+    Один UPDATE ... FROM (старые значения) ... RETURNING.
+    Цели — join с unnest(:ids) / unnest(:names), а не фильтр = ANY(:ids):
+    без статистики по users планировщик проверял ANY на каждой строке таблицы
+    (O(пользователей × списка)), а join ограничен длиной списка при любом плане.
+    """
+    matched = []
+    if targets.ids:
+        ids = _unnest("ids", targets.ids, BigInteger)
+        matched.append(
+            select(User.id, User.is_premium.label("was_premium")).join_from(
+                User, ids, User.telegram_user_id == ids.c.value
+            )
+        )
+    if targets.usernames:
+        names = _unnest("names", targets.usernames, String)
+        matched.append(
+            select(User.id, User.is_premium.label("was_premium")).join_from(
+                User, names, func.lower(User.username) == names.c.value
+            )
+        )
+
+    # снимок «до» — чтобы в том же запросе понять, у кого статус реально поменялся;
+    # UNION убирает тех, кто указан и по ID, и по @username
+    before = (union(*matched) if len(matched) > 1 else matched[0]).subquery()
+    stmt = (
+        update(User)
+        .where(User.id == before.c.id)
+        .values(**_premium_values(grant, now_moscow))
+        .returning(User.telegram_user_id, User.username, before.c.was_premium)
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return [tuple(row) for row in result.all()]
+
+
+async def _set_premium_sqlite(
+    session: AsyncSession,
+    targets: PremiumTargets,
+    grant: bool,
+    now_moscow: datetime,
+) -> list[tuple[int, str | None, bool]]:
+    """
+    В SQLite RETURNING не видит таблиц из FROM, поэтому два запроса в одной
+    транзакции: UPDATE только тех, у кого статус другой (они и «изменились»),
+    затем SELECT остальных найденных.
+    """
+    conditions = []
+    if targets.ids:
+        conditions.append(User.telegram_user_id.in_(targets.ids))
+    if targets.usernames:
+        conditions.append(func.lower(User.username).in_(targets.usernames))
+
+    result = await session.execute(
+        update(User)
+        .where(or_(*conditions), User.is_premium.is_not(grant))
+        .values(**_premium_values(grant, now_moscow))
+        .returning(User.telegram_user_id, User.username)
+        .execution_options(synchronize_session=False)
+    )
+    rows = [(tg_id, username, not grant) for tg_id, username in result.all()]
+    changed_ids = {tg_id for tg_id, _, _ in rows}
+
+    result = await session.execute(
+        select(User.telegram_user_id, User.username).where(or_(*conditions))
+    )
+    rows += [
+        (tg_id, username, grant)
+        for tg_id, username in result.all()
+        if tg_id not in changed_ids
+    ]
+    return rows
+
+
+async def set_premium_bulk(
+    session: AsyncSession,
+    targets: PremiumTargets,
+    grant: bool,
+    now_moscow: datetime,
+) -> PremiumBulkResult:
+    """
+    Выдаёт/снимает премиум всем найденным пользователям и сообщает,
+    у кого статус реально поменялся.
+    Флаг премиума в общем кэше обновляется одной пачкой.
+    """
+    rows = []
+    if targets.ids or targets.usernames:
+        update_premium = _set_premium_sqlite if IS_SQLITE else _set_premium_pg
+        rows = await update_premium(session, targets, grant, now_moscow)
+        await session.commit()
+
+    changed: list[PremiumChange] = []
+    unchanged: list[PremiumChange] = []
+    found_ids: set[int] = set()
+    found_names: set[str] = set()
+    for tg_id, username, was_premium in rows:
+        found_ids.add(tg_id)
+        if username:
+            found_names.add(username.lower())
+        item = PremiumChange(tg_id, username, changed=was_premium != grant)
+        (changed if item.changed else unchanged).append(item)
+
+    await premium_cache.remember_many(
+        [item.telegram_user_id for item in changed + unchanged], grant
+    )
+
+    not_found = [str(i) for i in targets.ids if i not in found_ids] + [
+        f"@{name}" for name in targets.usernames if name not in found_names
+    ]
+    return PremiumBulkResult(
+        changed=changed,
+        unchanged=unchanged,
+        not_found=not_found,
+        invalid=targets.invalid,
+    )
@@ -0,0 +1,34 @@
+# app/services/premium_cache.py
+from app.services.state_backend import get_state_backend
+
+# Флаг «у пользователя премиум» в общем state-бэкенде.
+# Нужен там, где в БД ходить нельзя или дорого (антифлуд до любой работы с БД),
+# и одинаково виден всем репликам.
+PREMIUM_FLAG_TTL = 24 * 60 * 60
+
+
+def key(tg_user_id: int) -> str:
+    return f"premium:{tg_user_id}"
+
+
+async def remember(tg_user_id: int, is_premium: bool) -> None:
+    backend = get_state_backend()
+    if is_premium:
+        await backend.set(key(tg_user_id), "1", ttl=PREMIUM_FLAG_TTL)
+    else:
+        await backend.delete(key(tg_user_id))
+
+
+async def is_premium(tg_user_id: int) -> bool:
+    return await get_state_backend().get(key(tg_user_id)) is not None
+
+
+async def remember_many(tg_user_ids: list[int], is_premium: bool) -> None:
+    """Массовое обновление флага — одной пачкой к бэкенду."""
+    backend = get_state_backend()
+    if is_premium:
+        await backend.set_many(
+            {key(uid): "1" for uid in tg_user_ids}, ttl=PREMIUM_FLAG_TTL
+        )
+    else:
+        await backend.delete(*(key(uid) for uid in tg_user_ids))
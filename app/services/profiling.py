@@ -0,0 +1,255 @@
+# app/services/profiling.py
+"""
+Профилирование живого бота по запросу (только с PROFILING_TOKEN).
+
+    GET /debug/profile?seconds=10   — сэмплы стека event loop в collapsed-формате
+                                      (flamegraph.pl, speedscope, inferno)
+    GET /debug/loop?seconds=10      — задержка event loop и самые долгие
+                                      блокирующие колбэки (asyncio debug mode)
+    GET /debug/memory?seconds=30    — разница снимков tracemalloc за окно
+
+Всё включается только на время запроса: в простое ни потоков, ни debug-режима,
+ни tracemalloc — накладные расходы нулевые.
+Токен — только в заголовке X-Profiling-Token: query-строка оседает в логах
+прокси и в истории браузера.
+"""
+import asyncio
+import hmac
+import logging
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import PurePath
+
+from aiohttp import web
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_SECONDS = 60
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Шаг, с которым меряем задержку event loop
+LAG_PROBE_INTERVAL = 0.05
+# Глубина трейсбеков tracemalloc (больше — точнее «кто выделил», но дороже)
+TRACEMALLOC_FRAMES = 10
+
+_SLOW_CALLBACK_RE = re.compile(r"took (\d+(?:\.\d+)?) seconds")
+
+# Одна сессия профилирования за раз
+_busy = asyncio.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = PurePath(code.co_filename)
+    return f"{code.co_name} ({'/'.join(path.parts[-2:])})"
+
+
+def _collapse(frame) -> str:
+    parts = []
+    while frame is not None:
+        parts.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Сэмплирует стек потока thread_id; вызывается в отдельном потоке."""
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            counts[_collapse(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return counts
+
+
+async def profile_loop_thread(seconds: float, interval: float) -> str:
+    """Collapsed stacks потока event loop: «a;b;c count» по строке на стек."""
+    counts = await asyncio.to_thread(
+        sample_stacks, threading.get_ident(), seconds, interval
+    )
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class _SlowCallbackCollector(logging.Handler):
+    """Ловит предупреждения asyncio «Executing <Handle ...> took N seconds»."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.items: list[tuple[float, str]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        match = _SLOW_CALLBACK_RE.search(message)
+        if message.startswith("Executing") and match:
+            self.items.append((float(match.group(1)), message))
+
+
+def _percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def inspect_loop(seconds: float, slow_callback: float, top: int = 10) -> dict:
+    """
+    Задержка event loop (насколько позже просыпается sleep) и колбэки, которые
+    держали loop дольше slow_callback секунд. Debug-режим loop включается
+    только на это окно.
+    """
+    loop = asyncio.get_running_loop()
+    collector = _SlowCallbackCollector()
+    asyncio_logger = logging.getLogger("asyncio")
+    prev_debug = loop.get_debug()
+    prev_threshold = loop.slow_callback_duration
+
+    asyncio_logger.addHandler(collector)
+    loop.slow_callback_duration = slow_callback
+    loop.set_debug(True)
+    lags: list[float] = []
+    try:
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            started = loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            lags.append(max(0.0, loop.time() - started - LAG_PROBE_INTERVAL))
+    finally:
+        loop.set_debug(prev_debug)
+        loop.slow_callback_duration = prev_threshold
+        asyncio_logger.removeHandler(collector)
+
+    slowest = sorted(collector.items, key=lambda item: item[0], reverse=True)
+    return {
+        "seconds": seconds,
+        "lag_ms": {
+            "p50": round(_percentile(lags, 0.5) * 1000, 2),
+            "p95": round(_percentile(lags, 0.95) * 1000, 2),
+            "p99": round(_percentile(lags, 0.99) * 1000, 2),
+            "max": round(max(lags, default=0.0) * 1000, 2),
+        },
+        "slow_callbacks": len(collector.items),
+        "slowest": [
+            {"seconds": duration, "callback": message}
+            for duration, message in slowest[:top]
+        ],
+    }
+
+
+async def memory_diff(seconds: float, group_by: str = "lineno", top: int = 25) -> dict:
+    """Что выросло в памяти за окно: разница двух снимков tracemalloc."""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    stats = await asyncio.to_thread(after.compare_to, before, group_by)
+    return {
+        "seconds": seconds,
+        "traced_kb": traced // 1024,
+        "peak_kb": peak // 1024,
+        "top": [
+            {
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "count_diff": stat.count_diff,
+                "size_kb": round(stat.size / 1024, 1),
+                "where": stat.traceback.format(limit=TRACEMALLOC_FRAMES),
+            }
+            for stat in stats[:top]
+        ],
+    }
+
+
+# ===== aiohttp-эндпоинты =====
+
+
+def _authorized(request: web.Request) -> bool:
+    token = request.headers.get("X-Profiling-Token", "")
+    return bool(settings.profiling_token) and hmac.compare_digest(
+        token.encode("utf-8"), settings.profiling_token.encode("utf-8")
+    )
+
+
+def _float_param(request: web.Request, name: str, default: float) -> float:
+    try:
+        return float(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be a number")
+
+
+def _seconds(request: web.Request, default: float) -> float:
+    return min(max(_float_param(request, "seconds", default), 0.1), MAX_SECONDS)
+
+
+def _guarded(handler):
+    async def wrapper(request: web.Request) -> web.StreamResponse:
+        if not _authorized(request):
+            # не выдаём, что эндпоинт существует
+            raise web.HTTPNotFound()
+        if _busy.locked():
+            raise web.HTTPConflict(text="profiling session already running")
+        async with _busy:
+            logger.info("profiling started", extra={"endpoint": request.path})
+            return await handler(request)
+
+    return wrapper
+
+
+@_guarded
+async def profile_endpoint(request: web.Request) -> web.Response:
+    seconds = _seconds(request, 10)
+    interval = min(
+        max(_float_param(request, "interval", DEFAULT_SAMPLE_INTERVAL), 0.001), 1.0
+    )
+    collapsed = await profile_loop_thread(seconds, interval)
+    return web.Response(
+        text=collapsed,
+        content_type="text/plain",
+        headers={"Content-Disposition": 'attachment; filename="loop.collapsed"'},
+    )
+
+
+@_guarded
+async def loop_endpoint(request: web.Request) -> web.Response:
+    report = await inspect_loop(
+        seconds=_seconds(request, 10),
+        slow_callback=_float_param(request, "slow_ms", 50) / 1000,
+    )
+    return web.json_response(report)
+
+
+@_guarded
+async def memory_endpoint(request: web.Request) -> web.Response:
+    group_by = request.query.get("group", "lineno")
+    if group_by not in ("lineno", "traceback", "filename"):
+        raise web.HTTPBadRequest(text="group must be lineno, traceback or filename")
+    report = await memory_diff(seconds=_seconds(request, 30), group_by=group_by)
+    return web.json_response(report)
+
+
+def setup_profiling(app: web.Application) -> None:
+    """Регистрирует /debug/* только если задан PROFILING_TOKEN."""
+    if not settings.profiling_token:
+        return
+    app.router.add_get("/debug/profile", profile_endpoint)
+    app.router.add_get("/debug/loop", loop_endpoint)
+    app.router.add_get("/debug/memory", memory_endpoint)
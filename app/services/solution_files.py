@@ -0,0 +1,182 @@
+# app/services/solution_files.py
+"""
+Повторная отправка картинок-решений по file_id.
+
+Одинаковый текст ответа (кэш упражнений, повторное фото, досылка из истории)
+даёт одинаковую картинку, поэтому после первой загрузки в Telegram её
+file_id запоминается по хэшу текста: в LRU процесса и в tasks.solution_file_id.
+Дальше — ни рендера, ни загрузки PNG.
+"""
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.db.models import Task
+from app.db.session import get_session
+from app.services.image_renderer import render_solution_image
+from app.services.lru import LRUCache
+
+# Меняем при изменении вида картинки — старые file_id перестанут совпадать
+RENDER_VERSION = "1"
+
+# хэш ответа -> file_id загруженной картинки
+_cache: LRUCache[str, str] = LRUCache(settings.answer_cache_size)
+
+
+@dataclass
+class SolutionFileStats:
+    renders: int = 0
+    render_seconds: float = 0.0
+    uploads: int = 0
+    upload_bytes: int = 0
+    reuses: int = 0
+    stale: int = 0  # Telegram не принял сохранённый file_id
+
+    @property
+    def saved_render_seconds(self) -> float:
+        if not self.renders:
+            return 0.0
+        return self.reuses * self.render_seconds / self.renders
+
+    @property
+    def saved_upload_bytes(self) -> int:
+        if not self.uploads:
+            return 0
+        return self.reuses * self.upload_bytes // self.uploads
+
+
+stats = SolutionFileStats()
+
+
+@dataclass
+class PreparedSolution:
+    answer_hash: str
+    file_id: Optional[str] = None  # картинка уже есть в Telegram
+    image: Optional[bytes] = None  # свежий рендер, нужно загрузить
+
+    def input_file(self) -> str | BufferedInputFile:
+        if self.file_id:
+            return self.file_id
+        return BufferedInputFile(self.image, filename="solution.png")
+
+
+def answer_hash(answer_text: str) -> str:
+    digest = hashlib.sha256(f"{RENDER_VERSION}\n{answer_text}".encode("utf-8"))
+    return digest.hexdigest()[:40]
+
+
+async def find_file_id(answer_hash: str) -> Optional[str]:
+    file_id = _cache.get(answer_hash)
+    if file_id is not None:
+        return file_id
+    async with get_session() as session:
+        result = await session.execute(
+            select(Task.solution_file_id)
+            .where(
+                Task.answer_hash == answer_hash,
+                Task.solution_file_id.is_not(None),
+            )
+            .order_by(Task.id.desc())
+            .limit(1)
+        )
+        file_id = result.scalar_one_or_none()
+    if file_id is not None:
+        _cache.put(answer_hash, file_id)
+    return file_id
+
+
+async def forget_file_id(answer_hash: str, file_id: str) -> None:
+    """Иначе следующий промах LRU снова достанет тот же file_id из старой задачи."""
+    _cache.pop(answer_hash)
+    async with get_session() as session:
+        await session.execute(
+            update(Task)
+            .where(Task.answer_hash == answer_hash, Task.solution_file_id == file_id)
+            .values(solution_file_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+
+async def _render(answer_text: str) -> bytes:
+    started = time.perf_counter()
+    image = await asyncio.to_thread(render_solution_image, answer_text)
+    stats.renders += 1
+    stats.render_seconds += time.perf_counter() - started
+    return image
+
+
+async def lookup_solution(answer_text: str) -> PreparedSolution:
+    """Только поиск готового file_id, без рендера."""
+    prepared = PreparedSolution(answer_hash=answer_hash(answer_text))
+    prepared.file_id = await find_file_id(prepared.answer_hash)
+    return prepared
+
+
+async def render_solution(prepared: PreparedSolution, answer_text: str) -> None:
+    """Рендерит картинку, если готового file_id нет."""
+    if prepared.file_id is None and prepared.image is None:
+        prepared.image = await _render(answer_text)
+
+
+async def prepare_solution(answer_text: str) -> PreparedSolution:
+    """Готовая картинка по file_id, если такой ответ уже отправляли, иначе рендер."""
+    prepared = await lookup_solution(answer_text)
+    await render_solution(prepared, answer_text)
+    return prepared
+
+
+async def send_solution(
+    bot: Bot,
+    chat_id: int,
+    prepared: PreparedSolution,
+    answer_text: str,
+    task_id: int,
+    **kwargs: Any,
+) -> Message:
+    """
+    Отправляет картинку-решение. После свежей загрузки запоминает file_id
+    в LRU и в tasks.solution_file_id задачи task_id.
+    """
+    if prepared.file_id:
+        try:
+            sent = await bot.send_photo(chat_id, photo=prepared.file_id, **kwargs)
+        except TelegramBadRequest:
+            # file_id больше не принимается — забываем его везде и рендерим заново
+            stats.stale += 1
+            await forget_file_id(prepared.answer_hash, prepared.file_id)
+            prepared.file_id = None
+            prepared.image = await _render(answer_text)
+        else:
+            stats.reuses += 1
+            return sent
+
+    sent = await bot.send_photo(chat_id, photo=prepared.input_file(), **kwargs)
+    stats.uploads += 1
+    stats.upload_bytes += len(prepared.image)
+
+    file_id = sent.photo[-1].file_id
+    prepared.file_id = file_id
+    _cache.put(prepared.answer_hash, file_id)
+    async with get_session() as session:
+        await session.execute(
+            update(Task)
+            .where(Task.id == task_id)
+            .values(solution_file_id=file_id)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    return sent
+
+
+def cache_stats() -> tuple[int, int, int]:
+    """(записей, попаданий, промахов)"""
+    return len(_cache), _cache.hits, _cache.misses
@@ -0,0 +1,345 @@
+# app/services/state_backend.py
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.config import settings
+
+# Сколько протухших записей выкидывать за один вызов — держит цену O(1)
+EVICT_PER_CALL = 4
+
+
+class StateBackend(ABC):
+    """
+    Общее состояние бота: FSM, кэши, single-flight блокировки и корзины антифлуда.
+    В памяти — для одного процесса, в Redis — для нескольких реплик за балансировщиком.
+    """
+
+    @abstractmethod
+    def fsm_storage(self) -> BaseStorage: ...
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None: ...
+
+    async def set_many(self, items: dict[str, str], ttl: Optional[float] = None) -> None:
+        for key, value in items.items():
+            await self.set(key, value, ttl=ttl)
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None: ...
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1) -> int: ...
+
+    @abstractmethod
+    async def take_token(
+        self,
+        key: str,
+        rate: float,
+        burst: float,
+        max_delay: float,
+        idle_ttl: float,
+        boost_key: Optional[str] = None,
+        boost: float = 1.0,
+    ) -> float:
+        """
+        Token bucket. Возвращает 0, если токен есть, иначе — сколько ждать.
+        Если ждать не дольше max_delay, токен резервируется сразу.
+        Если задан boost_key и он существует, корзина больше в boost раз.
+        """
+
+    @abstractmethod
+    def lock(
+        self, key: str, timeout: float, wait: float
+    ) -> AbstractAsyncContextManager[bool]:
+        """
+        Single-flight блокировка: держится не дольше timeout,
+        ждём её не дольше wait. Отдаёт True, если блокировку взяли.
+        """
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryStateBackend(StateBackend):
+    def __init__(self, max_keys: int = 100_000) -> None:
+        self.max_keys = max_keys
+        self._storage = MemoryStorage()
+        self._values: OrderedDict[str, tuple[str, Optional[float]]] = OrderedDict()
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self._bucket_ttl: dict[str, float] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._lock_owners: dict[str, object] = {}
+
+    def fsm_storage(self) -> BaseStorage:
+        return self._storage
+
+    def _evict_values(self, now: float) -> None:
+        values = self._values
+        for _ in range(EVICT_PER_CALL):
+            if not values:
+                return
+            key, (_, expires_at) = next(iter(values.items()))
+            expired = expires_at is not None and expires_at <= now
+            if not expired and len(values) <= self.max_keys:
+                return
+            del values[key]
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self._values[key] = (value, now + ttl if ttl else None)
+        self._values.move_to_end(key)
+        self._evict_values(now)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(await self.get(key) or 0) + amount
+        await self.set(key, str(value))
+        return value
+
+    def _evict_buckets(self, now: float) -> None:
+        buckets = self._buckets
+        for _ in range(EVICT_PER_CALL):
+            if not buckets:
+                return
+            key, (_, updated) = next(iter(buckets.items()))
+            idle = now - updated >= self._bucket_ttl.get(key, 0)
+            if not idle and len(buckets) <= self.max_keys:
+                return
+            del buckets[key]
+            self._bucket_ttl.pop(key, None)
+
+    async def take_token(
+        self,
+        key: str,
+        rate: float,
+        burst: float,
+        max_delay: float,
+        idle_ttl: float,
+        boost_key: Optional[str] = None,
+        boost: float = 1.0,
+    ) -> float:
+        # get(), а не `in`: протухший буст не должен действовать
+        if boost_key is not None and await self.get(boost_key) is not None:
+            burst *= boost
+        now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        self._bucket_ttl[key] = idle_ttl
+        self._evict_buckets(now)
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+
+        wait = (1.0 - bucket[0]) / rate
+        if wait <= max_delay:
+            # резервируем токен сразу, чтобы параллельные апдейты встали в очередь
+            bucket[0] -= 1.0
+        return wait
+
+    def _release(self, key: str, lock: asyncio.Lock, owner: object) -> None:
+        # владельца проверяем, как Redis: истёкшая блокировка уже чужая
+        if self._lock_owners.get(key) is not owner:
+            return
+        del self._lock_owners[key]
+        lock.release()
+        # не копим блокировки по всем ключам, которые когда-либо видели
+        if not lock.locked() and not getattr(lock, "_waiters", None):
+            if self._locks.get(key) is lock:
+                del self._locks[key]
+
+    @asynccontextmanager
+    async def lock(self, key: str, timeout: float, wait: float) -> AsyncIterator[bool]:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        if wait <= 0:
+            # wait_for с нулевым таймаутом не успевает взять даже свободную
+            # блокировку; свободную берём сразу, занятую не ждём
+            if lock.locked():
+                yield False
+                return
+            await lock.acquire()
+        else:
+            try:
+                await asyncio.wait_for(lock.acquire(), timeout=wait)
+            except asyncio.TimeoutError:
+                yield False
+                return
+        owner = object()
+        self._lock_owners[key] = owner
+        # как у Redis: через timeout блокировка истекает, даже если владелец завис
+        expiry = asyncio.get_running_loop().call_later(
+            timeout, self._release, key, lock, owner
+        )
+        try:
+            yield True
+        finally:
+            expiry.cancel()
+            self._release(key, lock, owner)
+
+
+# Token bucket целиком на стороне Redis — одна атомарная операция на апдейт
+_TAKE_TOKEN_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_delay = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local boost = tonumber(ARGV[5])
+if #KEYS > 1 and redis.call('EXISTS', KEYS[2]) == 1 then
+    burst = burst * boost
+end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(data[1])
+local updated = tonumber(data[2])
+if tokens == nil then
+    tokens = burst
+    updated = now
+end
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+    if wait <= max_delay then
+        tokens = tokens - 1
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """Бэкенд поверх любого сервера с протоколом Redis (redis, valkey, fakeredis)."""
+
+    def __init__(self, redis, prefix: str = "gdz:") -> None:
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        self._redis = redis
+        self._prefix = prefix
+        self._storage = RedisStorage(redis=redis)
+        self._take_token = redis.register_script(_TAKE_TOKEN_LUA)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStateBackend":
+        from redis.asyncio import Redis
+
+        return cls(Redis.from_url(url, decode_responses=True))
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    def fsm_storage(self) -> BaseStorage:
+        return self._storage
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(self._key(key))
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        px = int(ttl * 1000) if ttl else None
+        await self._redis.set(self._key(key), value, px=px)
+
+    async def set_many(self, items: dict[str, str], ttl: Optional[float] = None) -> None:
+        if not items:
+            return
+        px = int(ttl * 1000) if ttl else None
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(self._key(key), value, px=px)
+            await pipe.execute()
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._redis.delete(*(self._key(k) for k in keys))
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return int(await self._redis.incrby(self._key(key), amount))
+
+    async def take_token(
+        self,
+        key: str,
+        rate: float,
+        burst: float,
+        max_delay: float,
+        idle_ttl: float,
+        boost_key: Optional[str] = None,
+        boost: float = 1.0,
+    ) -> float:
+        keys = [self._key(key)]
+        if boost_key is not None:
+            keys.append(self._key(boost_key))
+        wait = await self._take_token(
+            keys=keys,
+            args=[rate, burst, max_delay, max(int(idle_ttl), 1), boost],
+        )
+        return float(wait)
+
+    @asynccontextmanager
+    async def lock(self, key: str, timeout: float, wait: float) -> AsyncIterator[bool]:
+        lock = self._redis.lock(
+            self._key(f"lock:{key}"), timeout=timeout, blocking_timeout=wait
+        )
+        acquired = await lock.acquire()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                try:
+                    await lock.release()
+                except Exception:
+                    # блокировка успела истечь по timeout — это не ошибка
+                    pass
+
+    async def close(self) -> None:
+        await self._storage.close()
+
+
+_backend: Optional[StateBackend] = None
+
+
+def get_state_backend() -> StateBackend:
+    """Бэкенд процесса: Redis, если задан REDIS_URL, иначе память."""
+    global _backend
+    if _backend is None:
+        if settings.redis_url:
+            _backend = RedisStateBackend.from_url(settings.redis_url)
+        else:
+            _backend = InMemoryStateBackend()
+    return _backend
@@ -0,0 +1,136 @@
+# app/services/stats.py
+import logging
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.dialect import insert
+from app.db.models import DailyUsage, Task, UsageRollup
+from app.db.session import get_session
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COUNTERS = (
+    "active_users",
+    "photos",
+    "premium_photos",
+    "cache_hits",
+    "rejected",
+    "errors",
+    "prompt_tokens",
+    "completion_tokens",
+)
+# Что rebuild_rollup умеет пересчитать из таблиц; остальное в них не хранится
+# (попадание в кэш, отказы, ошибки) и при пересчёте остаётся как было
+REBUILT_COUNTERS = (
+    "active_users",
+    "photos",
+    "premium_photos",
+    "prompt_tokens",
+    "completion_tokens",
+)
+KEPT_COUNTERS = ("cache_hits", "rejected", "errors")
+assert set(REBUILT_COUNTERS) | set(KEPT_COUNTERS) == set(ROLLUP_COUNTERS)
+
+
+async def bump_rollup(session: AsyncSession, day: date, **increments: int) -> None:
+    """
+    Прибавляет счётчики к строке дня одним upsert'ом (commit — на вызывающем).
+    Статистика потом читается по первичному ключу, без сканов tasks.
+    """
+    increments = {k: v for k, v in increments.items() if v}
+    if not increments:
+        return
+    unknown = set(increments) - set(ROLLUP_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown rollup counters: {sorted(unknown)}")
+
+    stmt = insert(UsageRollup).values(
+        date=day,
+        **{name: increments.get(name, 0) for name in ROLLUP_COUNTERS},
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageRollup.date],
+        set_={
+            name: getattr(UsageRollup, name) + getattr(stmt.excluded, name)
+            for name in increments
+        },
+    )
+    await session.execute(stmt)
+
+
+async def record_usage(day: date, **increments: int) -> None:
+    """bump_rollup в отдельной сессии — для веток с ошибками и отказами."""
+    try:
+        async with get_session() as session:
+            await bump_rollup(session, day, **increments)
+            await session.commit()
+    except Exception:
+        # статистика не должна ронять обработку апдейта
+        logger.exception("rollup update failed", extra={"counters": increments})
+
+
+async def get_rollups(
+    session: AsyncSession,
+    today: date,
+    days: int = 7,
+) -> list[UsageRollup]:
+    """Последние days дней, новые сверху. Диапазон по PK — O(days)."""
+    stmt = (
+        select(UsageRollup)
+        .where(UsageRollup.date > today - timedelta(days=days))
+        .order_by(UsageRollup.date.desc())
+    )
+    result = await session.execute(stmt)
+    return list(result.scalars().all())
+
+
+async def rebuild_rollup(session: AsyncSession, day: date) -> UsageRollup:
+    """
+    Пересчитывает строку дня из таблиц — для бэкфилла истории до появления
+    роллапов или после ручных правок. Определения те же, что у инкрементов:
+    active_users — пользователи со строкой daily_usage за день (её создаёт
+    первый запрос дня, bump_rollup считает там же), остальное — из tasks.
+    KEPT_COUNTERS в таблицах не хранятся и не трогаются. active_users тоже
+    не трогаем, если строки daily_usage за день уже удалены обслуживанием.
+    """
+    start = datetime.combine(
+        day, datetime.min.time(), tzinfo=ZoneInfo(settings.moscow_tz)
+    )
+    stmt = select(
+        func.count(Task.id),
+        func.coalesce(func.sum(cast(Task.is_premium, Integer)), 0),
+        func.coalesce(func.sum(Task.prompt_tokens), 0),
+        func.coalesce(func.sum(Task.completion_tokens), 0),
+    ).where(Task.created_at >= start, Task.created_at < start + timedelta(days=1))
+    photos, premium, prompt, completion = (await session.execute(stmt)).one()
+    values = {
+        "photos": photos,
+        "premium_photos": premium,
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+    }
+
+    today = datetime.now(ZoneInfo(settings.moscow_tz)).date()
+    if day >= today - timedelta(days=settings.daily_usage_keep_days):
+        values["active_users"] = (
+            await session.execute(
+                select(func.count(func.distinct(DailyUsage.user_id))).where(
+                    DailyUsage.date == day
+                )
+            )
+        ).scalar_one()
+
+    upsert = insert(UsageRollup).values(
+        date=day, **{name: values.get(name, 0) for name in ROLLUP_COUNTERS}
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[UsageRollup.date],
+        set_={name: getattr(upsert.excluded, name) for name in values},
+    )
+    await session.execute(upsert)
+    await session.commit()
+    return await session.get(UsageRollup, day, populate_existing=True)
@@ -0,0 +1,83 @@
+# app/services/text_split.py
+import html
+
+# Лимит Telegram на длину одного текстового сообщения. Telegram считает
+# длину в UTF-16: эмодзи и прочие символы вне BMP занимают по две единицы.
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+EMPTY_ANSWER_TEXT = "Текст решения пустой 🤷 Пришли фото ещё раз."
+
+
+def _length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _hard_split(text: str, limit: int) -> list[str]:
+    """По символам, не разрывая суррогатные пары."""
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for char in text:
+        width = 2 if ord(char) > 0xFFFF else 1
+        if size + width > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _pack(pieces: list[str], sep: str, limit: int) -> list[str]:
+    """Склеивает куски через sep, пока влезает в limit."""
+    chunks: list[str] = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}{sep}{piece}" if current else piece
+        if _length(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Режет длинный ответ на сообщения не длиннее limit.
+    Сначала по абзацам, слишком длинные абзацы — по строкам,
+    совсем длинные строки — жёстко по символам.
+    """
+    text = text.strip()
+    if _length(text) <= limit:
+        return [text] if text else []
+
+    pieces: list[str] = []
+    for paragraph in text.split("\n\n"):
+        if _length(paragraph) <= limit:
+            pieces.append(paragraph)
+            continue
+        for line_chunk in _pack(paragraph.split("\n"), "\n", limit):
+            if _length(line_chunk) <= limit:
+                pieces.append(line_chunk)
+            else:
+                pieces.extend(_hard_split(line_chunk, limit))
+
+    return _pack(pieces, "\n\n", limit)
+
+
+def answer_messages(text: str) -> list[str]:
+    """
+    Текст решения для отправки с parse_mode=HTML бота по умолчанию.
+    Режем по видимому тексту, потом экранируем каждый кусок: «<» и «&» из
+    решения показываются как есть, а разрезанной сущности не бывает.
+    Пустой ответ — одно сообщение-заглушка, чтобы кнопка не молчала.
+    """
+    chunks = split_message(text)
+    if not chunks:
+        return [EMPTY_ANSWER_TEXT]
+    return [html.escape(chunk, quote=False) for chunk in chunks]
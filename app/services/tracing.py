@@ -0,0 +1,201 @@
+# app/services/tracing.py
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from app.config import settings
+
+slow_logger = logging.getLogger("app.slow")
+
+# Стандартные поля LogRecord — всё остальное считаем structured-полями из extra
+_RECORD_ATTRS = set(
+    logging.LogRecord("", 0, "", 0, "", None, None).__dict__
+) | {"message", "asctime"}
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    parent: Optional[int]
+    end: Optional[float] = None
+    attrs: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    update_id: Optional[int]
+    user_id: Optional[int] = None
+    sampled: bool = True
+    start: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    current: Optional[int] = None
+
+    def duration_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def tree(self) -> list[dict[str, Any]]:
+        """Спаны в виде дерева: смещения и длительности в миллисекундах."""
+        nodes = [
+            {
+                "name": s.name,
+                "offset_ms": round((s.start - self.start) * 1000, 2),
+                "duration_ms": (
+                    round((s.end - s.start) * 1000, 2) if s.end is not None else None
+                ),
+                **({"attrs": s.attrs} if s.attrs else {}),
+                **({"error": s.error} if s.error else {}),
+                "children": [],
+            }
+            for s in self.spans
+        ]
+        roots = []
+        for span, node in zip(self.spans, nodes):
+            if span.parent is None:
+                roots.append(node)
+            else:
+                nodes[span.parent]["children"].append(node)
+        return roots
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def start_trace(update_id: Optional[int], user_id: Optional[int] = None) -> Trace:
+    trace = Trace(
+        trace_id=uuid.uuid4().hex[:16],
+        update_id=update_id,
+        user_id=user_id,
+        sampled=random.random() < settings.trace_sample_rate,
+    )
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+    def set(self, **attrs: Any) -> None:
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ("trace", "index", "prev")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict[str, Any]) -> None:
+        self.trace = trace
+        self.prev = trace.current
+        self.index = len(trace.spans)
+        trace.spans.append(
+            Span(name=name, start=time.perf_counter(), parent=self.prev, attrs=attrs)
+        )
+
+    def __enter__(self) -> "_SpanContext":
+        self.trace.current = self.index
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        span = self.trace.spans[self.index]
+        span.end = time.perf_counter()
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        self.trace.current = self.prev
+
+    def set(self, **attrs: Any) -> None:
+        self.trace.spans[self.index].attrs.update(attrs)
+
+
+def span(name: str, **attrs: Any) -> "_SpanContext | _NoopSpan":
+    """
+    Отрезок работы внутри апдейта: with span("openai"): ...
+    Вне трейса и в несэмплированных трейсах ничего не записывает.
+    """
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        return _NOOP
+    return _SpanContext(trace, name, attrs)
+
+
+def finish_trace(trace: Trace, update_type: Optional[str] = None) -> None:
+    """Пишет апдейт в slow-лог, если он обработался дольше порога."""
+    duration_ms = trace.duration_ms()
+    if duration_ms < settings.slow_update_ms:
+        return
+    payload: dict[str, Any] = {
+        "update_type": update_type,
+        "duration_ms": round(duration_ms, 2),
+        "sampled": trace.sampled,
+    }
+    if trace.sampled:
+        payload["spans"] = trace.tree()
+    slow_logger.warning("slow update", extra=payload)
+
+
+class TraceContextFilter(logging.Filter):
+    """Добавляет trace_id/update_id/user_id текущего апдейта в каждую запись."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current_trace.get()
+        if trace is not None:
+            record.trace_id = trace.trace_id
+            record.update_id = trace.update_id
+            record.user_id = trace.user_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> None:
+    """JSON-логи в stdout (или текст при LOG_FORMAT=text) + отдельный slow-лог."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(TraceContextFilter())
+    if settings.log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - [%(levelname)s] - %(name)s - %(message)s")
+        )
+    logging.basicConfig(level=logging.INFO, handlers=[handler], force=True)
+
+    if settings.slow_log_path:
+        slow_handler = logging.FileHandler(settings.slow_log_path, encoding="utf-8")
+        slow_handler.addFilter(TraceContextFilter())
+        slow_handler.setFormatter(JsonFormatter())
+        slow_logger.addHandler(slow_handler)
+        # свой файл — значит не дублируем записи в общий stdout
+        slow_logger.propagate = False
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# app.config читает настройки из окружения при импорте.
+# SQLite — файлом: у пишущего и читающего пулов разные соединения.
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='gdz-tests-')}/test.db",
+)
+
+
+@pytest.fixture
+def run():
+    """asyncio.run для сценария + закрытие пулов: соединения asyncpg
+    привязаны к своему event loop и в следующем тесте не годятся."""
+    from app.db.session import engine, read_engine
+
+    def _run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await engine.dispose()
+                await read_engine.dispose()
+
+        return asyncio.run(main())
+
+    return _run
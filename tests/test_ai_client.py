@@ -0,0 +1,71 @@
+import pytest
+
+from app.services.ai_client import (
+    BASE_MAX_TOKENS,
+    SYSTEM_PROMPT,
+    build_vision_request,
+    choose_max_tokens,
+)
+
+# Промпт, на котором отлажены ответы бота: менять его — значит менять ответы
+USER_TEXT = (
+    "Реши задание по этой фотографии. Если в подписи указаны, какие номера "
+    "решать или как именно отвечать — строго соблюдай это.\n\n"
+    "{caption}"
+    "Дай в ответе само решение / ответы. Если нужно, можешь очень кратко "
+    "пояснить, но без лишней воды."
+)
+
+
+@pytest.mark.parametrize(
+    "caption, caption_text",
+    [
+        (None, ""),
+        ("   ", ""),
+        (" только ответ, №5 ", "Подпись к фото: только ответ, №5\n\n"),
+    ],
+)
+def test_prompt_is_unchanged(caption, caption_text):
+    request = build_vision_request(b"\xff\xd8jpeg", caption, max_tokens=321)
+    system, user = request["messages"]
+
+    assert system == {
+        "role": "system",
+        "content": [{"type": "text", "text": SYSTEM_PROMPT}],
+    }
+    assert user["role"] == "user"
+    text, image = user["content"]
+    assert text == {"type": "text", "text": USER_TEXT.format(caption=caption_text)}
+    assert image == {
+        "type": "image_url",
+        "image_url": {"url": "data:image/jpeg;base64,/9hqcGVn"},
+    }
+    assert request["max_tokens"] == 321
+
+
+@pytest.mark.parametrize(
+    "caption, exercises",
+    [
+        (None, 1),
+        ("реши", 1),
+        ("7 класс стр 78", 1),
+        ("алгебра 7 класс, стр. 78, упр 3", 1),
+        ("§ 12 стр 45 номер 5 и 6", 2),
+        ("реши 1, 2, 5", 3),
+        ("геометрия 8 кл стр 101 задачи 5.12, 5.13, 5.14", 3),
+    ],
+)
+def test_max_tokens_grow_with_exercises_only(caption, exercises):
+    base = BASE_MAX_TOKENS[True]
+    expected = base + (exercises - 1) * base // 4
+    assert choose_max_tokens(caption, is_premium=True) == expected
+
+
+def test_max_tokens_intent_and_limits():
+    base = BASE_MAX_TOKENS[False]
+    assert choose_max_tokens("только ответ", False) == base // 2
+    assert choose_max_tokens("объясни подробно", False) == int(base * 1.5)
+    # прошлые длинные ответы поднимают лимит, но не выше потолка тарифа
+    assert choose_max_tokens(None, False, recent_completion_tokens=[5000]) == 800
+    assert choose_max_tokens(None, False, remaining_budget=250) == 250
+    assert choose_max_tokens(None, False, remaining_budget=10) == 200
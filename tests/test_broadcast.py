@@ -0,0 +1,140 @@
+import asyncio
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from aiogram.methods import SendMessage
+from sqlalchemy import func, select, update
+
+from app.config import settings
+from app.db.models import Broadcast, User
+from app.db.session import get_session, init_db
+from app.services import broadcast as bc
+from app.services.limits import get_or_create_user
+
+RETRY_AFTER = 1
+
+
+class FakeBot:
+    """Bot API понарошку: пишет время каждой попытки и кидает ошибки Telegram."""
+
+    def __init__(self, blocked=(), gone=(), flood=(), hang_on=None) -> None:
+        self.blocked = set(blocked)
+        self.gone = set(gone)
+        self.flood = set(flood)
+        self.hang_on = hang_on
+        self.hanging = asyncio.Event()
+        self.attempts: list[float] = []
+        self.retry_at: list[float] = []
+        self.received: list[int] = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        self.attempts.append(now)
+        method = SendMessage(chat_id=chat_id, text=text)
+        if chat_id in self.flood:
+            self.flood.discard(chat_id)
+            self.retry_at.append(now)
+            raise TelegramRetryAfter(method, "Too Many Requests", RETRY_AFTER)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, "bot was blocked by the user")
+        if chat_id in self.gone:
+            raise TelegramBadRequest(method, "chat not found")
+        if chat_id == self.hang_on:
+            # «рестарт» посреди отправки: задачу отменят, сообщение не уйдёт
+            self.hanging.set()
+            await asyncio.sleep(3600)
+        self.received.append(chat_id)
+
+    async def edit_message_text(self, **kwargs) -> None:
+        return None
+
+
+async def _prepare(first_tg_id: int, count: int) -> tuple[int, list[int]]:
+    """Получатели рассылки — только свои пользователи, чужие тесты не задеваем."""
+    await init_db()
+    now = datetime.now(ZoneInfo(settings.moscow_tz))
+    async with get_session() as session:
+        base = (await session.execute(select(func.max(User.id)))).scalar() or 0
+        for tg_id in range(first_tg_id, first_tg_id + count):
+            await get_or_create_user(session, tg_id, None, now)
+        await session.commit()
+
+    broadcast = await bc.create_broadcast("Привет!", admin_chat_id=1)
+    async with get_session() as session:
+        await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast.id)
+            .values(last_user_id=base, total=count)
+        )
+        await session.commit()
+    return broadcast.id, list(range(first_tg_id, first_tg_id + count))
+
+
+async def _load(broadcast_id: int) -> Broadcast:
+    async with get_session() as session:
+        return await session.get(Broadcast, broadcast_id)
+
+
+def test_pacing_retry_after_and_counters(monkeypatch, run):
+    rate = 20
+    monkeypatch.setattr(settings, "broadcast_rate", float(rate))
+    monkeypatch.setattr(settings, "broadcast_workers", 4)
+
+    async def scenario():
+        broadcast_id, chats = await _prepare(810_000, 40)
+        bot = FakeBot(blocked=chats[3:6], gone=chats[7:8], flood=chats[10:11])
+        await bc.run_broadcast(bot, broadcast_id)
+        return bot, chats, await _load(broadcast_id)
+
+    bot, chats, final = run(scenario())
+
+    # не больше rate попыток в любом окне в 1 секунду
+    attempts = sorted(bot.attempts)
+    assert len(attempts) == len(chats) + 1
+    for i in range(len(attempts) - rate):
+        assert attempts[i + rate] - attempts[i] >= 1.0 - 0.02
+
+    # после retry_after молчат все воркеры, а не только получивший ошибку
+    (flood_at,) = bot.retry_at
+    later = [t for t in attempts if t > flood_at]
+    assert later
+    assert min(later) - flood_at >= RETRY_AFTER - 0.02
+
+    assert final.status == "done"
+    assert (final.delivered, final.blocked, final.failed) == (36, 3, 1)
+    assert sorted(bot.received) == sorted(set(chats) - set(chats[3:6]) - {chats[7]})
+
+
+def test_resume_from_checkpoint_without_resending(monkeypatch, run):
+    monkeypatch.setattr(settings, "broadcast_rate", 200.0)
+    monkeypatch.setattr(settings, "broadcast_workers", 1)
+
+    async def scenario():
+        broadcast_id, chats = await _prepare(820_000, 12)
+
+        first = FakeBot(hang_on=chats[5])
+        task = asyncio.create_task(bc.run_broadcast(first, broadcast_id))
+        await first.hanging.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        interrupted = await _load(broadcast_id)
+
+        second = FakeBot()
+        await bc.run_broadcast(second, broadcast_id)
+        return chats, first, second, interrupted, await _load(broadcast_id)
+
+    chats, first, second, interrupted, final = run(scenario())
+
+    assert first.received == chats[:5]
+    assert interrupted.status == "running"
+    assert interrupted.delivered == 5
+    # второй прогон начинается ровно с того, кто был «в полёте»
+    assert second.received == chats[5:]
+    assert final.status == "done"
+    assert final.delivered == len(chats)
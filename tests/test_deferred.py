@@ -0,0 +1,215 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.db.models import DeferredTask, Task
+from app.db.session import get_session, init_db
+from app.services import deferred
+from app.services.ai_client import FakeBatchBackend
+from app.services.limits import get_or_create_user
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.photos: list[dict] = []
+        self.messages: list[str] = []
+
+    async def download(self, file_id, destination) -> None:
+        destination.write(b"\xff\xd8fake-jpeg")
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.photos.append({"chat_id": chat_id, **kwargs})
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file_{len(self.photos)}")])
+
+    async def send_message(self, chat_id, text, **kwargs) -> None:
+        self.messages.append(text)
+
+
+def test_submit_poll_deliver(monkeypatch, run):
+    monkeypatch.setattr(settings, "deferred_min_batch", 1)
+
+    async def scenario():
+        await init_db()
+        now = datetime.now(ZoneInfo(settings.moscow_tz))
+        async with get_session() as session:
+            user = await get_or_create_user(session, 7001, "night_owl", now)
+            await session.commit()
+        ids = [
+            await deferred.enqueue_deferred(
+                user=user,
+                chat_id=7001,
+                message_id=10 + i,
+                telegram_file_id=f"photo_{i}",
+                caption="номер 5",
+                max_tokens=500,
+                now_moscow=now,
+            )
+            for i in range(2)
+        ]
+
+        bot = FakeBot()
+        backend = FakeBatchBackend(pending_polls=1, answer="x = 42")
+
+        # 1) отправка батча, 2) батч ещё в работе, 3) досылка решений
+        assert await deferred.run_deferred_cycle(bot, backend) == {
+            "delivered": 0,
+            "submitted": 2,
+        }
+        assert await deferred.run_deferred_cycle(bot, backend) == {
+            "delivered": 0,
+            "submitted": 0,
+        }
+        assert await deferred.run_deferred_cycle(bot, backend) == {
+            "delivered": 2,
+            "submitted": 0,
+        }
+
+        async with get_session() as session:
+            items = (
+                await session.execute(
+                    select(DeferredTask).where(DeferredTask.id.in_(ids))
+                )
+            ).scalars().all()
+            assert {item.status for item in items} == {"done"}
+            tasks = (
+                await session.execute(
+                    select(Task).where(Task.id.in_([item.task_id for item in items]))
+                )
+            ).scalars().all()
+        assert [task.answer_text for task in tasks] == ["x = 42", "x = 42"]
+        assert sorted(p["reply_to_message_id"] for p in bot.photos) == [10, 11]
+        assert not bot.messages
+
+    run(scenario())
+
+
+class CountingBackend(FakeBatchBackend):
+    def __init__(self, crash: BaseException | None = None, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.crash = crash
+        self.submits = 0
+
+    async def submit(self, requests):
+        batch_id = await super().submit(requests)
+        self.submits += 1
+        if self.crash is not None:
+            # батч принят (и оплачен), а записать batch_id не успели
+            raise self.crash
+        return batch_id
+
+
+class BrokenPhotoBot(FakeBot):
+    async def send_photo(self, chat_id, photo, **kwargs):
+        raise RuntimeError("telegram is down")
+
+
+async def _enqueue(tg_id: int, count: int) -> list[int]:
+    await init_db()
+    now = datetime.now(ZoneInfo(settings.moscow_tz))
+    async with get_session() as session:
+        user = await get_or_create_user(session, tg_id, None, now)
+        await session.commit()
+    return [
+        await deferred.enqueue_deferred(
+            user=user,
+            chat_id=tg_id,
+            message_id=20 + i,
+            telegram_file_id=f"photo_{tg_id}_{i}",
+            caption=None,
+            max_tokens=500,
+            now_moscow=now,
+        )
+        for i in range(count)
+    ]
+
+
+async def _items(ids: list[int]) -> list[DeferredTask]:
+    async with get_session() as session:
+        result = await session.execute(
+            select(DeferredTask)
+            .where(DeferredTask.id.in_(ids))
+            .order_by(DeferredTask.id)
+        )
+        return list(result.scalars().all())
+
+
+def test_failed_send_keeps_saved_solution_done(monkeypatch, run):
+    monkeypatch.setattr(settings, "deferred_min_batch", 1)
+
+    async def scenario():
+        ids = await _enqueue(7002, 1)
+        bot = BrokenPhotoBot()
+        backend = FakeBatchBackend(pending_polls=0, answer="y = 7")
+        await deferred.run_deferred_cycle(bot, backend)
+        report = await deferred.run_deferred_cycle(bot, backend)
+        (item,) = await _items(ids)
+        async with get_session() as session:
+            task = await session.get(Task, item.task_id)
+        return report, item, task, bot
+
+    report, item, task, bot = run(scenario())
+    assert report["delivered"] == 1
+    # решение сохранено и лимит списан — задание не проваливаем
+    assert item.status == "done"
+    assert item.error == "delivery failed"
+    assert task.answer_text == "y = 7"
+    # вместо «пришли ещё раз» — ссылка на готовое решение
+    (fallback,) = bot.messages
+    assert "готово" in fallback
+    assert "ещё раз" not in fallback
+
+
+def test_crash_after_submit_does_not_resubmit(monkeypatch, run):
+    monkeypatch.setattr(settings, "deferred_min_batch", 1)
+
+    async def scenario():
+        ids = await _enqueue(7003, 2)
+        bot = FakeBot()
+        crashed = CountingBackend(crash=asyncio.CancelledError())
+        try:
+            await deferred.run_deferred_cycle(bot, crashed)
+        except asyncio.CancelledError:
+            pass
+        stuck = await _items(ids)
+
+        # «после рестарта»
+        restarted = CountingBackend()
+        report = await deferred.run_deferred_cycle(bot, restarted)
+        return stuck, report, crashed, restarted, await _items(ids), bot
+
+    stuck, report, crashed, restarted, final, bot = run(scenario())
+    assert {item.status for item in stuck} == {"submitting"}
+    assert crashed.submits == 1
+    assert restarted.submits == 0
+    assert report["submitted"] == 0
+    assert {(item.status, item.error) for item in final} == {
+        ("failed", "submit interrupted")
+    }
+    assert len(bot.messages) == 2
+
+
+def test_submit_error_returns_tasks_to_queue(monkeypatch, run):
+    monkeypatch.setattr(settings, "deferred_min_batch", 1)
+
+    async def scenario():
+        ids = await _enqueue(7004, 1)
+        failing = CountingBackend(crash=ConnectionError("upload failed"))
+        try:
+            await deferred.run_deferred_cycle(FakeBot(), failing)
+        except ConnectionError:
+            pass
+        returned = await _items(ids)
+        backend = CountingBackend(pending_polls=0)
+        await deferred.run_deferred_cycle(FakeBot(), backend)
+        submitted = await _items(ids)
+        # добираем батч, чтобы не оставить задание висеть для других тестов
+        await deferred.run_deferred_cycle(FakeBot(), backend)
+        return returned, submitted
+
+    returned, submitted = run(scenario())
+    assert [item.status for item in returned] == ["pending"]
+    assert [item.status for item in submitted] == ["submitted"]
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+from app.config import settings
+from app.db.session import get_session, init_db
+from app.services import exercise_cache
+from app.services.exercise_cache import add_cached_answer, find_cached_answer
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+PAGE = 0x0F0F_0F0F_0F0F_0F0F
+# тот же лист, снятый чуть иначе: пара бит dHash отличается
+PAGE_AGAIN = PAGE ^ 0b101
+OTHER_PAGE = ~PAGE & (2**64 - 1)
+
+
+async def _vote(key: str, answers: list[str], image_hash: int = PAGE) -> None:
+    await init_db()
+    async with get_session() as session:
+        for i, answer in enumerate(answers):
+            add_cached_answer(
+                session,
+                key=key,
+                image_hash=image_hash,
+                answer_text=answer,
+                task_id=None,
+                now_moscow=NOW - timedelta(minutes=len(answers) - i),
+            )
+        await session.commit()
+
+
+async def _lookup(key: str, image_hash: int = PAGE) -> str | None:
+    async with get_session() as session:
+        found = await find_cached_answer(session, key, image_hash, NOW)
+    return found.answer_text if found is not None else None
+
+
+def test_first_answer_is_not_served(run):
+    key = "subj=algebra|grade=7|p=78|ex=1"
+
+    async def scenario():
+        await _vote(key, ["x = 5"])
+        before = exercise_cache.stats.unconfirmed
+        found = await _lookup(key, PAGE_AGAIN)
+        return found, exercise_cache.stats.unconfirmed - before
+
+    assert run(scenario()) == (None, 1)
+
+
+def test_two_agreeing_answers_are_served(run):
+    key = "subj=algebra|grade=7|p=78|ex=2"
+
+    async def scenario():
+        # регистр, пробелы и разметка — тот же ответ
+        await _vote(key, ["**Ответ:** x = 5", "ответ: X=5"])
+        return await _lookup(key, PAGE_AGAIN), await _lookup(key, OTHER_PAGE)
+
+    served, other_page = run(scenario())
+    # отдаём самый свежий из согласных
+    assert served == "ответ: X=5"
+    assert other_page is None
+
+
+def test_disagreement_waits_for_a_majority(run):
+    key = "subj=physics|grade=9|p=14|ex=3"
+
+    async def scenario():
+        await _vote(key, ["v = 10 м/с", "v = 12 м/с"])
+        split = await _lookup(key)
+        await _vote(key, ["v = 12 м/с"])
+        return split, await _lookup(key)
+
+    assert run(scenario()) == (None, "v = 12 м/с")
+
+
+def test_agreement_on_other_photos_does_not_count(run):
+    key = "subj=russian|grade=5|p=40|ex=4"
+
+    async def scenario():
+        await _vote(key, ["Ответ А"], image_hash=OTHER_PAGE)
+        await _vote(key, ["Ответ А"])
+        return await _lookup(key)
+
+    # похожее фото только одно — голос с чужой страницы не считается
+    assert run(scenario()) is None
+
+
+def test_min_agreement_is_configurable(monkeypatch, run):
+    monkeypatch.setattr(settings, "exercise_cache_min_agreement", 1)
+    key = "subj=geometry|grade=8|p=101|ex=5"
+
+    async def scenario():
+        await _vote(key, ["угол 30°"])
+        return await _lookup(key)
+
+    assert run(scenario()) == "угол 30°"
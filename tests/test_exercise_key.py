@@ -0,0 +1,36 @@
+import pytest
+
+from app.services.exercise_key import normalize_exercise_key
+
+
+@pytest.mark.parametrize(
+    "caption, key",
+    [
+        ("Алгебра 7 класс, стр 78 упр 3", "subj=algebra|grade=7|p=78|ex=3"),
+        ("упр.3 стр.78 алгебра 7 класс", "subj=algebra|grade=7|p=78|ex=3"),
+        ("упр.3 стр.78 алгебра 7 кл", "subj=algebra|grade=7|p=78|ex=3"),
+        ("алгебра стр. 12 номер 5 и 6", "subj=algebra|p=12|ex=5,6"),
+        ("8 класс, с. 40 упр 7", "grade=8|p=40|ex=7"),
+        ("физика 9 класс задача 14", "subj=physics|grade=9|ex=14"),
+    ],
+)
+def test_key_with_textbook_context(caption, key):
+    assert normalize_exercise_key(caption) == key
+
+
+@pytest.mark.parametrize(
+    "caption",
+    [
+        None,
+        "",
+        "номер 1",
+        "реши упр 5 пожалуйста",
+        "алгебра номер 3",
+        "7 класс №12",
+        "стр 45",
+        "стр. 12 номер 5 и 6",
+        "§ 3 стр 12 упр 4",
+    ],
+)
+def test_no_key_without_textbook_context(caption):
+    assert normalize_exercise_key(caption) is None
@@ -0,0 +1,79 @@
+import csv
+import gzip
+import io
+import json
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import insert
+
+from app.config import settings
+from app.db.compression import compress_answer
+from app.db.models import Task
+from app.db.session import get_session, init_db
+from app.services.export import EXPORT_BATCH, EXPORT_TABLES, export_table
+from app.services.limits import get_or_create_user
+
+# Больше одной пачки курсора, чтобы граница EXPORT_BATCH попала внутрь выгрузки
+ROWS = EXPORT_BATCH + 1500
+# Свой день: другие тесты задачи туда не пишут, а сжатие старых ответов
+# обслуживанием его не трогает
+DAY = date(2099, 3, 14)
+
+
+def _answer(i: int) -> str:
+    return f"Задание {i}: ответ x = {i}, «кавычки», запятая и\nперенос строки"
+
+
+async def _seed() -> None:
+    await init_db()
+    tz = ZoneInfo(settings.moscow_tz)
+    start = datetime.combine(DAY, datetime.min.time(), tzinfo=tz)
+    async with get_session() as session:
+        user = await get_or_create_user(session, 880_001, None, start)
+        # каждый третий ответ уже сжат фоновым обслуживанием
+        await session.execute(
+            insert(Task),
+            [
+                dict(
+                    user_id=user.id,
+                    created_at=start + timedelta(seconds=i * 10),
+                    answer_text=None if i % 3 == 0 else _answer(i),
+                    answer_compressed=(
+                        compress_answer(_answer(i)) if i % 3 == 0 else None
+                    ),
+                    prompt_tokens=i,
+                )
+                for i in range(ROWS)
+            ],
+        )
+        await session.commit()
+
+
+def test_export_csv_and_jsonl(run):
+    async def scenario():
+        await _seed()
+        return [await export_table("tasks", DAY, DAY, fmt) for fmt in ("csv", "jsonl")]
+
+    exported = {}
+    for result in run(scenario()):
+        with result.file:
+            exported[result.filename] = result, gzip.decompress(result.file.read())
+
+    result, data = exported["tasks_20990314-20990314.csv.gz"]
+    text = data.decode("utf-8")
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == EXPORT_TABLES["tasks"].columns
+    assert len(rows) - 1 == result.rows == ROWS
+    assert result.raw_bytes == len(data)
+    # сжатые и несжатые ответы выгружаются одинаково, по порядку created_at
+    assert [row[-1] for row in rows[1:]] == [_answer(i) for i in range(ROWS)]
+    assert [int(row[4]) for row in rows[1:]] == list(range(ROWS))
+
+    result, data = exported["tasks_20990314-20990314.jsonl.gz"]
+    records = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+    assert len(records) == result.rows == ROWS
+    assert list(records[0]) == EXPORT_TABLES["tasks"].columns
+    assert [r["answer"] for r in records] == [_answer(i) for i in range(ROWS)]
+    # дата — ISO с поясом, разбирается обратно без потерь
+    assert datetime.fromisoformat(records[0]["created_at"]).utcoffset() is not None
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.db.models import Task
+from app.db.session import get_session, init_db
+from app.services.history import (
+    decode_cursor,
+    encode_cursor,
+    history_page_query,
+    list_history,
+)
+from app.services.limits import get_or_create_user
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        (datetime(2026, 10, 19, 9, 30, 0, 123456, tzinfo=timezone.utc), 1),
+        (datetime(1970, 1, 1, tzinfo=timezone.utc), 0),
+        (datetime(2099, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc), 2**31 - 1),
+    ],
+)
+def test_cursor_round_trip(cursor):
+    raw = encode_cursor(cursor)
+    assert decode_cursor(raw) == cursor
+    # callback_data целиком не длиннее 64 байт
+    assert len(f"hist:{raw}".encode()) <= 64
+
+
+def test_cursor_keeps_timezone_instant():
+    moscow = timezone(timedelta(hours=3))
+    local = datetime(2026, 10, 19, 12, 0, tzinfo=moscow)
+    created_at, _ = decode_cursor(encode_cursor((local, 5)))
+    assert created_at == local
+
+
+@pytest.mark.parametrize("raw", ["", "abc", "zz.", ".1", "1.2.3", "!!.1"])
+def test_broken_cursor_is_rejected(raw):
+    assert decode_cursor(raw) is None
+
+
+async def _seed(tg_id: int, count: int, ties: int) -> list[int]:
+    """count задач, по ties штук с одинаковым created_at. Отдаёт id, новые сверху."""
+    await init_db()
+    base = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+    async with get_session() as session:
+        user = await get_or_create_user(session, tg_id, None, base)
+        tasks = [
+            Task(
+                user_id=user.id,
+                created_at=base + timedelta(seconds=i // ties),
+                answer_text=f"answer {i}",
+            )
+            for i in range(count)
+        ]
+        session.add_all(tasks)
+        await session.commit()
+        ordered = sorted(tasks, key=lambda t: (t.created_at, t.id), reverse=True)
+        return [task.id for task in ordered]
+
+
+async def _walk(tg_id: int, limit: int) -> list[list[int]]:
+    """Листаем, как кнопка «Ещё»: курсор каждый раз через callback_data."""
+    pages, raw = [], None
+    while True:
+        after = decode_cursor(raw) if raw is not None else None
+        async with get_session() as session:
+            items, next_cursor = await list_history(session, tg_id, after, limit)
+        pages.append([item.task_id for item in items])
+        if next_cursor is None:
+            return pages
+        raw = encode_cursor(next_cursor)
+
+
+@pytest.mark.parametrize("count", [23, 20, 5, 1])
+def test_pages_have_no_duplicates_or_gaps(run, count):
+    tg_id = 70_000 + count
+
+    async def scenario():
+        # по 4 задачи на одну и ту же микросекунду — границы страниц
+        # попадают внутрь групп с одинаковым created_at
+        expected = await _seed(tg_id, count, ties=4)
+        return expected, await _walk(tg_id, limit=5)
+
+    expected, pages = run(scenario())
+    assert [task_id for page in pages for task_id in page] == expected
+    assert all(len(page) == 5 for page in pages[:-1])
+    # число задач кратно странице — лишней пустой страницы нет
+    assert 0 < len(pages[-1]) <= 5
+
+
+def test_unknown_user_has_empty_history(run):
+    async def scenario():
+        await init_db()
+        async with get_session() as session:
+            return await list_history(session, owner_tg_id=404_404)
+
+    assert run(scenario()) == ([], None)
+
+
+def test_page_query_walks_the_index(run):
+    async def scenario():
+        await init_db()
+        async with get_session() as session:
+            conn = await session.connection()
+            if conn.dialect.name != "sqlite":
+                pytest.skip("EXPLAIN QUERY PLAN — только SQLite")
+            plans = []
+            for after in (None, (datetime(2026, 10, 1, tzinfo=timezone.utc), 10)):
+                compiled = history_page_query(1, after, 6).compile(
+                    dialect=conn.dialect
+                )
+                params = tuple(
+                    str(compiled.params[name]) for name in compiled.positiontup
+                )
+                rows = await conn.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {compiled}", params
+                )
+                plans.append(" | ".join(row[-1] for row in rows))
+            return plans
+
+    for plan in run(scenario()):
+        assert "USING INDEX ix_tasks_user_created_id" in plan
+        # порядок отдаёт индекс, без сортировки всех задач пользователя
+        assert "TEMP B-TREE" not in plan
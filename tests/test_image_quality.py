@@ -0,0 +1,88 @@
+import statistics
+import time
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from app.services.image_quality import assess_image_quality
+
+FIXTURES = Path(__file__).parent / "fixtures" / "quality"
+
+# Метка снимка — префикс имени файла: ok_*, blur_*, dark_*, bright_*, ...
+LABELS = ("ok", "blur", "dark", "bright", "resolution", "no_text")
+
+# Проверка стоит перед каждым вызовом OpenAI: на типичной машине ~8 мс на фото
+# 800 px и ~20 мс на 2560 px. Порог с запасом, чтобы не зависеть от железа.
+TIMING_RUNS = 7
+TIMING_LIMIT_MS = 60
+# Самые большие стороны фото, которые отдаёт Telegram
+TELEGRAM_SIDES = (1280, 2560)
+
+
+def _label(path: Path) -> str:
+    for label in sorted(LABELS, key=len, reverse=True):
+        if path.name.startswith(f"{label}_"):
+            return label
+    raise AssertionError(f"у фикстуры {path.name} нет метки")
+
+
+def _load() -> list[tuple[Path, str]]:
+    return [(path, _label(path)) for path in sorted(FIXTURES.glob("*.jpg"))]
+
+
+def test_fixtures_cover_every_label():
+    assert {label for _, label in _load()} == set(LABELS)
+
+
+def test_rejection_precision():
+    # Каждый отказ — это потерянное задание, поэтому хорошие фото не режем никогда
+    rejected = [
+        (path.name, label)
+        for path, label in _load()
+        if not assess_image_quality(path.read_bytes()).ok
+    ]
+    false_rejects = [name for name, label in rejected if label == "ok"]
+    assert rejected
+    assert false_rejects == []
+
+
+@pytest.mark.parametrize(
+    "path, label",
+    [item for item in _load() if item[1] != "ok"],
+    ids=lambda item: getattr(item, "name", None),
+)
+def test_bad_photo_rejected(path, label):
+    report = assess_image_quality(path.read_bytes())
+    assert not report.ok
+    # пустой лист без краёв неотличим от размытого — обе подсказки уместны
+    if label == "no_text":
+        assert report.reason in ("no_text", "blur")
+    else:
+        assert report.reason == label
+
+
+def _telegram_sized(side: int) -> tuple[str, bytes]:
+    img = Image.open(FIXTURES / "ok_page.jpg").convert("RGB")
+    img = img.resize((side * 3 // 4, side), Image.LANCZOS)
+    out = BytesIO()
+    img.save(out, "JPEG", quality=87)
+    return f"ok_page@{side}", out.getvalue()
+
+
+def test_assessment_is_fast():
+    photos = [(path.name, path.read_bytes()) for path, _ in _load()]
+    photos += [_telegram_sized(side) for side in TELEGRAM_SIDES]
+    slow = {}
+    for name, data in photos:
+        assess_image_quality(data)
+        timings = []
+        for _ in range(TIMING_RUNS):
+            started = time.perf_counter()
+            assess_image_quality(data)
+            timings.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(timings)
+        if median > TIMING_LIMIT_MS:
+            slow[name] = round(median, 1)
+    assert slow == {}
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app.config import settings
+from app.db.models import Task
+from app.db.session import get_session, init_db
+from app.services.limits import get_or_create_user, get_token_report, report_since
+
+
+def test_token_report_groups_by_moscow_day(run):
+    async def scenario():
+        await init_db()
+        tz = ZoneInfo(settings.moscow_tz)
+        now = datetime.now(tz)
+        # 01:30 МСК — в UTC это ещё предыдущие сутки
+        early = now.replace(hour=1, minute=30, second=0, microsecond=0)
+        async with get_session() as session:
+            user = await get_or_create_user(session, 9501, "early_bird", now)
+            session.add(
+                Task(user_id=user.id, created_at=early, prompt_tokens=10, completion_tokens=5)
+            )
+            session.add(
+                Task(
+                    user_id=user.id,
+                    created_at=early - timedelta(hours=3),
+                    prompt_tokens=1,
+                    completion_tokens=1,
+                )
+            )
+            await session.commit()
+            rows = await get_token_report(session, report_since(now, 2))
+
+        mine = {row.day: row for row in rows if row.telegram_user_id == 9501}
+        assert mine[early.date()].prompt_tokens == 10
+        assert mine[(early - timedelta(hours=3)).date()].prompt_tokens == 1
+
+    run(scenario())
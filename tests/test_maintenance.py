@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from aiogram.types import Chat, Message, User
+from sqlalchemy import func, select
+
+from app.config import settings
+from app.db.compression import load_answer
+from app.db.models import Task
+from app.db.session import get_session, init_db
+from app.services.limits import get_or_create_user
+from app.handlers.admin import admin_maintenance
+from app.services.maintenance import compress_old_answers, maintenance_lock
+
+
+def test_compress_old_answers_in_batches(run):
+    async def scenario():
+        await init_db()
+        now = datetime.now(ZoneInfo(settings.moscow_tz))
+        old = now - timedelta(days=settings.answer_compress_after_days + 1)
+        async with get_session() as session:
+            user = await get_or_create_user(session, 8001, None, now)
+            for i in range(7):
+                session.add(Task(user_id=user.id, created_at=old, answer_text=f"old {i}"))
+            session.add(Task(user_id=user.id, created_at=now, answer_text="fresh"))
+            await session.commit()
+
+        assert await compress_old_answers(now, batch_size=3) == 7
+        assert await compress_old_answers(now, batch_size=3) == 0
+
+        async with get_session() as session:
+            rows = (
+                await session.execute(
+                    select(Task.answer_text, Task.answer_compressed)
+                    .where(Task.user_id == user.id)
+                    .order_by(Task.id)
+                )
+            ).all()
+            left = (
+                await session.execute(
+                    select(func.count()).where(
+                        Task.user_id == user.id, Task.answer_text.is_not(None)
+                    )
+                )
+            ).scalar_one()
+        assert [load_answer(*row) for row in rows] == [
+            *(f"old {i}" for i in range(7)),
+            "fresh",
+        ]
+        assert left == 1
+
+    run(scenario())
+
+
+def test_manual_run_waits_for_scheduled_one(monkeypatch, run):
+    replies: list[str] = []
+
+    async def fake_answer(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "answer", fake_answer)
+    message = Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=settings.admin_id, type="private"),
+        from_user=User(id=settings.admin_id, is_bot=False, first_name="Admin"),
+        text="/maintenance",
+    )
+
+    async def scenario():
+        await init_db()
+        # плановый проход maintenance_loop в работе — ручной не стартует
+        async with maintenance_lock() as acquired:
+            assert acquired
+            await admin_maintenance(message)
+        busy = replies[:]
+        replies.clear()
+        await admin_maintenance(message)
+        # после ручного прохода блокировка свободна
+        async with maintenance_lock() as free:
+            assert free
+        return busy
+
+    busy = run(scenario())
+    assert busy == ["Обслуживание уже идёт, дождись его окончания ⏳"]
+    assert replies[0] == "Обслуживание БД запущено…"
+    assert replies[1].startswith("Готово✅")
@@ -0,0 +1,125 @@
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import insert, select
+
+from app.config import settings
+from app.db.models import User
+from app.db.session import get_session, init_db
+from app.services import premium_cache
+from app.services.premium import parse_targets, set_premium_bulk
+
+# Выдача премиума на столько ID должна укладываться с большим запасом
+LARGE_LIST = 5000
+LARGE_LIST_SECONDS = 10.0
+
+
+def _now() -> datetime:
+    return datetime.now(ZoneInfo(settings.moscow_tz))
+
+
+async def _add_users(rows: list[tuple[int, str | None, bool]]) -> None:
+    await init_db()
+    now = _now()
+    async with get_session() as session:
+        await session.execute(
+            insert(User),
+            [
+                dict(
+                    telegram_user_id=tg_id,
+                    username=username,
+                    first_seen_at=now,
+                    is_premium=is_premium,
+                    premium_since=now if is_premium else None,
+                )
+                for tg_id, username, is_premium in rows
+            ],
+        )
+        await session.commit()
+
+
+async def _premium_flags(tg_ids: list[int]) -> dict[int, bool]:
+    async with get_session() as session:
+        result = await session.execute(
+            select(User.telegram_user_id, User.is_premium).where(
+                User.telegram_user_id.in_(tg_ids)
+            )
+        )
+        return dict(result.all())
+
+
+def test_parse_targets_mixed_list():
+    targets = parse_targets("123, @Alice_01\nbob_the_cat;123 @x 0 -5 @Alice_01 99")
+    assert targets.ids == [123, 99]
+    assert targets.usernames == ["alice_01", "bob_the_cat"]
+    assert targets.invalid == ["@x", "0", "-5"]
+
+
+def test_grant_and_revoke_mixed_targets(run):
+    async def scenario():
+        await _add_users(
+            [
+                (610_001, "Alice_Grant", False),
+                (610_002, "bob_grant", True),
+                (610_003, None, False),
+                (610_004, "carol_grant", False),
+            ]
+        )
+        targets = parse_targets(
+            "@alice_grant 610002 610003 @BOB_GRANT 610999 @nobody_here ???"
+        )
+        async with get_session() as session:
+            granted = await set_premium_bulk(session, targets, True, _now())
+        flags = await _premium_flags([610_001, 610_002, 610_003, 610_004])
+        cached = {uid: await premium_cache.is_premium(uid) for uid in flags}
+
+        async with get_session() as session:
+            revoked = await set_premium_bulk(
+                session, parse_targets("610001 @bob_grant"), False, _now()
+            )
+        flags_after = await _premium_flags([610_001, 610_002, 610_003])
+        cached_after = {
+            uid: await premium_cache.is_premium(uid) for uid in flags_after
+        }
+        return granted, flags, cached, revoked, flags_after, cached_after
+
+    granted, flags, cached, revoked, flags_after, cached_after = run(scenario())
+
+    assert sorted(c.telegram_user_id for c in granted.changed) == [610_001, 610_003]
+    assert [c.telegram_user_id for c in granted.unchanged] == [610_002]
+    assert granted.not_found == ["610999", "@nobody_here"]
+    assert granted.invalid == ["???"]
+    assert flags == {610_001: True, 610_002: True, 610_003: True, 610_004: False}
+    assert cached == flags
+
+    assert sorted(c.telegram_user_id for c in revoked.changed) == [610_001, 610_002]
+    assert flags_after == {610_001: False, 610_002: False, 610_003: True}
+    # снятый премиум сразу пропадает из общего кэша (антифлуд, лимиты)
+    assert cached_after == flags_after
+
+
+def test_grant_large_list(run):
+    first = 620_000
+    tg_ids = list(range(first, first + LARGE_LIST))
+
+    async def scenario():
+        await _add_users([(tg_id, f"bulk_{tg_id}", False) for tg_id in tg_ids])
+        # половина — по @username, плюс сотня неизвестных ID
+        raw = " ".join(
+            [f"@bulk_{tg_id}" for tg_id in tg_ids[::2]]
+            + [str(tg_id) for tg_id in tg_ids[1::2]]
+            + [str(first + LARGE_LIST + i) for i in range(100)]
+        )
+        started = time.perf_counter()
+        async with get_session() as session:
+            result = await set_premium_bulk(session, parse_targets(raw), True, _now())
+        elapsed = time.perf_counter() - started
+        flags = await _premium_flags(tg_ids)
+        return result, elapsed, flags
+
+    result, elapsed, flags = run(scenario())
+    assert len(result.changed) == LARGE_LIST
+    assert len(result.not_found) == 100
+    assert all(flags.values()) and len(flags) == LARGE_LIST
+    assert elapsed < LARGE_LIST_SECONDS
@@ -0,0 +1,26 @@
+from aiohttp.test_utils import make_mocked_request
+
+from app.config import settings
+from app.services.profiling import _authorized
+
+
+def test_token_only_from_header(monkeypatch):
+    monkeypatch.setattr(settings, "profiling_token", "s3cret")
+
+    def request(path: str, token: str | None = None):
+        headers = {"X-Profiling-Token": token} if token is not None else {}
+        return make_mocked_request("GET", path, headers=headers)
+
+    assert _authorized(request("/debug/loop", "s3cret"))
+    assert not _authorized(request("/debug/loop", "wrong"))
+    assert not _authorized(request("/debug/loop"))
+    # токен в query-строке не принимаем: она попадает в логи прокси
+    assert not _authorized(request("/debug/loop?token=s3cret"))
+
+
+def test_no_token_configured_denies_everything(monkeypatch):
+    monkeypatch.setattr(settings, "profiling_token", "")
+    request = make_mocked_request(
+        "GET", "/debug/loop", headers={"X-Profiling-Token": ""}
+    )
+    assert not _authorized(request)
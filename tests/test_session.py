@@ -0,0 +1,123 @@
+import asyncio
+import sqlite3
+from datetime import date, datetime, timezone
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+from app.db.dialect import IS_SQLITE
+from app.db.models import DailyUsage
+from app.db.session import engine, get_session, init_db
+from app.services.limits import get_or_create_user
+
+pytestmark = pytest.mark.skipif(
+    not IS_SQLITE, reason="пулы чтения и записи различаются только в SQLite"
+)
+
+DAY = date(2099, 1, 1)
+
+
+async def _usage_row(tg_id: int) -> int:
+    await init_db()
+    async with get_session() as session:
+        user = await get_or_create_user(
+            session, tg_id, None, datetime.now(timezone.utc)
+        )
+        row = DailyUsage(user_id=user.id, date=DAY, used_requests=0)
+        session.add(row)
+        await session.commit()
+        return row.id
+
+
+async def _used_in(session, row_id: int) -> int:
+    return await session.scalar(
+        select(DailyUsage.used_requests).where(DailyUsage.id == row_id)
+    )
+
+
+async def _used(row_id: int, read_only: bool = False) -> int:
+    async with get_session(read_only=read_only) as session:
+        return await _used_in(session, row_id)
+
+
+def test_read_only_session_cannot_write(run):
+    async def scenario():
+        row_id = await _usage_row(930_001)
+        async with get_session(read_only=True) as session:
+            with pytest.raises(OperationalError, match="readonly"):
+                await session.execute(
+                    update(DailyUsage)
+                    .where(DailyUsage.id == row_id)
+                    .values(used_requests=99)
+                )
+        return await _used(row_id)
+
+    assert run(scenario()) == 0
+
+
+def test_reader_does_not_wait_for_open_write(run):
+    async def scenario():
+        row_id = await _usage_row(930_002)
+        async with get_session() as writer:
+            await writer.execute(
+                update(DailyUsage)
+                .where(DailyUsage.id == row_id)
+                .values(used_requests=1)
+            )
+            # WAL: читатель видит последний коммит и не ждёт busy_timeout
+            seen = await asyncio.wait_for(_used(row_id, read_only=True), 1)
+            await writer.commit()
+        return seen, await _used(row_id, read_only=True)
+
+    assert run(scenario()) == (0, 1)
+
+
+def test_write_lock_is_taken_at_begin(run):
+    def foreign_begin() -> str:
+        # чужой процесс со своим соединением к тому же файлу
+        conn = sqlite3.connect(engine.url.database, timeout=0.05)
+        conn.isolation_level = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("ROLLBACK")
+            return "free"
+        except sqlite3.OperationalError as e:
+            return str(e)
+        finally:
+            conn.close()
+
+    async def scenario():
+        row_id = await _usage_row(930_003)
+        async with get_session() as session:
+            # только SELECT: обычный BEGIN ещё не взял бы блокировку записи
+            await _used_in(session, row_id)
+            during = foreign_begin()
+        return during, foreign_begin()
+
+    assert run(scenario()) == ("database is locked", "free")
+
+
+def test_writers_are_serialised(run):
+    increments = 20
+
+    async def writer(row_id: int) -> None:
+        for _ in range(increments):
+            async with get_session() as session:
+                # read-modify-write: без очереди писателей часть прибавлений
+                # потерялась бы или упала с «database is locked»
+                value = await _used_in(session, row_id)
+                await asyncio.sleep(0)
+                await session.execute(
+                    update(DailyUsage)
+                    .where(DailyUsage.id == row_id)
+                    .values(used_requests=value + 1)
+                )
+                await session.commit()
+
+    async def scenario():
+        row_id = await _usage_row(930_004)
+        await asyncio.gather(writer(row_id), writer(row_id))
+        return await _used(row_id)
+
+    assert run(scenario()) == 2 * increments
@@ -0,0 +1,75 @@
+from datetime import datetime
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+from sqlalchemy import select
+
+from app.config import settings
+from app.db.models import Task
+from app.db.session import get_session, init_db
+from app.services import solution_files
+from app.services.limits import get_or_create_user
+
+
+class FakeBot:
+    def __init__(self, stale: set[str]) -> None:
+        self.stale = stale
+        self.uploads = 0
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if isinstance(photo, str):
+            if photo in self.stale:
+                raise TelegramBadRequest(
+                    method=SendPhoto(chat_id=chat_id, photo=photo),
+                    message="wrong file identifier",
+                )
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+        self.uploads += 1
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="fresh")])
+
+
+def test_stale_file_id_is_forgotten(monkeypatch, run):
+    monkeypatch.setattr(solution_files, "render_solution_image", lambda text: b"png")
+
+    async def scenario():
+        await init_db()
+        now = datetime.now(ZoneInfo(settings.moscow_tz))
+        answer = "stale answer"
+        digest = solution_files.answer_hash(answer)
+        async with get_session() as session:
+            user = await get_or_create_user(session, 9001, None, now)
+            old = [
+                Task(
+                    user_id=user.id,
+                    created_at=now,
+                    answer_text=answer,
+                    answer_hash=digest,
+                    solution_file_id="old",
+                )
+                for _ in range(2)
+            ]
+            new = Task(user_id=user.id, created_at=now, answer_text=answer, answer_hash=digest)
+            session.add_all([*old, new])
+            await session.commit()
+
+        bot = FakeBot(stale={"old"})
+        prepared = await solution_files.prepare_solution(answer)
+        assert prepared.file_id == "old"
+        await solution_files.send_solution(bot, 1, prepared, answer, task_id=new.id)
+        assert bot.uploads == 1
+
+        async with get_session() as session:
+            file_ids = (
+                await session.execute(
+                    select(Task.solution_file_id).where(Task.answer_hash == digest)
+                )
+            ).scalars().all()
+        assert file_ids.count(None) == 2 and "fresh" in file_ids
+
+        # LRU пуст — свежий id должен найтись в БД, а не старый
+        solution_files._cache.clear()
+        assert await solution_files.find_file_id(digest) == "fresh"
+
+    run(scenario())
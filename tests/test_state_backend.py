@@ -0,0 +1,253 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Message, PhotoSize, User
+
+from app.middlewares.throttling import BucketRule, ThrottlingMiddleware
+from app.services.state_backend import InMemoryStateBackend, RedisStateBackend
+
+
+def _redis_factory():
+    """Реплики за балансировщиком: у каждой свой клиент, сервер Redis общий."""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def make():
+        return RedisStateBackend(
+            fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        )
+
+    return make
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_backend(request):
+    if request.param == "memory":
+        return InMemoryStateBackend
+    return _redis_factory()
+
+
+def test_values_set_many_delete(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        await backend.set_many({"a": "1", "b": "2", "c": "3"})
+        assert [await backend.get(k) for k in "abc"] == ["1", "2", "3"]
+        await backend.delete("a", "c", "missing")
+        assert [await backend.get(k) for k in "abc"] == [None, "2", None]
+
+        await backend.set_many({"t1": "x", "t2": "y"}, ttl=0.05)
+        assert await backend.get("t1") == "x"
+        await asyncio.sleep(0.08)
+        assert await backend.get("t1") is None
+        assert await backend.get("t2") is None
+
+        assert await backend.incr("n") == 1
+        assert await backend.incr("n", 4) == 5
+        await backend.close()
+
+    run(scenario())
+
+
+def test_take_token_bucket(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        args = dict(rate=1.0, burst=2, idle_ttl=60)
+        assert await backend.take_token("b", max_delay=0, **args) == 0.0
+        assert await backend.take_token("b", max_delay=0, **args) == 0.0
+        # корзина пуста: ждать ~1 с, и без резерва — max_delay меньше
+        refused = await backend.take_token("b", max_delay=0, **args)
+        assert 0.9 < refused <= 1.0
+        # с max_delay токен резервируется, следующий встаёт в очередь за ним
+        first = await backend.take_token("b", max_delay=5, **args)
+        second = await backend.take_token("b", max_delay=5, **args)
+        assert 0.9 < first <= 1.0
+        assert 1.9 < second <= 2.0
+        await backend.close()
+
+    run(scenario())
+
+
+def test_take_token_boost(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        args = dict(rate=0.001, burst=2, max_delay=0, idle_ttl=60, boost=3)
+
+        async def allowed(bucket: str, boost_key: str) -> int:
+            waits = [
+                await backend.take_token(bucket, boost_key=boost_key, **args)
+                for _ in range(10)
+            ]
+            return sum(wait == 0.0 for wait in waits)
+
+        assert await allowed("plain", "boost:none") == 2
+        await backend.set("boost:on", "1")
+        assert await allowed("boosted", "boost:on") == 6
+        # протухший буст не действует
+        await backend.set("boost:old", "1", ttl=0.01)
+        await asyncio.sleep(0.03)
+        assert await allowed("expired", "boost:old") == 2
+        await backend.close()
+
+    run(scenario())
+
+
+def test_lock_contention(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        async with backend.lock("job", timeout=10, wait=0) as acquired:
+            assert acquired
+            async with backend.lock("job", timeout=10, wait=0) as second:
+                assert not second
+            async with backend.lock("job", timeout=10, wait=0.05) as waited:
+                assert not waited
+        async with backend.lock("job", timeout=10, wait=0) as again:
+            assert again
+
+        async def holder():
+            async with backend.lock("job", timeout=10, wait=1):
+                await asyncio.sleep(0.05)
+
+        task = asyncio.create_task(holder())
+        await asyncio.sleep(0.01)
+        async with backend.lock("job", timeout=10, wait=1) as queued:
+            assert queued
+        await task
+        await backend.close()
+
+    run(scenario())
+
+
+def test_lock_expires_after_timeout(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        async with backend.lock("job", timeout=0.05, wait=0) as stale:
+            assert stale
+            # владелец «завис» дольше timeout — блокировку забирает следующий
+            await asyncio.sleep(0.1)
+            async with backend.lock("job", timeout=10, wait=0) as taken:
+                assert taken
+        async with backend.lock("job", timeout=10, wait=0) as after:
+            assert after
+        await backend.close()
+
+    run(scenario())
+
+
+def test_stale_owner_does_not_release_new_holder(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        cm = backend.lock("job", timeout=0.05, wait=0)
+        assert await cm.__aenter__()
+        await asyncio.sleep(0.1)
+        async with backend.lock("job", timeout=10, wait=0) as taken:
+            assert taken
+            await cm.__aexit__(None, None, None)
+            async with backend.lock("job", timeout=10, wait=0) as third:
+                assert not third
+        await backend.close()
+
+    run(scenario())
+
+
+def test_fsm_storage(make_backend, run):
+    async def scenario():
+        backend = make_backend()
+        storage = backend.fsm_storage()
+        key = StorageKey(bot_id=1, chat_id=5, user_id=5)
+        await storage.set_state(key, "AdminStates:waiting_broadcast_text")
+        await storage.set_data(key, {"step": 2})
+        assert await storage.get_state(key) == "AdminStates:waiting_broadcast_text"
+        assert await storage.get_data(key) == {"step": 2}
+        await storage.set_state(key, None)
+        assert await storage.get_state(key) is None
+        await backend.close()
+
+    run(scenario())
+
+
+def test_fsm_state_visible_on_every_replica(run):
+    make = _redis_factory()
+
+    async def scenario():
+        first, second = make(), make()
+        key = StorageKey(bot_id=1, chat_id=6, user_id=6)
+        await first.fsm_storage().set_state(key, "AdminStates:waiting_user_id_give")
+        # следующий апдейт админа балансировщик отдал другой реплике
+        assert (
+            await second.fsm_storage().get_state(key)
+            == "AdminStates:waiting_user_id_give"
+        )
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+def _photo(message_id: int, user_id: int) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="Test"),
+        photo=[
+            PhotoSize(
+                file_id=f"p{message_id}",
+                file_unique_id=f"u{message_id}",
+                width=1,
+                height=1,
+            )
+        ],
+    )
+
+
+async def _flood(backends, users: int = 20, photos: int = 24) -> int:
+    """Пользователи шлют фото, балансировщик раскидывает их по репликам по кругу."""
+    replicas = [
+        ThrottlingMiddleware(
+            backend=backend,
+            rules={"photo": BucketRule(rate=0.001, burst=5)},
+            max_delay=0,
+        )
+        for backend in backends
+    ]
+    passed = 0
+
+    async def handler(event, data):
+        nonlocal passed
+        passed += 1
+
+    await asyncio.gather(
+        *(
+            replicas[n % len(replicas)](
+                handler, _photo(user * 100 + n, 90_000 + user), {}
+            )
+            for n in range(photos)
+            for user in range(users)
+        )
+    )
+    return passed
+
+
+def test_one_and_four_replicas_share_limits(monkeypatch, run):
+    # без ответов в Telegram: выкинутые фото только считаем
+    async def no_answer(self, text, **kwargs):
+        return None
+
+    monkeypatch.setattr(Message, "answer", no_answer)
+
+    async def scenario():
+        one = _redis_factory()
+        four = _redis_factory()
+        return (
+            await _flood([one()]),
+            await _flood([four() for _ in range(4)]),
+            await _flood([InMemoryStateBackend() for _ in range(4)]),
+        )
+
+    one_replica, four_replicas, four_in_memory = run(scenario())
+    # 20 пользователей × burst 5 — столько же при любом числе реплик
+    assert one_replica == four_replicas == 100
+    # у реплик со своей памятью у каждой своя корзина — лимит растёт вчетверо
+    assert four_in_memory == 400
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from app.config import settings
+from app.db.models import Task, UsageRollup
+from app.db.session import get_session, init_db
+from app.services.limits import (
+    DailyLimitExceeded,
+    check_and_increment_daily_usage,
+    get_or_create_user,
+)
+from app.services.stats import ROLLUP_COUNTERS, bump_rollup, rebuild_rollup, record_usage
+
+
+def test_rebuild_matches_incremental_counters(run):
+    async def scenario():
+        await init_db()
+        tz = ZoneInfo(settings.moscow_tz)
+        # завтрашний день — чтобы не смешиваться со строками других тестов
+        now = datetime.now(tz) + timedelta(days=1)
+        day = now.date()
+        async with get_session() as session:
+            solver = await get_or_create_user(session, 9601, None, now)
+            blocked = await get_or_create_user(session, 9602, None, now)
+            await check_and_increment_daily_usage(session, solver, now, daily_limit=5)
+            session.add(
+                Task(
+                    user_id=solver.id,
+                    created_at=now,
+                    is_premium=False,
+                    prompt_tokens=100,
+                    completion_tokens=20,
+                )
+            )
+            await bump_rollup(
+                session, day, photos=1, cache_hits=1, prompt_tokens=100, completion_tokens=20
+            )
+            await session.commit()
+            # упёрся в лимит: в DAU попал, задачи нет
+            with pytest.raises(DailyLimitExceeded):
+                await check_and_increment_daily_usage(session, blocked, now, daily_limit=0)
+        await record_usage(day, rejected=1, errors=2)
+
+        async with get_session() as session:
+            incremental = await session.get(UsageRollup, day)
+            before = {name: getattr(incremental, name) for name in ROLLUP_COUNTERS}
+            rebuilt = await rebuild_rollup(session, day)
+            after = {name: getattr(rebuilt, name) for name in ROLLUP_COUNTERS}
+
+        assert before["active_users"] == 2
+        assert after == before
+
+    run(scenario())
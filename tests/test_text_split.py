@@ -0,0 +1,58 @@
+import pytest
+
+from app.services.text_split import (
+    EMPTY_ANSWER_TEXT,
+    TELEGRAM_MESSAGE_LIMIT,
+    answer_messages,
+    split_message,
+)
+
+
+def _utf16(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def test_exactly_limit_is_one_message():
+    text = "а" * TELEGRAM_MESSAGE_LIMIT
+    assert split_message(text) == [text]
+    assert split_message(text + "б") == [text, "б"]
+
+
+def test_paragraphs_are_kept_whole():
+    first, second = "x" * 3000, "y" * 3000
+    assert split_message(f"{first}\n\n{second}") == [first, second]
+    # строки длинного абзаца собираются обратно через \n
+    lines = ["строка " * 100] * 20
+    chunks = split_message("\n".join(lines))
+    assert all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    assert "\n".join(chunks) == "\n".join(lines).strip()
+
+
+def test_long_line_without_newlines_is_cut_hard():
+    text = "0123456789" * 1000
+    chunks = split_message(text)
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 1808]
+    assert "".join(chunks) == text
+
+
+@pytest.mark.parametrize("char", ["я", "√", "😀", "𝑥"])
+def test_multibyte_text_fits_telegram_limit(char):
+    text = char * 5000
+    chunks = split_message(text)
+    assert "".join(chunks) == text
+    # Telegram считает длину в UTF-16: эмодзи — две единицы
+    assert all(_utf16(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    assert _utf16(chunks[0]) >= TELEGRAM_MESSAGE_LIMIT - 1
+
+
+def test_empty_answer_gets_fallback():
+    assert split_message("  \n\n ") == []
+    assert answer_messages("  \n\n ") == [EMPTY_ANSWER_TEXT]
+
+
+def test_answer_is_escaped_after_split():
+    text = "x < 5 & y > 2 <b>не тег</b>\n\n" + "<" * TELEGRAM_MESSAGE_LIMIT
+    messages = answer_messages(text)
+    assert messages[0] == "x &lt; 5 &amp; y &gt; 2 &lt;b&gt;не тег&lt;/b&gt;"
+    # длина считается по видимому тексту, экранирование её не меняет
+    assert messages[1] == "&lt;" * TELEGRAM_MESSAGE_LIMIT
@@ -0,0 +1,85 @@
+import time
+from datetime import datetime
+
+from aiogram.types import Chat, Message, PhotoSize, User
+
+from app.middlewares.throttling import BucketRule, ThrottlingMiddleware
+from app.services.state_backend import InMemoryStateBackend
+
+# Антифлуд стоит перед каждым апдейтом: его цена должна теряться на фоне
+# хендлера. Порог с большим запасом, чтобы не зависеть от машины.
+OVERHEAD_UPDATES = 5000
+OVERHEAD_LIMIT_US = 200
+
+
+def _photo(message_id: int, user_id: int = 42) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="Test"),
+        media_group_id="album",
+        photo=[PhotoSize(file_id=f"p{message_id}", file_unique_id=f"u{message_id}", width=1, height=1)],
+    )
+
+
+def test_album_passes_and_overflow_gets_one_notice(monkeypatch, run):
+    replies: list[str] = []
+
+    async def fake_answer(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "answer", fake_answer)
+
+    async def scenario():
+        middleware = ThrottlingMiddleware(
+            backend=InMemoryStateBackend(),
+            rules={"photo": BucketRule(rate=0.2, burst=10)},
+            max_delay=2.0,
+        )
+        handled: list[int] = []
+
+        async def handler(event, data):
+            handled.append(event.message_id)
+
+        # полный альбом из 10 фото проходит без задержки
+        for message_id in range(10):
+            await middleware(handler, _photo(message_id), {})
+        assert handled == list(range(10))
+        assert not replies
+
+        # дальше — выкидываем, но предупреждаем один раз
+        for message_id in range(10, 13):
+            await middleware(handler, _photo(message_id), {})
+        assert handled == list(range(10))
+        assert middleware.stats.dropped == {"photo": 3}
+        assert len(replies) == 1
+
+    run(scenario())
+
+
+def test_per_update_overhead(run):
+    async def scenario():
+        middleware = ThrottlingMiddleware(
+            backend=InMemoryStateBackend(),
+            rules={"photo": BucketRule(rate=1e6, burst=1e6)},
+        )
+        events = [_photo(n, user_id=1000 + n % 50) for n in range(OVERHEAD_UPDATES)]
+
+        async def handler(event, data):
+            return None
+
+        started = time.perf_counter()
+        for event in events:
+            await handler(event, {})
+        bare = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for event in events:
+            await middleware(handler, event, {})
+        throttled = time.perf_counter() - started
+        return middleware.stats, (throttled - bare) / OVERHEAD_UPDATES * 1e6
+
+    stats, overhead_us = run(scenario())
+    assert stats.passed == {"photo": OVERHEAD_UPDATES}
+    assert overhead_us < OVERHEAD_LIMIT_US
@@ -0,0 +1,97 @@
+import asyncio
+import io
+import json
+import logging
+from datetime import datetime
+
+import pytest
+from aiogram.types import Chat, Message, Update, User
+
+from app.config import settings
+from app.middlewares.tracing import TracingMiddleware
+from app.services import tracing
+from app.services.tracing import span
+
+SLOW_MS = 50
+
+
+@pytest.fixture
+def slow_log(tmp_path, monkeypatch):
+    """setup_logging с отдельным slow-логом и stdout в буфер.
+    После теста логгеры как были."""
+    path = tmp_path / "slow.jsonl"
+    monkeypatch.setattr(settings, "slow_log_path", str(path))
+    monkeypatch.setattr(settings, "slow_update_ms", float(SLOW_MS))
+    monkeypatch.setattr(settings, "log_format", "json")
+    monkeypatch.setattr(settings, "trace_sample_rate", 1.0)
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    tracing.setup_logging()
+    stdout = io.StringIO()
+    root.handlers[0].setStream(stdout)
+    yield path, stdout
+    for handler in tracing.slow_logger.handlers[:]:
+        tracing.slow_logger.removeHandler(handler)
+        handler.close()
+    tracing.slow_logger.propagate = True
+    root.handlers[:], root.level = saved[0], saved[1]
+
+
+def _update(update_id: int) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=7, type="private"),
+            text="привет",
+        ),
+    )
+
+
+async def _handle(update_id: int, delay: float) -> str:
+    trace_ids = []
+
+    async def handler(event, data):
+        trace_ids.append(tracing.current_trace().trace_id)
+        with span("openai", model="test"):
+            await asyncio.sleep(delay)
+        logging.getLogger("app.test").info("handled")
+
+    user = User(id=7, is_bot=False, first_name="Test")
+    await TracingMiddleware()(handler, _update(update_id), {"event_from_user": user})
+    return trace_ids[0]
+
+
+def test_slow_update_goes_to_slow_log_only(slow_log, run):
+    path, stdout = slow_log
+    fast_id = run(_handle(1, 0))
+    slow_id = run(_handle(2, SLOW_MS * 2 / 1000))
+
+    (record,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert record["msg"] == "slow update"
+    assert record["trace_id"] == slow_id != fast_id
+    assert (record["update_id"], record["user_id"]) == (2, 7)
+    assert record["update_type"] == "message"
+    assert record["duration_ms"] >= SLOW_MS
+    (openai,) = record["spans"]
+    assert openai["name"] == "openai" and openai["attrs"] == {"model": "test"}
+    assert openai["duration_ms"] >= SLOW_MS
+
+    # в stdout обычные записи с trace_id, а slow-лог туда не дублируется
+    lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert [(r["msg"], r["trace_id"]) for r in lines] == [
+        ("handled", fast_id),
+        ("handled", slow_id),
+    ]
+
+
+def test_unsampled_trace_has_no_spans(slow_log, monkeypatch, run):
+    monkeypatch.setattr(settings, "trace_sample_rate", 0.0)
+    path, _ = slow_log
+    trace_id = run(_handle(3, SLOW_MS * 2 / 1000))
+
+    (record,) = [json.loads(line) for line in path.read_text().splitlines()]
+    assert record["trace_id"] == trace_id
+    assert record["sampled"] is False
+    assert "spans" not in record